@@ -3,13 +3,19 @@
 
 from __future__ import division
 from Bio import AlignIO
+from alignment_cache import alignment_cache_key, retrieve_alignment, store_alignment
+from alignment_matrix import alignment_matrix, codon_gap_masks, full_codon_columns, longest_gap_runs
+from codon_align import codon_align, CODON_ALIGN_VERSION
 from shared import create_directory, extract_archive_of_files, create_archive_of_files, parse_options, \
     CODON_TABLE_ID
 from scatterplot import scatterplot
-from versions import TRANSLATORX
+from versions import TRANSLATORX, aligner_version
+from multiprocessing import cpu_count, Pool
+from multiprocessing.pool import ThreadPool
 from operator import itemgetter
 from subprocess import check_call, STDOUT
 import logging as log
+import numpy
 import os
 import shutil
 import sys
@@ -19,18 +25,43 @@ __author__ = "Tim te Beek"
 __copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
 __license__ = "MIT"
 
+# Aligners available to create DNA level alignments of protein level aligned sequences
+ALIGNERS = ('translatorx', 'codon_align')
 
-def _align_sicos(run_dir, sico_files):
-    """Align all SICO files given as argument in parallel and return the resulting alignment files."""
-    log.info('Aligning {0} SICO genes using TranslatorX & muscle.'.format(len(sico_files)))
-    # We'll multiplex this embarrassingly parallel task using a pool of workers
-    return [_run_translatorx((run_dir, sico_file)) for sico_file in sico_files]
 
+def _align_sicos(run_dir, sico_files, jobs=1, aligner='translatorx'):
+    """Align all SICO files given as argument in parallel and return the resulting alignment files.
 
-def _run_translatorx((run_dir, sico_file), translation_table=CODON_TABLE_ID):
-    """Run TranslatorX to create DNA level alignment file of protein level aligned DNA sequences within sico_file."""
-    assert os.path.exists(TRANSLATORX) and os.access(TRANSLATORX, os.X_OK), 'Could not find or run ' + TRANSLATORX
+    Alignments are returned in the same order as sico_files, regardless of the number of jobs."""
+    assert aligner in ALIGNERS, 'Aligner should be one of {0}: {1}'.format(ALIGNERS, aligner)
+    log.info('Aligning {0} SICO genes using {1} in {2} jobs.'.format(len(sico_files), aligner, jobs))
+    tasks = [(run_dir, sico_file, aligner) for sico_file in sico_files]
+    if jobs <= 1:
+        return _report_progress(len(tasks), (_align_sico(task) for task in tasks))
+
+    # We'll multiplex this embarrassingly parallel task using a pool of workers: threads suffice when the work happens
+    # in TranslatorX subprocesses, whereas in process codon alignment needs worker processes
+    pool = ThreadPool(jobs) if aligner == 'translatorx' else Pool(jobs)
+    try:
+        # Ordered imap keeps output deterministic, while still allowing progress to be reported as alignments complete
+        return _report_progress(len(tasks), pool.imap(_align_sico, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _report_progress(total, alignments, every=100):
+    """Consume alignments into a list, logging progress every so many alignments and when done."""
+    completed = []
+    for dna_alignment in alignments:
+        completed.append(dna_alignment)
+        if len(completed) % every == 0 or len(completed) == total:
+            log.info('Aligned %d of %d SICO genes', len(completed), total)
+    return completed
 
+
+def _align_sico((run_dir, sico_file, aligner), translation_table=CODON_TABLE_ID):
+    """Create DNA level alignment file of protein level aligned DNA sequences within sico_file using aligner."""
     # Determine output file name
     sico_base = os.path.splitext(os.path.split(sico_file)[1])[0]
     alignment_dir = create_directory('alignments/' + sico_base, inside_dir=run_dir)
@@ -39,12 +70,41 @@ def _run_translatorx((run_dir, sico_file), translation_table=CODON_TABLE_ID):
     file_base = os.path.join(alignment_dir, sico_base)
     dna_alignment = file_base + '.nt_ali.fasta'
 
-    # Actually run the TranslatorX program
+    # Reuse the alignment of identical sequences from a previous run, as alignment does not depend on trim settings
+    # Alignments are cached by content, keyed by the versions of the aligners used as well
+    version = aligner_version() if aligner == 'translatorx' else CODON_ALIGN_VERSION
+    cache_key = alignment_cache_key(sico_file, translation_table, version)
+    if retrieve_alignment(cache_key, dna_alignment):
+        return dna_alignment
+
+    if aligner == 'translatorx':
+        _run_translatorx(sico_file, file_base, translation_table)
+    else:
+        codon_align(sico_file, dna_alignment, translation_table)
+
+    assert os.path.isfile(dna_alignment) and 0 < os.path.getsize(dna_alignment), \
+        'Alignment file should exist and have some content now: {0}'.format(dna_alignment)
+    store_alignment(cache_key, dna_alignment)
+    return dna_alignment
+
+
+def _run_translatorx(sico_file, file_base, translation_table=CODON_TABLE_ID):
+    """Run TranslatorX to create DNA level alignment file of protein level aligned DNA sequences within sico_file."""
+    assert os.path.exists(TRANSLATORX) and os.access(TRANSLATORX, os.X_OK), 'Could not find or run ' + TRANSLATORX
+    # Resolve paths before changing the working directory below, so relative paths still point to the same files
+    sico_file = os.path.abspath(sico_file)
+    file_base = os.path.abspath(file_base)
+    alignment_dir = os.path.dirname(file_base)
+    dna_alignment = file_base + '.nt_ali.fasta'
+
+    # Actually run the TranslatorX program, from within the alignment directory such that any intermediate files
+    # written to the working directory do not clash between simultaneous jobs
     command = [TRANSLATORX,
                '-i', sico_file,
                '-c', str(translation_table),
                '-o', file_base]
-    check_call(command, stdout=open('/dev/null', 'w'), stderr=STDOUT)
+    with open(os.devnull, 'w') as devnull:
+        check_call(command, stdout=devnull, stderr=STDOUT, cwd=alignment_dir)
 
     assert os.path.isfile(dna_alignment) and 0 < os.path.getsize(dna_alignment), \
         'Alignment file should exist and have some content now: {0}'.format(dna_alignment)
@@ -109,23 +169,22 @@ def _trim_alignment((trimmed_dir, dna_alignment, max_indel_length)):
     # After using protein alignment only for CDS, all alignment lengths should be multiples of three
     assert alignment_length % 3 == 0, 'Length not a multiple of three: {} \n{2}'.format(alignment_length, alignment)
 
+    # Load alignment as a byte matrix, so codons and gaps can be inspected for all sequences at once
+    matrix = alignment_matrix(alignment)
+
     # Assert all codons are either full length codons or gaps, but not a mix of gaps and letters such as AA- or A--
-    for index in range(0, alignment_length, 3):
-        for ali in alignment:
-            codon = ali.seq[index:index + 3]
-            assert not ('-' in codon and str(codon) != '---'), '{0} at {1} in \n{2}'.format(codon, index, alignment)
-
-    # Loop over alignment, taking 3 DNA characters each time, representing a single codon
-    first_full_codon_start = None
-    last_full_codon_end = None
-    for index in range(0, alignment_length, 3):
-        codon_concatemer = ''.join([str(seqr.seq) for seqr in alignment[:, index:index + 3]])
-        if '-' in codon_concatemer:
-            continue
-        if first_full_codon_start is None:
-            first_full_codon_start = index
-        else:
-            last_full_codon_end = index + 3
+    mixed = codon_gap_masks(matrix)[1]
+    if mixed.any():
+        row, codon_index = numpy.argwhere(mixed)[0]
+        index = codon_index * 3
+        codon = alignment[row].seq[index:index + 3]
+        raise AssertionError('{0} at {1} in \n{2}'.format(codon, index, alignment))
+
+    # Find the first and last codon without gaps across all sequences; a single full codon is trimmed from only the
+    # start
+    full_codons = full_codon_columns(matrix)
+    first_full_codon_start = int(full_codons[0]) * 3 if len(full_codons) else None
+    last_full_codon_end = int(full_codons[-1]) * 3 + 3 if 1 < len(full_codons) else None
 
     # Create sub alignment consisting of all trimmed sequences from full alignment
     trimmed = alignment[:, first_full_codon_start:last_full_codon_end]
@@ -142,7 +201,7 @@ def _trim_alignment((trimmed_dir, dna_alignment, max_indel_length)):
         'Expected trimmed alignment file to exist with some content now: {0}'.format(trimmed_file)
 
     # Filter out those alignment that contain an indel longer than N: return zero (0) as trimmed length & % retained 
-    if any('-' * max_indel_length in str(seqr.seq) for seqr in trimmed):
+    if (longest_gap_runs(matrix[:, first_full_codon_start:last_full_codon_end]) >= max_indel_length).any():
         return trimmed_file, alignment_length, 0, 0
 
     return trimmed_file, alignment_length, trimmed_length, trimmed_length / alignment_length * 100
@@ -160,16 +219,21 @@ Usage: filter_orthologs.py
 --trimmed-zip=FILE             destination file path for archive of aligned & trimmed orthologous genes
 --stats=FILE                   destination file path for ortholog trimming statistics file
 --scatterplot=FILE             destination file path for scatterplot of retained and filtered sequences by length
+--jobs=NUMBER                  optional number of simultaneous alignments, defaulting to the number of CPUs
+--aligner=NAME                 optional aligner: translatorx (default) or in process codon_align for short orthologs
 """
     options = ['orthologs-zip', 'retained-threshold', 'max-indel-length',
-               'aligned-zip', 'misaligned-zip', 'trimmed-zip', 'stats', 'scatterplot']
+               'aligned-zip', 'misaligned-zip', 'trimmed-zip', 'stats', 'scatterplot', 'jobs=?',
+               'aligner=?']
     orthologs_zip, retained_threshold, max_indel_length, \
-    aligned_zip, misaligned_zip, trimmed_zip, target_stats_path, target_scatterplot = \
+    aligned_zip, misaligned_zip, trimmed_zip, target_stats_path, target_scatterplot, jobs, aligner = \
         parse_options(usage, options, args)
 
     # Convert retained threshold to integer, so we can fail fast if argument value format was wrong
     retained_threshold = int(retained_threshold)
     max_indel_length = int(max_indel_length)
+    jobs = int(jobs) if jobs else cpu_count()
+    aligner = aligner or 'translatorx'
 
     # Run filtering in a temporary folder, to prevent interference from simultaneous runs
     run_dir = tempfile.mkdtemp(prefix='align_trim_')
@@ -179,7 +243,7 @@ Usage: filter_orthologs.py
     sico_files = extract_archive_of_files(orthologs_zip, temp_dir)
 
     # Align SICOs so all sequences become equal length sequences
-    aligned_files = _align_sicos(run_dir, sico_files)
+    aligned_files = _align_sicos(run_dir, sico_files, jobs, aligner)
 
     # Filter orthologs that retain less than PERC % of sequence after trimming alignment
     trimmed_files, misaligned_files = _trim_alignments(run_dir, aligned_files, retained_threshold, max_indel_length,
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Module to cache DNA alignments by the content of the orthologs aligned, so reruns with other trim settings skip
+realignment."""
+
+from Bio import SeqIO
+from genome_cache import default_manifest
+from shared import create_directory
+import hashlib
+import os
+import shutil
+import tempfile
+
+__author__ = "Tim te Beek"
+__copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
+__license__ = "MIT"
+
+
+def alignment_cache_key(sico_file, translation_table, aligner_version):
+    """Return a hash of the sorted sequences in sico_file, along with the translation table and aligner version.
+
+    Sequence headers are included, as they are carried over into the alignment, but their order in the file is not."""
+    records = sorted((seqr.description, str(seqr.seq).upper()) for seqr in SeqIO.parse(sico_file, 'fasta'))
+    sha1 = hashlib.sha1('{0}\n{1}\n'.format(translation_table, aligner_version))
+    for header, sequence in records:
+        sha1.update('>{0}\n{1}\n'.format(header, sequence))
+    return sha1.hexdigest()
+
+
+def _cache_path(key, cache_dir=None):
+    """Return the path of the cached alignment for key, within a subdirectory named after the first characters."""
+    cache_dir = cache_dir or create_directory('alignments')
+    return os.path.join(cache_dir, key[:2], key + '.nt_ali.fasta')
+
+
+def retrieve_alignment(key, dna_alignment, cache_dir=None, manifest=None):
+    """Copy the cached alignment for key to dna_alignment and return True, or return False when not cached."""
+    cached_file = _cache_path(key, cache_dir)
+    if not os.path.isfile(cached_file):
+        return False
+    shutil.copyfile(cached_file, dna_alignment)
+    (manifest or default_manifest()).record_hit('alignments', cached_file)
+    return True
+
+
+def store_alignment(key, dna_alignment, cache_dir=None, manifest=None):
+    """Store a copy of dna_alignment in the cache under key."""
+    cached_file = _cache_path(key, cache_dir)
+    if not os.path.isdir(os.path.dirname(cached_file)):
+        try:
+            os.makedirs(os.path.dirname(cached_file))
+        except OSError:
+            # Created by a simultaneous job in the meantime
+            assert os.path.isdir(os.path.dirname(cached_file))
+
+    # Copy to a temporary file first and rename, so simultaneous jobs never see an incomplete cached alignment
+    tmp_file = tempfile.mkstemp(suffix='.fasta', prefix=key, dir=os.path.dirname(cached_file))[1]
+    shutil.copyfile(dna_alignment, tmp_file)
+    os.rename(tmp_file, cached_file)
+    (manifest or default_manifest()).record_miss('alignments', cached_file)
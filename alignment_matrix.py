@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Module to represent sequence alignments as NumPy byte matrices, for array based operations on codons and gaps."""
+
+from Bio.Data import CodonTable
+from shared import CODON_TABLE_ID
+import numpy
+
+__author__ = "Tim te Beek"
+__copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
+__license__ = "MIT"
+
+GAP = ord('-')
+
+
+def alignment_matrix(alignment):
+    """Return the alignment as a (sequences x sites) matrix of unsigned bytes."""
+    sequences = [str(seqr.seq) for seqr in alignment]
+    return numpy.frombuffer(''.join(sequences), dtype=numpy.uint8).reshape(len(sequences), -1)
+
+
+def codon_gap_masks(matrix):
+    """Return two (sequences x codons) boolean masks: codons that are full gaps, and codons that mix gaps & letters."""
+    gaps = (matrix == GAP).reshape(matrix.shape[0], -1, 3)
+    any_gap = gaps.any(axis=2)
+    all_gap = gaps.all(axis=2)
+    return all_gap, any_gap & ~all_gap
+
+
+def full_codon_columns(matrix):
+    """Return the indices of codons that do not contain a gap in any of the sequences."""
+    gapped_codons = (matrix == GAP).reshape(matrix.shape[0], -1, 3).any(axis=2).any(axis=0)
+    return numpy.flatnonzero(~gapped_codons)
+
+
+def longest_gap_runs(matrix):
+    """Return the length of the longest run of consecutive gaps in each sequence of the matrix."""
+    rows = matrix.shape[0]
+    # Pad each row with non-gap sites on both ends, such that runs never span rows and every run has a start & end
+    padded = numpy.zeros((rows, matrix.shape[1] + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = matrix == GAP
+    edges = numpy.diff(padded.ravel())
+    starts = numpy.flatnonzero(edges == 1)
+    ends = numpy.flatnonzero(edges == -1)
+
+    # Assign the length of each run to the row it started in, keeping only the longest run per row
+    longest = numpy.zeros(rows, dtype=int)
+    numpy.maximum.at(longest, starts // padded.shape[1], ends - starts)
+    return longest
+
+
+def stop_codon_mask(matrix, table_id=CODON_TABLE_ID):
+    """Return a (sequences x codons) boolean mask of the full codons that are a stop codon in translation table
+    table_id.
+
+    Codons are compared as is, so codons with lowercase or ambiguous nucleotides never match a stop codon."""
+    stops = numpy.array([numpy.frombuffer(codon, dtype=numpy.uint8)
+                         for codon in CodonTable.unambiguous_dna_by_id[table_id].stop_codons])
+    codons = matrix[:, :matrix.shape[1] - matrix.shape[1] % 3].reshape(matrix.shape[0], -1, 1, 3)
+    return (codons == stops).all(axis=3).any(axis=2)
+
+
+def without_stop_codons(matrix, table_id=CODON_TABLE_ID):
+    """Return the matrix without the codons that are a stop codon in any of the sequences, in a single take.
+
+    Trailing sites that do not form a full codon are kept."""
+    keep = numpy.ones(matrix.shape[1], dtype=bool)
+    keep[:len(keep) - len(keep) % 3] = ~numpy.repeat(stop_codon_mask(matrix, table_id).any(axis=0), 3)
+    return matrix[:, keep]
+
+
+def codon_columns(codon_indices):
+    """Return the indices of the sites of the codons at codon_indices, in order."""
+    return (3 * numpy.asarray(codon_indices, dtype=int)[:, numpy.newaxis] + numpy.arange(3)).ravel()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Module to store all alignments of a dataset in a single memory mappable file, as an alternative to an archive of
+FASTA files that each step would otherwise extract and parse again.
+
+A store starts with a magic line, followed by a line with the size of a JSON index, the index itself, and a contiguous
+block of unsigned bytes holding the sequences of all alignments. The index lists for each alignment its name, the
+headers of its rows, and the offset, number of rows and length of its (rows x length) matrix within the block."""
+
+from Bio import AlignIO
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from alignment_matrix import alignment_matrix
+from shared import parse_options, parse_header, iterate_archive_of_files, create_archive_of_records
+import json
+import logging as log
+import numpy
+import os
+import shutil
+import sys
+import tempfile
+
+__author__ = "Tim te Beek"
+__copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
+__license__ = "MIT"
+
+MAGIC = 'ODOSE ALIGNMENT STORE 1\n'
+
+
+def write_store(store_file, alignments):
+    """Write the (name, alignment) pairs in alignments to store_file, and return the names of the alignments written.
+
+    Sequences are written to a temporary block file as they come, so only a single alignment is held in memory."""
+    index = []
+    offset = 0
+    with tempfile.TemporaryFile(prefix='alignment_store_') as block_handle:
+        for name, alignment in alignments:
+            matrix = alignment_matrix(alignment)
+            block_handle.write(matrix.tostring())
+            index.append({'name': name,
+                          'headers': [seqr.description for seqr in alignment],
+                          'offset': offset,
+                          'rows': matrix.shape[0],
+                          'length': matrix.shape[1]})
+            offset += matrix.size
+
+        # Write the index ahead of the block, so readers find alignments without scanning the block
+        header = json.dumps(index)
+        block_handle.seek(0)
+        with open(store_file, mode='wb') as write_handle:
+            write_handle.write(MAGIC)
+            write_handle.write('{0}\n'.format(len(header)))
+            write_handle.write(header)
+            shutil.copyfileobj(block_handle, write_handle)
+    return [entry['name'] for entry in index]
+
+
+class AlignmentStore(object):
+    """Read only access to the alignments in a store file, as zero-copy views on a memory mapped block of sequences."""
+
+    def __init__(self, store_file):
+        with open(store_file, mode='rb') as read_handle:
+            assert read_handle.readline() == MAGIC, 'Not an alignment store: ' + store_file
+            header = read_handle.read(int(read_handle.readline()))
+            block_offset = read_handle.tell()
+        self.index = json.loads(header)
+        # JSON decodes to unicode, while names and headers are handled as byte strings throughout
+        for entry in self.index:
+            entry['name'] = entry['name'].encode('utf-8')
+            entry['headers'] = [header.encode('utf-8') for header in entry['headers']]
+        self.entries = dict((entry['name'], entry) for entry in self.index)
+
+        # Memory map the block of sequences, which can not be done for an empty block
+        if os.path.getsize(store_file) > block_offset:
+            self.block = numpy.memmap(store_file, dtype=numpy.uint8, mode='r', offset=block_offset)
+        else:
+            self.block = numpy.zeros(0, dtype=numpy.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    @property
+    def names(self):
+        """Return the names of all alignments in the order they were written."""
+        return [entry['name'] for entry in self.index]
+
+    def headers(self, name):
+        """Return the FASTA headers of the rows of alignment name."""
+        return self.entries[name]['headers']
+
+    def genomes(self, name):
+        """Return the genome of each of the rows of alignment name, as parsed from the FASTA headers."""
+        return [parse_header(header.split()[0]).genome for header in self.headers(name)]
+
+    def matrix(self, name):
+        """Return the (rows x length) matrix of unsigned bytes of alignment name, as a view without copying."""
+        entry = self.entries[name]
+        size = entry['rows'] * entry['length']
+        return self.block[entry['offset']:entry['offset'] + size].reshape(entry['rows'], entry['length'])
+
+    def rows(self, name, genome_ids):
+        """Return the rows of the matrix of alignment name for the genomes in genome_ids, in order of the alignment."""
+        selected = [index for index, genome in enumerate(self.genomes(name)) if genome in genome_ids]
+        return self.matrix(name)[selected]
+
+    def alignment(self, name):
+        """Return alignment name as MultipleSeqAlignment, for steps that operate on Biopython alignments."""
+        return MultipleSeqAlignment(SeqRecord(Seq(row.tostring()), id=header.split()[0], description=header)
+                                    for header, row in zip(self.headers(name), self.matrix(name)))
+
+
+def store_from_archive(archive_file, store_file):
+    """Convert an archive of FASTA alignments into a store, named after the files in the archive, and return the names.
+
+    Alignments are parsed directly from the archive, without extracting them to disk."""
+    return write_store(store_file, ((filename, AlignIO.read(read_handle, 'fasta'))
+                                    for filename, read_handle in iterate_archive_of_files(archive_file)))
+
+
+def archive_from_store(store_file, archive_file):
+    """Convert a store back into an archive of FASTA alignments, with a file per alignment named as in the store."""
+    store = AlignmentStore(store_file)
+    return create_archive_of_records(archive_file, ((name, store.alignment(name)) for name in store))
+
+
+def main(args):
+    """Main function called when run from command line or as part of pipeline."""
+    usage = """
+Usage: alignment_store.py
+--orthologs-zip=FILE    archive of aligned single copy orthologous (SICO) genes
+--alignment-store=FILE  store of all alignments in a single memory mappable file
+--to-zip                convert the alignment store into the orthologs archive, instead of the reverse
+"""
+    options = ['orthologs-zip', 'alignment-store', 'to-zip?']
+    orthologs_zip, alignment_store, to_zip = parse_options(usage, options, args)
+
+    # Convert in either direction
+    if to_zip:
+        names = archive_from_store(alignment_store, orthologs_zip)
+        log.info('Wrote %i alignments to %s', len(names), orthologs_zip)
+    else:
+        names = store_from_archive(orthologs_zip, alignment_store)
+        log.info('Wrote %i alignments to %s', len(names), alignment_store)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
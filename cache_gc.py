@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Module to evict least recently used genomes, translations, alignments and PhiPack values from the cache."""
+
+import argparse
+import logging
+import os
+import re
+
+from genome_cache import default_manifest
+from shared import create_directory
+
+
+__author__ = "Tim te Beek"
+__copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
+__license__ = "MIT"
+
+# Cache trees subject to eviction; files directly inside the cache directory, such as prokaryotes.txt, are kept
+CACHE_TREES = ('genomes', 'translations', 'alignments', 'phipack')
+
+_SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(size):
+    """Return the number of bytes in a human readable size such as 500M or 20G."""
+    match = re.match(r'^(\d+(?:\.\d+)?)\s*([KMGT]?)B?$', size.strip().upper())
+    if not match:
+        raise ValueError('Could not parse size: ' + size)
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def cached_files(manifest, trees=CACHE_TREES):
+    """Return tuples of last access time, size and path for all files in trees, least recently used first.
+
+    Files without any recorded access, such as those cached before access tracking, fall back to their mtime."""
+    last_accesses = manifest.last_accesses()
+    entries = []
+    for tree in trees:
+        for dirpath, _, filenames in os.walk(create_directory(tree)):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                last_access = last_accesses.get(os.path.abspath(path)) or os.path.getmtime(path)
+                entries.append((last_access, os.path.getsize(path), path))
+    return sorted(entries)
+
+
+def collect_garbage(budget, manifest=None, trees=CACHE_TREES, dry_run=False):
+    """Evict least recently used files from trees until their combined size is within budget bytes.
+
+    Return the list of evicted paths, and the total size of the remaining files."""
+    manifest = manifest or default_manifest()
+    entries = cached_files(manifest, trees)
+    total_size = sum(size for _, size, _ in entries)
+
+    evicted = []
+    for _, size, path in entries:
+        if total_size <= budget:
+            break
+        logging.info('Evicting %s (%d bytes)', path, size)
+        if not dry_run:
+            os.remove(path)
+            manifest.forget(path)
+            _remove_empty_directory(os.path.dirname(path))
+        evicted.append(path)
+        total_size -= size
+
+    return evicted, total_size
+
+
+def _remove_empty_directory(directory):
+    """Remove a genome project or other cache subdirectory once its last file has been evicted."""
+    if not os.listdir(directory):
+        os.rmdir(directory)
+
+
+def _parse_args():
+    '''
+    Parse required arguments.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('budget',
+                        help='Maximum combined size of cached files, such as 500M or 20G',
+                        type=parse_size)
+    parser.add_argument('--dry-run',
+                        help='Only report which files would be evicted',
+                        action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    '''
+    Report cache hit rates, and evict least recently used files until the cache is within the size budget.
+    '''
+    # Parse arguments
+    args = _parse_args()
+
+    # Report hit rates, which help in sizing the budget: lower hit rates after eviction suggest a larger budget
+    manifest = default_manifest()
+    for tree, (hits, misses, rate) in sorted(manifest.hit_rates().iteritems()):
+        logging.info('Cache %s: %d hits, %d misses, %.1f%% hit rate', tree, hits, misses, rate * 100)
+
+    # Evict files
+    evicted, total_size = collect_garbage(args.budget, manifest, dry_run=args.dry_run)
+    logging.info('Evicted %d files, leaving %d bytes in cache', len(evicted), total_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,16 +13,21 @@ from __future__ import division
 from Bio import AlignIO
 from Bio.Align import MultipleSeqAlignment
 from Bio.Data import CodonTable
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from alignment_matrix import alignment_matrix, stop_codon_mask, codon_columns
 from argparse import ArgumentParser, RawDescriptionHelpFormatter, ArgumentTypeError
-from collections import Counter, defaultdict
+from array import array
+from collections import Counter, OrderedDict, defaultdict, namedtuple
 from shared import CODON_TABLE_ID, find_cogs_in_sequence_records, get_most_recent_gene_name, \
-    extract_archive_of_files, create_directory
-from run_codeml import run_codeml, parse_codeml_output
-from run_phipack import run_phipack
+    extract_archive_of_files, create_directory, parse_header, GenomeRanking
+from run_codeml import pairwise_dnds_for_all, ESTIMATORS
+from run_phipack import run_phipack_for_all
 from select_taxa import select_genomes_by_ids
 from itertools import product
-from numpy import mean
 from random import choice
+from string import Formatter
+import numpy
 import logging
 import os
 import re
@@ -38,6 +43,9 @@ __updated__ = '2013-02-11'
 
 DEBUG = 0
 
+# Number of orthologs whose alignments are held in memory at once, while calculating their codeml values simultaneously
+ORTHOLOGS_PER_BATCH = 100
+
 # Premise
 # - Some duplication is OK if it helps clarity
 # - Do not repeatedly pass around the same arguments
@@ -142,12 +150,18 @@ def _get_column_headers(max_nton):
     return headers
 
 
-def _write_intro_to_file(table_a_dest):
-    '''Explain the presence of three tables in one file if we're also calculating odd & even codons'''
+def _write_intro_to_file(table_a_dest, partition_name='odd-even'):
+    '''Explain the presence of multiple tables in one file if we're also calculating over parts of the codons'''
     with open(table_a_dest, 'w') as write_handle:
-        write_handle.write('''#First table contains calculations for all codon
+        write_handle.write('#First table contains calculations for all codon')
+        if partition_name == 'odd-even':
+            write_handle.write('''
 #Second table contains calculations for odd codons only
 #Third table contains calculations for even codons only''')
+        else:
+            write_handle.write('''
+#Following tables contain calculations for each part of the {} codon partition, as prefixed to the ortholog'''.format(
+                partition_name))
 
 
 def _write_to_file(table_a_dest,
@@ -167,40 +181,82 @@ def _write_to_file(table_a_dest,
     :param common_prefix_b:
     :type common_prefix_b: string
     :param calculations:
-    :type calculations: list of clade_calcs instances
+    :type calculations: iterable of OrthologRecord instances or values dictionaries, written out as they are produced
     '''
     with open(table_a_dest, 'a') as write_handle:
-        # Print introduction about the strain comparison
-        write_handle.write('#{} {} strains compared with {} {} strains\n'.format(len(genome_ids_a),
-                                                                                 common_prefix_a,
-                                                                                 len(genome_ids_b),
-                                                                                 common_prefix_b))
-        # Print the genome IDs involved in each of the strains
-        write_handle.write('#IDs {}: {}\n'.format(common_prefix_a,
-                                                  ', '.join(genome_ids_a)))
-        write_handle.write('#IDs {}: {}\n'.format(common_prefix_b,
-                                                  ', '.join(genome_ids_b)))
-
-        # Print column headers for the data to come
-        max_nton = len(genome_ids_a) // 2
-        headers = _get_column_headers(max_nton)
-        write_handle.write('#' + '\t'.join(headers))
-        write_handle.write('\n')
+        headers = _write_table_header(write_handle, genome_ids_a, genome_ids_b, common_prefix_a, common_prefix_b)
 
         # Print data rows
+        for row in calculations:
+            _write_table_row(write_handle, headers, row)
+
+
+def _write_table_header(write_handle, genome_ids_a, genome_ids_b, common_prefix_a, common_prefix_b):
+    '''Write the introduction and column headers of a table to write_handle, and return the column headers.'''
+    # Print introduction about the strain comparison
+    write_handle.write('#{} {} strains compared with {} {} strains\n'.format(len(genome_ids_a),
+                                                                             common_prefix_a,
+                                                                             len(genome_ids_b),
+                                                                             common_prefix_b))
+    # Print the genome IDs involved in each of the strains
+    write_handle.write('#IDs {}: {}\n'.format(common_prefix_a,
+                                              ', '.join(genome_ids_a)))
+    write_handle.write('#IDs {}: {}\n'.format(common_prefix_b,
+                                              ', '.join(genome_ids_b)))
+
+    # Print column headers for the data to come
+    max_nton = len(genome_ids_a) // 2
+    headers = _get_column_headers(max_nton)
+    write_handle.write('#' + '\t'.join(headers))
+    write_handle.write('\n')
+    return headers
+
+
+def _write_table_row(write_handle, headers, row):
+    '''Write a single OrthologRecord or values dictionary to write_handle, as a row of a table with headers.'''
+    if isinstance(row, OrthologRecord):
+        write_handle.write(row.row())
+    else:
         format_str = '\t'.join('{{{}}}'.format(key) for key in headers)
-        from string import Formatter
-        formatter = Formatter()
-        for clade_calcs in calculations:
-            write_handle.write(formatter.vformat(format_str, None, clade_calcs.values))
-            write_handle.write('\n')
+        write_handle.write(Formatter().vformat(format_str, None, row))
+    write_handle.write('\n')
+
+
+def _write_tables_per_part(table_dest,
+                           genome_ids_a,
+                           genome_ids_b,
+                           common_prefix_a,
+                           common_prefix_b,
+                           calculations):
+    '''Write a table for each part of calculations to table_dest, in the order in which parts first occur.
+
+    Rows of the first part, the full alignments, are written out directly as they are produced. Rows of any other part
+    are written to a temporary file per part as they are produced, which are appended to table_dest at the end.'''
+    with open(table_dest, 'a') as write_handle:
+        part_handles = OrderedDict()
+        try:
+            for part, row in calculations:
+                if part not in part_handles:
+                    # Write the first part to the destination, and any further parts to a temporary file of their own
+                    handle = write_handle if not part_handles else tempfile.TemporaryFile(prefix='calculations_part_')
+                    headers = _write_table_header(handle, genome_ids_a, genome_ids_b, common_prefix_a, common_prefix_b)
+                    part_handles[part] = handle
+                _write_table_row(part_handles[part], headers, row)
+
+            # Append the tables of further parts in order
+            for handle in part_handles.values()[1:]:
+                handle.seek(0)
+                shutil.copyfileobj(handle, write_handle)
+        finally:
+            for handle in part_handles.values()[1:]:
+                handle.close()
 
 
 def _extract_cog_digits_and_letters(clade_calcs):
-    '''Add the COG digits and letters to the clade_calcs.values dictionary for all strains in clade_calcs.alignment.'''
+    '''Add the COG digits and letters to the clade_calcs.values dictionary for all strains in clade_calcs.headers.'''
     cog_digits = []
     cog_letters = []
-    for cog in find_cogs_in_sequence_records(clade_calcs.alignment):
+    for cog in find_cogs_in_sequence_records(clade_calcs.headers):
         # Match digits and letters separately
         matchobj = re.match('(COG[0-9]+)([A-Z]*)', cog)
         if matchobj:
@@ -211,19 +267,18 @@ def _extract_cog_digits_and_letters(clade_calcs):
     clade_calcs.values[COG_LETTERS] = ','.join(cog_letters)
 
 
-def _get_codeml_values(alignment_a, alignment_b):
-    '''Get the codeml values for running the first sequences of both alignment a & b through codeml and return dict.'''
-    # Run codeml to calculate values for dn & ds
-    subdir = tempfile.mkdtemp(prefix='codeml_')
-    codeml_file = run_codeml(subdir, alignment_a, alignment_b)
-    codeml_values_dict = parse_codeml_output(codeml_file)
-    shutil.rmtree(subdir)
+def _get_codeml_values(alignment_pairs, estimator='codeml'):
+    '''Get the codeml values for running the first sequences of each pair of alignments a & b through codeml
+    simultaneously, and return a dict per pair.'''
+    # Run codeml or its in process alternative to calculate values for dn & ds
+    all_codeml_values = pairwise_dnds_for_all(alignment_pairs, estimator)
 
-    # convert poorly legible keys to better ones
-    codeml_values_dict[NON_SYNONYMOUS_SITES] = codeml_values_dict['N']
-    codeml_values_dict[SYNONYMOUS_SITES] = codeml_values_dict['S']
+    for codeml_values_dict in all_codeml_values:
+        # convert poorly legible keys to better ones
+        codeml_values_dict[NON_SYNONYMOUS_SITES] = codeml_values_dict['N']
+        codeml_values_dict[SYNONYMOUS_SITES] = codeml_values_dict['S']
 
-    return codeml_values_dict
+    return all_codeml_values
 
 
 def _calc_pi(nr_of_strains, nr_of_sites, site_freq_spec):
@@ -266,57 +321,59 @@ FOUR_FOLD_DEGENERATE_PATTERN = '({onetwo})[{three}]'.format(onetwo='|'.join(sort
                                                             three=BACTERIAL_CODON_TABLE.nucleotide_alphabet.letters)
 
 
-def _codon_site_freq_spec(clade_calcs):
-    '''Site frequency spectrum calculations for full, syn, non-syn and 4-fold syn sites.'''
-    four_fold_synonymous_sites = 0
-    multiple_site_polymorphisms = 0
-    mixed_synonymous_polymorphisms = 0
-
-    stop_codons = 0
-    codons_with_unresolved_bases = 0
+# Kinds of codon columns, which determine to which counts and SFS the polymorphisms of a codon contribute
+INVARIANT = 'invariant'
+UNRESOLVED = 'unresolved'
+STOP = 'stop'
+MULTIPLE = 'multiple'
+SYNONYMOUS = 'synonymous'
+NON_SYNONYMOUS = 'non-synonymous'
+MIXED = 'mixed'
 
-    global_sfs = defaultdict(int)
+# Classification of a single codon column, with the SFS of its polymorphic site if any
+CodonClass = namedtuple('CodonClass', 'kind four_fold local_sfs')
 
-    synonymous_sfs = defaultdict(int)
-    non_synonymous_sfs = defaultdict(int)
-    four_fold_syn_sfs = defaultdict(int)
 
+def _classify_codons(alignment):
+    '''Classify each full codon column of alignment in a single pass, such that the site frequency spectra of any
+    subset of codons can be summed from the classifications.'''
     # Calculate sequence_lengths here so we can handle alignments that are not multiples of three
-    sequence_lengths = clade_calcs.sequence_lengths - clade_calcs.sequence_lengths % 3
+    sequences = [str(seqr.seq) for seqr in alignment]
+    sequence_lengths = len(sequences[0]) - len(sequences[0]) % 3
+
+    # Find codons that are a stop codon in any of the sequences at once for the whole alignment
+    stop_codon_columns = stop_codon_mask(alignment_matrix(alignment), CODON_TABLE_ID).any(axis=0)
 
-    # Split into codon_alignments
-    codon_alignments = (clade_calcs.alignment[:, index:index + 3] for index in range(0, sequence_lengths, 3))
-    for codon_alignment in codon_alignments:
+    classes = []
+    for codon_index, index in enumerate(range(0, sequence_lengths, 3)):
         # Get string representations of codons for simplicity
-        codons = [str(seqr.seq) for seqr in codon_alignment]
+        codons = [sequence[index:index + 3] for sequence in sequences]
 
         # Skip when all codons are the same
         if len(set(codons)) == 1:
-            # Increase number of four fold synonymous sites if the codons match; No SFS to add as all codons are equal
-            if re.match(FOUR_FOLD_DEGENERATE_PATTERN, codons[0]):
-                four_fold_synonymous_sites += 1
+            # Four fold synonymous site if the codons match; No SFS to add as all codons are equal
+            classes.append(CodonClass(INVARIANT, bool(re.match(FOUR_FOLD_DEGENERATE_PATTERN, codons[0])), None))
             continue
 
         # As per AEW: Skip codons with gaps, and codons with unresolved bases: Basically anything but ACGT
         if 0 < len(''.join(codons).translate(None, 'ACGTactg')):
-            codons_with_unresolved_bases += 1
+            classes.append(CodonClass(UNRESOLVED, False, None))
             continue
 
         # Skip codons where any of the alignment codons is a stopcodon, same as in codeml
-        for codon in codons:
-            if codon in BACTERIAL_CODON_TABLE.stop_codons:
-                stop_codons += 1
-                continue
+        if stop_codon_columns[codon_index]:
+            classes.append(CodonClass(STOP, False, None))
+            continue
 
         # Determine variation per site
-        per_site_usage = [Counter(codon_alignment[:, site]) for site in range(3)]
+        per_site_usage = [Counter(codon[site] for codon in codons) for site in range(3)]
 
         # Determine which sites contain polymorphisms
         polymorph_site_usages = [usage for usage in per_site_usage if 1 < len(usage)]
 
         # Skip codons where multiple sites contain polymorphisms
         if 1 < len(polymorph_site_usages):
-            multiple_site_polymorphisms += 1
+            classes.append(CodonClass(MULTIPLE, False, None))
             continue
 
         # Extract the polymorphic site
@@ -333,34 +390,68 @@ def _codon_site_freq_spec(clade_calcs):
             else:
                 local_sfs[counts] += 1
 
-        def add_dict_to_dict(target, source):
-            '''Add values from source to target'''
-            for key, value in source.iteritems():
-                target[key] += value
-
-        # Global SFS takes it values from the local SFS, no further filtering applied
-        add_dict_to_dict(global_sfs, local_sfs)
-
         # Retrieve translations of codons now that inconclusive & stop-codons have been removed
         translations = Counter(BACTERIAL_CODON_TABLE.forward_table.get(codon) for codon in codons)
 
         if len(translations) == 1:
-            # All mutations are synonymous
-            add_dict_to_dict(synonymous_sfs, local_sfs)
-
-            # Check if these codons also match the four fold synonymous pattern
-            if all(re.match(FOUR_FOLD_DEGENERATE_PATTERN, codon) for codon in codons):
-                four_fold_synonymous_sites += 1
-                add_dict_to_dict(four_fold_syn_sfs, local_sfs)
+            # All mutations are synonymous; Check if these codons also match the four fold synonymous pattern
+            four_fold = all(re.match(FOUR_FOLD_DEGENERATE_PATTERN, codon) for codon in codons)
+            classes.append(CodonClass(SYNONYMOUS, four_fold, local_sfs))
+        elif len(translations) == len(polymorph_site_usage):
+            # Multiple translations, one per change in base
+            classes.append(CodonClass(NON_SYNONYMOUS, False, local_sfs))
         else:
-            if len(translations) == len(polymorph_site_usage):
-                # Multiple translations, one per change in base
-                add_dict_to_dict(non_synonymous_sfs, local_sfs)
-            else:
-                # Number of translations & number of different bases do not match: Both syn and non syn changes found
-                mixed_synonymous_polymorphisms += 1
+            # Number of translations & number of different bases do not match: Both syn and non syn changes found
+            classes.append(CodonClass(MIXED, False, local_sfs))
+
+    return classes
+
+
+def _codon_site_freq_spec(clade_calcs, codon_classes=None, codon_indices=None):
+    '''Site frequency spectrum calculations for full, syn, non-syn and 4-fold syn sites.
+
+    Calculations are restricted to codon_indices when given, from codon_classes classified once for the full
+    alignment.'''
+    if codon_classes is None:
+        codon_classes = _classify_codons(clade_calcs.alignment)
+    if codon_indices is None:
+        codon_indices = range(len(codon_classes))
+
+    global_sfs = defaultdict(int)
+
+    synonymous_sfs = defaultdict(int)
+    non_synonymous_sfs = defaultdict(int)
+    four_fold_syn_sfs = defaultdict(int)
+
+    def add_dict_to_dict(target, source):
+        '''Add values from source to target'''
+        for key, value in source.iteritems():
+            target[key] += value
+
+    # Tally the kinds of codons, and sum the local SFS of polymorphic codons
+    kinds = Counter()
+    four_fold_synonymous_sites = 0
+    for codon_index in codon_indices:
+        codon_class = codon_classes[codon_index]
+        kinds[codon_class.kind] += 1
+        if codon_class.four_fold:
+            four_fold_synonymous_sites += 1
+        if codon_class.local_sfs is None:
+            continue
 
-        # Implicitly continue with next iteration
+        # Global SFS takes it values from the local SFS, no further filtering applied
+        add_dict_to_dict(global_sfs, codon_class.local_sfs)
+        if codon_class.kind == SYNONYMOUS:
+            add_dict_to_dict(synonymous_sfs, codon_class.local_sfs)
+            if codon_class.four_fold:
+                add_dict_to_dict(four_fold_syn_sfs, codon_class.local_sfs)
+        elif codon_class.kind == NON_SYNONYMOUS:
+            add_dict_to_dict(non_synonymous_sfs, codon_class.local_sfs)
+
+    multiple_site_polymorphisms = kinds[MULTIPLE]
+    mixed_synonymous_polymorphisms = kinds[MIXED]
+    stop_codons = kinds[STOP]
+    codons_with_unresolved_bases = kinds[UNRESOLVED]
 
     # Add SFS & Pi calculations to values dictionary
     # Synonymous
@@ -460,31 +551,55 @@ class Statistic(object):
         self.values[ORTHOLOG] = name
 
 
-def _calculcate_mean_and_averages(calculations, max_nton):
-    '''Calculate the sum and mean data rows for a subset of numerical data columns, and append them to calculations.'''
-    headers = _get_column_headers(max_nton)
-
-    # calculate the sum for a subset of headers
-    sum_stats = Statistic('sum')
-    for header in headers[5:-2]:
-        sum_stats.values[header] = sum(clade_calcs.values[header]
-                                       for clade_calcs in calculations
-                                       if clade_calcs.values[header] is not None)
-
-    # calculate the average for a subset of headers
-    mean_stats = Statistic('mean')
-    for header in headers[5:-2] + [DOS]:
-        # XXX fromnumeric.py:37: RuntimeWarning: invalid value encountered in double_scalars
-        mean_stats.values[header] = mean([clade_calcs.values[header]
-                                          for clade_calcs in calculations
-                                          if clade_calcs.values[header] is not None])
-
-    # append statistics now that we're no longer looping over them
-    return sum_stats, mean_stats
+class ResultsTable(object):
+    '''Running sums and counts of the numeric values of all orthologs per column, from which the sum and mean rows are
+    derived, with missing values left out. Only the NI parts of orthologs are kept, for the bootstrap of the NI rows.'''
+    def __init__(self, schema):
+        self.schema = schema
+        self.sum_headers = schema.headers[5:-2]
+        self.mean_headers = schema.headers[5:-2] + [DOS]
+        # fields and optional SFS index of the numeric values for each of the mean headers
+        self.fields = [schema.nton_columns.get(header, (header, None)) for header in self.mean_headers]
+        self.sums = numpy.zeros(len(self.mean_headers))
+        self.counts = numpy.zeros(len(self.mean_headers), dtype=int)
+        self.x_values = array('d')
+        self.y_values = array('d')
+
+    def add(self, record):
+        '''Add the numeric values of a single OrthologRecord to the running sums and counts.'''
+        numbers = record.numbers
+        values = numpy.array([numbers[field] if index is None else numbers[field][index]
+                              for field, index in self.fields], dtype=float)
+        present = ~numpy.isnan(values)
+        self.sums += numpy.where(present, values, 0)
+        self.counts += present
+
+        # NI parts of orthologs are kept in order, leaving out missing values
+        for ni_values, header in ((self.x_values, DS_PN_PS_DS), (self.y_values, DN_PS_PS_DS)):
+            if not numpy.isnan(numbers[header]):
+                ni_values.append(numbers[header])
+
+    def statistics(self):
+        '''Return the sum, mean and neutrality index statistics over all orthologs added.'''
+        # calculate the sum for a subset of headers, where counts are summed as integers
+        sum_stats = Statistic('sum')
+        for column, header in enumerate(self.sum_headers):
+            integer = header in COUNT_COLUMNS or header in NULLABLE_COUNT_COLUMNS or header in self.schema.nton_columns
+            sum_stats.values[header] = int(self.sums[column]) if integer else self.sums[column]
+
+        # calculate the average for a subset of headers, which is not a number when there are no values
+        mean_stats = Statistic('mean')
+        for column, header in enumerate(self.mean_headers):
+            count = self.counts[column]
+            mean_stats.values[header] = self.sums[column] / count if count else float('nan')
+
+        # neutrality index calculation and bootstrapping, over the NI parts of orthologs in order
+        return (sum_stats, mean_stats) + _neutrality_indices(self.x_values, self.y_values)
 
 
 def _bootstrap(sum_dspn, sum_dnps):
-    """Bootstrap by gene to get to confidence scores for Neutrality Index."""
+    """Bootstrap by gene to get to confidence scores for Neutrality Index, or None when the Neutrality Index is not
+    defined for all samples."""
     def _sample_with_replacement(sample_set, sample_size=None):
         """Sample sample_size items from sample_set, or len(sample_set) items if sample_size is None (default)."""
         if sample_size is None:
@@ -500,8 +615,12 @@ def _bootstrap(sum_dspn, sum_dnps):
     # interval van be obtained by sorting the values and taking the 25t and 975th values"
     ni_values = []
     while len(ni_values) < len(sum_dspn):
-        ni_values.append(sum(_sample_with_replacement(sum_dspn)) /
-                         sum(_sample_with_replacement(sum_dnps)))
+        sample_dspn = sum(_sample_with_replacement(sum_dspn))
+        sample_dnps = sum(_sample_with_replacement(sum_dnps))
+        # Dropping samples with a zero divisor would bias the limits, so these leave the limits undefined instead
+        if not sample_dnps:
+            return None
+        ni_values.append(sample_dspn / sample_dnps)
 
     # 95 percent of values fall between n*.025th element & n*.975th element when NI values are sorted
     ni_values = sorted(ni_values)
@@ -510,17 +629,9 @@ def _bootstrap(sum_dspn, sum_dnps):
     return ni_values[lower_limit], ni_values[upper_limit]
 
 
-def _neutrality_indices(calculations):
+def _neutrality_indices(x_values, y_values):
     '''Return the statistics for Neutrality index. It adds the actual value, and two bootstrapped 95% values.'''
     # Neutrality Index = Sum(X = Ds*Pn/(Ps+Ds)) / Sum(Y = Dn*Ps/(Ps+Ds))
-
-    x_values = [clade_calcs.values[DS_PN_PS_DS]
-                for clade_calcs in calculations
-                if clade_calcs.values[DS_PN_PS_DS] is not None]
-    y_values = [clade_calcs.values[DN_PS_PS_DS]
-                for clade_calcs in calculations
-                if clade_calcs.values[DN_PS_PS_DS] is not None]
-
     sum_x = sum(x_values)
     sum_y = sum(y_values)
 
@@ -532,9 +643,17 @@ def _neutrality_indices(calculations):
         ni_stats.values[NEUTRALITY_INDEX] = sum_x / sum_y
 
         # Find lower and upper limits within which 95% of values fall, by using bootstrapping statistics
-        lower_95perc_limit, upper_95perc_limit = _bootstrap(x_values, y_values)
-        ni_lower_stats.values[NEUTRALITY_INDEX] = lower_95perc_limit
-        ni_upper_stats.values[NEUTRALITY_INDEX] = upper_95perc_limit
+        limits = _bootstrap(x_values, y_values)
+        if limits is not None:
+            lower_95perc_limit, upper_95perc_limit = limits
+            ni_lower_stats.values[NEUTRALITY_INDEX] = lower_95perc_limit
+            ni_upper_stats.values[NEUTRALITY_INDEX] = upper_95perc_limit
+        else:
+            # This happens for few genes, such as in small parts of the codons
+            msg = 'Failed to bootstrap Neutrality index limits because divisor Sum(Dn*Ps/(Ps+Ds)) was zero in a sample'
+            logging.warn(msg)
+            ni_lower_stats.values[NEUTRALITY_INDEX] = msg
+            ni_upper_stats.values[NEUTRALITY_INDEX] = msg
     else:
         # We could not calculate Neutrality index because Sum(Y = Dn*Ps/(Ps+Ds)) was zero
         msg = 'Failed to calculate Neutrality index because divisor Sum(Dn*Ps/(Ps+Ds)) was zero'
@@ -548,15 +667,18 @@ class clade_calcs(object):
     '''Perform the calculations specific a single clade.'''
 
     alignment = None
+    headers = None
     nr_of_strains = None
     sequence_lengths = None
 
     values = None
 
-    def __init__(self, alignment, genomes):
+    def __init__(self, alignment, genomes, headers=None, sequence_lengths=None):
         self.alignment = alignment
+        self.headers = headers if headers is not None else [parse_header(seqr.description) for seqr in alignment]
         self.nr_of_strains = len(alignment)
-        self.sequence_lengths = len(alignment[0])
+        # Calculations over a part of the codons cover fewer sites than the full alignment
+        self.sequence_lengths = sequence_lengths if sequence_lengths is not None else len(alignment[0])
 
         self.values = defaultdict(int)
 
@@ -564,71 +686,223 @@ class clade_calcs(object):
         self.values[CODONS] = self.sequence_lengths // 3
 
         # Get the most recent gene name for the strains in a given clade_calcs instance
-        self.values[PRODUCT] = get_most_recent_gene_name(genomes, self.alignment)
-
-
-def _table_calculations(genome_ids_a, genome_ids_b, sico_files, phipack_values):
-    '''Perform calculations for comparsion of genome_ids_a with genome_ids_b.'''
-    # retrieve genomes once for both
-    genomes_a = select_genomes_by_ids(genome_ids_a).values()
-
-    # dictionary to hold the values calculated per file
-    calculations = []
-    # loop over orthologs
-    for sico_file in sico_files:
-        # parse alignment
-        alignment = AlignIO.read(sico_file, 'fasta')
-
-        # split alignments
-        alignment_a = MultipleSeqAlignment(seqr for seqr in alignment if seqr.id.split('|')[0] in genome_ids_a)
-        alignment_b = MultipleSeqAlignment(seqr for seqr in alignment if seqr.id.split('|')[0] in genome_ids_b)
-
-        # calculate codeml values
-        codeml_values = _get_codeml_values(alignment_a, alignment_b)
-
-        # create gathering instance of clade_calcs
-        instance = clade_calcs(alignment_a, genomes_a)
-
-        # store ortholog name retrieved from filename
-        ortholog = os.path.basename(sico_file).split('.')[0]
-        instance.values[ORTHOLOG] = ortholog
-
-        # add codeml_values to clade_calcs instance values
-        instance.values.update(codeml_values)
-
-        # add phipack values for this file
-        instance.values.update(phipack_values[sico_file])
-
-        # add COG digits and letters
-        _extract_cog_digits_and_letters(instance)
-
-        # add SFS related values
-        _codon_site_freq_spec(instance)
-
-        # add additional deduced calculation
-        _add_combined_calculations(instance)
-
-        # store the clade_calc values
-        calculations.append(instance)
-
-    # calculcate mean and averages
-    max_nton = len(genome_ids_a) // 2
-    sum_stats, mean_stats = _calculcate_mean_and_averages(calculations, max_nton)
-
-    # neutrality index calculation and bootstrapping
-    ni_stats, ni_lower_stats, ni_upper_stats = _neutrality_indices(calculations)
-
-    # finally append statistics to calculations so they show up in file
-    calculations.extend((sum_stats, mean_stats, ni_stats, ni_lower_stats, ni_upper_stats))
-
-    return calculations
+        self.values[PRODUCT] = get_most_recent_gene_name(genomes, self.headers)
+
+
+# Text columns are kept as they are, while the remaining columns of ortholog rows are stored in a structured array
+TEXT_COLUMNS = (ORTHOLOG, PRODUCT, COG_DIGITS, COG_LETTERS)
+# Numeric columns holding counts are stored as integers, and all others as floats, with NaN for missing values
+COUNT_COLUMNS = frozenset([CODONS, NON_SYNONYMOUS_POLYMORPHISMS, SYNONYMOUS_POLYMORPHISMS,
+                           FOUR_FOLD_SYNONYMOUS_SITES, FOUR_FOLD_SYNONYMOUS_POLYMORPHISMS,
+                           MULTIPLE_SITE_POLYMORPHISMS, COMPLEX_CODONS])
+# PhiPack sites are a count, but missing when PhiPack fails, so stored as float and written as integer
+NULLABLE_COUNT_COLUMNS = frozenset([PHIPACK_SITES])
+SFS_COLUMNS = (NON_SYNONYMOUS_SFS, SYNONYMOUS_SFS, FOUR_FOLD_SYNONYMOUS_SFS)
+
+
+class RecordSchema(object):
+    '''Fixed schema of ortholog records for a given max_nton, with each SFS stored as a vector of max_nton counts.'''
+    def __init__(self, max_nton):
+        self.headers = _get_column_headers(max_nton)
+        # Map each named n-ton column onto its SFS vector and index
+        self.nton_columns = dict((_get_nton_name(number, sfs + ' '), (sfs, number - 1))
+                                 for sfs in SFS_COLUMNS for number in range(1, max_nton + 1))
+
+        # Neutrality index is only calculated over all orthologs, while the NI parts are kept for that calculation
+        fields = [(header, 'i8' if header in COUNT_COLUMNS else 'f8')
+                  for header in self.headers[len(TEXT_COLUMNS):-2] if header not in self.nton_columns]
+        fields += [(DOS, 'f8'), (DS_PN_PS_DS, 'f8'), (DN_PS_PS_DS, 'f8')]
+        fields += [(sfs, 'i8', (max_nton,)) for sfs in SFS_COLUMNS]
+        self.dtype = numpy.dtype(fields)
+
+
+class OrthologRecord(object):
+    '''Compact result of calculations for a single ortholog, following a RecordSchema.'''
+    __slots__ = ('schema', 'text', 'numbers')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.text = tuple(values[column] for column in TEXT_COLUMNS)
+        self.numbers = numpy.zeros(1, dtype=schema.dtype)[0]
+        for name in schema.dtype.names:
+            if name in SFS_COLUMNS:
+                vector = self.numbers[name]
+                for nton, count in values[name].iteritems():
+                    vector[nton - 1] = count
+            else:
+                value = values[name]
+                self.numbers[name] = numpy.nan if value is None else value
+
+    def value(self, header):
+        '''Return the value for header, with None for missing values, as it was in the clade_calcs values.'''
+        if header in TEXT_COLUMNS:
+            return self.text[TEXT_COLUMNS.index(header)]
+        if header in self.schema.nton_columns:
+            sfs, index = self.schema.nton_columns[header]
+            return self.numbers[sfs][index]
+        if header == NEUTRALITY_INDEX:
+            return 0
+        value = self.numbers[header]
+        if header in COUNT_COLUMNS:
+            return value
+        if numpy.isnan(value):
+            return None
+        return int(value) if header in NULLABLE_COUNT_COLUMNS else float(value)
+
+    def row(self):
+        '''Return the values of all columns formatted as tab separated row, as for the clade_calcs values.'''
+        return '\t'.join('{}'.format(self.value(header)) for header in self.schema.headers)
+
+
+def whole_partition(codons):
+    '''Partition codons into a single unnamed part, for calculations over the full alignment.'''
+    return [(None, None)]
+
+
+def odd_even_partition(codons):
+    '''Partition codons into odd and even codons, counting codons from one, to get independent axis when graphing
+    data.'''
+    return [('odd', numpy.arange(0, codons, 2)), ('even', numpy.arange(1, codons, 2))]
+
+
+def thirds_partition(codons):
+    '''Partition codons into the first, middle and last third of the gene.'''
+    return zip(('first_third', 'middle_third', 'last_third'), numpy.array_split(numpy.arange(codons), 3))
+
+
+def sliding_window_partition(size, step=None):
+    '''Return a function to partition codons into windows of size codons, starting every step codons.'''
+    step = step or size
+    assert 0 < size and 0 < step, 'Window size and step should be positive: {} {}'.format(size, step)
+
+    def _windows(codons):
+        '''Partition codons into windows, followed by a window over the last size codons when the last full window
+        ends before the last codon, such that codons after the last full window are covered as well. Genes shorter than
+        a single window are left out, as their windows would not line up with those of other genes.'''
+        if codons < size:
+            return []
+        windows = [('codons_{}-{}'.format(start + 1, start + size), numpy.arange(start, start + size))
+                   for start in range(0, codons - size + 1, step)]
+        if (codons - size) % step:
+            windows.append(('last_{}_codons'.format(size), numpy.arange(codons - size, codons)))
+        return windows
+    return _windows
+
+# Partitions of codons available from the command line, besides sliding windows
+PARTITIONS = {'odd-even': odd_even_partition, 'thirds': thirds_partition}
+
+
+def _codons_alignment(alignment, codon_indices):
+    """Return the alignment of the codons at codon_indices of alignment, in a single take from its byte matrix."""
+    matrix = alignment_matrix(alignment)[:, codon_columns(codon_indices)]
+    return MultipleSeqAlignment(SeqRecord(Seq(row.tostring()), id=seqr.id, description=seqr.description)
+                                for row, seqr in zip(matrix, alignment))
+
+
+def _partition_calculations(genome_ids_a, genome_ids_b, sico_files, phipack_values, estimator='codeml',
+                            partition=None):
+    '''Perform calculations for comparsion of genome_ids_a with genome_ids_b, over the full alignments and each part of
+    the codons as given by partition.
+
+    A tuple of part name and OrthologRecord is yielded per part of each ortholog as soon as it is calculated, followed
+    by the summary statistics values per part. The full alignments are the part named None. Orthologs are processed in
+    batches for codeml, so only the alignments of a single batch are held in memory at any time. Codons are classified
+    once per ortholog for the SFS of all parts, while PhiPack values are only given for the full alignments.'''
+    # retrieve genomes once for both, ranked by date once for all orthologs
+    genomes_a = GenomeRanking(select_genomes_by_ids(genome_ids_a).values())
+
+    # columnar table of numeric values for the summary statistics per part, as all other values are dropped after
+    # yielding them
+    schema = RecordSchema(len(genome_ids_a) // 2)
+    statistics = OrderedDict()
+
+    # loop over orthologs in batches, splitting the alignments of a batch first to calculate codeml values in one go
+    for start in range(0, len(sico_files), ORTHOLOGS_PER_BATCH):
+        split_alignments = []
+        for sico_file in sico_files[start:start + ORTHOLOGS_PER_BATCH]:
+            # parse alignment
+            alignment = AlignIO.read(sico_file, 'fasta')
+
+            # parse headers once, and split alignments
+            headers = [parse_header(seqr.description) for seqr in alignment]
+            headers_a = [header for header in headers if header.genome in genome_ids_a]
+            alignment_a = MultipleSeqAlignment(seqr for seqr, header in zip(alignment, headers)
+                                               if header.genome in genome_ids_a)
+            alignment_b = MultipleSeqAlignment(seqr for seqr, header in zip(alignment, headers)
+                                               if header.genome in genome_ids_b)
+
+            # the full alignment followed by the parts of the codons with at least a single codon
+            codons = alignment.get_alignment_length() // 3
+            parts = whole_partition(codons)
+            if partition is not None:
+                parts += [(part, codon_indices) for part, codon_indices in partition(codons) if len(codon_indices)]
+            split_alignments.append((sico_file, headers_a, alignment_a, alignment_b, parts))
+
+        # calculate codeml values for the representatives of each part of each ortholog
+        pairs = [(alignment_a, alignment_b) if codon_indices is None else
+                 (_codons_alignment(alignment_a[:1], codon_indices), _codons_alignment(alignment_b[:1], codon_indices))
+                 for _, _, alignment_a, alignment_b, parts in split_alignments for _, codon_indices in parts]
+        all_codeml_values = iter(_get_codeml_values(pairs, estimator))
+
+        for sico_file, headers_a, alignment_a, _, parts in split_alignments:
+            # classify codons once for all parts
+            codon_classes = _classify_codons(alignment_a)
+
+            for part, codon_indices in parts:
+                # create gathering instance of clade_calcs
+                sequence_lengths = None if codon_indices is None else 3 * len(codon_indices)
+                instance = clade_calcs(alignment_a, genomes_a, headers_a, sequence_lengths)
+
+                # store ortholog name retrieved from filename, prefixed with the part of the codons if any
+                ortholog = os.path.basename(sico_file).split('.')[0]
+                if part is not None:
+                    ortholog = part + '_' + ortholog
+                instance.values[ORTHOLOG] = ortholog
+
+                # add codeml_values to clade_calcs instance values
+                instance.values.update(next(all_codeml_values))
+
+                # add phipack values for this file, which are only calculated for the full alignment
+                if codon_indices is None:
+                    instance.values.update(phipack_values[sico_file])
+                else:
+                    instance.values.update(dict.fromkeys((PHIPACK_SITES, PHI, MAX_CHI_2, NSS)))
+
+                # add COG digits and letters
+                _extract_cog_digits_and_letters(instance)
+
+                # add SFS related values
+                _codon_site_freq_spec(instance, codon_classes, codon_indices)
+
+                # add additional deduced calculation
+                _add_combined_calculations(instance)
+
+                # keep only a compact record of the clade_calc values, to add to the statistics and hand out to be
+                # written
+                record = OrthologRecord(schema, instance.values)
+                statistics.setdefault(part, ResultsTable(schema)).add(record)
+                yield part, record
+
+    # finally yield sum, mean and neutrality index statistics per part so they show up in file
+    for part, results in statistics.iteritems():
+        for statistic in results.statistics():
+            yield part, statistic.values
+
+
+def _table_calculations(genome_ids_a, genome_ids_b, sico_files, phipack_values, estimator='codeml'):
+    '''Perform calculations for comparsion of genome_ids_a with genome_ids_b over the full alignments, yielding an
+    OrthologRecord per ortholog as soon as it is calculated, followed by the summary statistics values.'''
+    calculations = _partition_calculations(genome_ids_a, genome_ids_b, sico_files, phipack_values, estimator)
+    return (row for _, row in calculations)
 
 
 def run_calculations(genomes_a_file,
                      genomes_b_file,
                      sico_files,
                      table_a_dest,
-                     table_b_dest):
+                     table_b_dest,
+                     estimator='codeml',
+                     partition=None):
     '''Perform all calculations as requested through command line arguments'''
     # parse genomes in genomes_x_files
     genome_ids_a, common_prefix_a = _extract_genome_ids_and_common_prefix(genomes_a_file)
@@ -642,103 +916,59 @@ def run_calculations(genomes_a_file,
                           for sico_file in sico_files}
     else:
         phipack_dir = tempfile.mkdtemp(prefix='phipack_')
-        phipack_values = {sico_file:
-                          run_phipack(phipack_dir, sico_file)
-                          for sico_file in sico_files}
+        phipack_values = dict(zip(sico_files, run_phipack_for_all(phipack_dir, sico_files)))
         shutil.rmtree(phipack_dir)
 
-    # per table calculations
+    # per table calculations, with separate tables for each part of the codons following the table for all codons
     if 1 < len(genome_ids_a):
-        calculations_ab = _table_calculations(genome_ids_a, genome_ids_b, sico_files, phipack_values)
-        _write_to_file(table_a_dest,
-                       genome_ids_a, genome_ids_b,
-                       common_prefix_a, common_prefix_b,
-                       calculations_ab)
+        calculations_ab = _partition_calculations(genome_ids_a, genome_ids_b, sico_files, phipack_values,
+                                                  estimator, partition)
+        _write_tables_per_part(table_a_dest,
+                               genome_ids_a, genome_ids_b,
+                               common_prefix_a, common_prefix_b,
+                               calculations_ab)
     else:
         with open(table_a_dest, 'w') as write_handle:
             write_handle.write('#At least two genomes are needed to calculate diversity, not ' + str(len(genome_ids_a)))
 
     if 1 < len(genome_ids_b):
-        calculations_ba = _table_calculations(genome_ids_b, genome_ids_a, sico_files, phipack_values)
-        _write_to_file(table_b_dest,
-                       genome_ids_b, genome_ids_a,
-                       common_prefix_b, common_prefix_a,
-                       calculations_ba)
+        calculations_ba = _partition_calculations(genome_ids_b, genome_ids_a, sico_files, phipack_values,
+                                                  estimator, partition)
+        _write_tables_per_part(table_b_dest,
+                               genome_ids_b, genome_ids_a,
+                               common_prefix_b, common_prefix_a,
+                               calculations_ba)
     else:
         with open(table_b_dest, 'w') as write_handle:
             write_handle.write('#At least two genomes are needed to calculate diversity, not ' + str(len(genome_ids_b)))
 
 
-def _every_other_codon_alignments(alignment):
-    """Separate alignment into separate alignments per codon, to get independent axis when graphing data."""
-    # Calculate sequence_length to use when splitting MSA into codons
-    sequence_lengths = len(alignment[0]) - len(alignment[0]) % 3
-    alignment_codons = [alignment[:, index:index + 3] for index in range(0, sequence_lengths, 3)]
-
-    def _concat_codons_to_alignment(codons):
-        """Concatenate codons as Bio.Align.MultipleSeqAlignment to one another to create a composed MSA."""
-        alignment = codons[0]
-        for codon in codons[1:]:
-            alignment += codon
-        return alignment
-
-    # Odd alignments are the sum of the odd codons
-    ali_odd = _concat_codons_to_alignment([codon for index, codon in enumerate(alignment_codons, 1) if index % 2 == 1])
-    # Even alignments are the sum of the even codons
-    ali_even = _concat_codons_to_alignment([codon for index, codon in enumerate(alignment_codons, 1) if index % 2 == 0])
-    return ali_odd, ali_even
-
-
-def _split_by_odd_even_codons(sico_files):
-    '''Split each sequence in each sico file by odd and even codons and write them out to separate files.'''
-    odd_sico_files = []
-    even_sico_files = []
-
-    for sico_file in sico_files:
-        # split alignments and store them in separate files
-        alignment = AlignIO.read(sico_file, 'fasta')
-        odd_alignment, even_alignment = _every_other_codon_alignments(alignment)
-
-        # compose new unique filenames
-        dirname, basename = os.path.split(sico_file)
-        odd_file = os.path.join(dirname, 'odd_' + basename)
-        even_file = os.path.join(dirname, 'even_' + basename)
-
-        # store the split alignments in separate files
-        AlignIO.write(odd_alignment, odd_file, 'fasta')
-        AlignIO.write(even_alignment, even_file, 'fasta')
-
-        # safe the references to the new files
-        odd_sico_files.append(odd_file)
-        even_sico_files.append(even_file)
-
-    return odd_sico_files, even_sico_files
-
-
 def _prepare_calculations(genomes_a_file,
                           genomes_b_file,
                           sicozip_file,
                           table_a_dest,
                           table_b_dest,
-                          append_odd_even=False):
-    '''Unzip sico_files, and if needed create temporary files for the odd/even only codons.'''
-    if append_odd_even:
-        # prepend file makeup when odd/even table are also added
-        _write_intro_to_file(table_a_dest)
-        _write_intro_to_file(table_b_dest)
+                          partition_name=None,
+                          estimator='codeml',
+                          window_size=None,
+                          window_step=None):
+    '''Unzip sico_files, and perform calculations on them, optionally also for each part of a codon partition.'''
+    partition = None
+    if partition_name:
+        # prepend file makeup when tables for parts of the codons are also added
+        _write_intro_to_file(table_a_dest, partition_name)
+        _write_intro_to_file(table_b_dest, partition_name)
+        if partition_name == 'windows':
+            partition = sliding_window_partition(window_size, window_step)
+        else:
+            partition = PARTITIONS[partition_name]
 
     # extract ortholog files from sicozip
     rundir = tempfile.mkdtemp(prefix='calculations_')
     sico_files = extract_archive_of_files(sicozip_file, create_directory('sicos', inside_dir=rundir))
 
-    # perform normal calculation
-    run_calculations(genomes_a_file, genomes_b_file, sico_files, table_a_dest, table_b_dest)
-
-    # separate calculations for odd and even tables
-    if append_odd_even:
-        odd_sico_files, even_sico_files = _split_by_odd_even_codons(sico_files)
-        run_calculations(genomes_a_file, genomes_b_file, odd_sico_files, table_a_dest, table_b_dest)
-        run_calculations(genomes_a_file, genomes_b_file, even_sico_files, table_a_dest, table_b_dest)
+    # perform normal calculation, along with the calculations for each part of the codons if requested
+    run_calculations(genomes_a_file, genomes_b_file, sico_files, table_a_dest, table_b_dest, estimator, partition)
 
     # clean up
     shutil.rmtree(rundir)
@@ -772,6 +1002,11 @@ USAGE
                 return argument
             raise ArgumentTypeError('File {} is not {}'.format(argument, mode))
 
+        def positive_int(argument):
+            if argument.isdigit() and 0 < int(argument):
+                return int(argument)
+            raise ArgumentTypeError('{} is not a positive integer'.format(argument))
+
         # Arguments specific to calculations
         parser.add_argument('--genomes-a', nargs=1, type=test_file_readable, required=True,
                             help='Tab separated values file with Genome IDs of clade A')
@@ -784,8 +1019,20 @@ USAGE
         parser.add_argument('--table-b', nargs=1, default='table-b.tsv',
                             help='Destination output file path for comparison of clade B with clade A')
 
-        parser.add_argument('-a', '--append-odd-even', action='store_true',
-                            help='append separate tables calculated for odd and even codons of ortholog alignments (default: False)')
+        partition_group = parser.add_mutually_exclusive_group()
+        partition_group.add_argument('-a', '--append-odd-even', action='store_true',
+                                     help='append separate tables calculated for odd and even codons of ortholog '
+                                     'alignments (default: False)')
+        partition_group.add_argument('--partition', choices=sorted(PARTITIONS) + ['windows'],
+                                     help='append separate tables calculated for each part of the codons of ortholog '
+                                     'alignments')
+        parser.add_argument('--window-size', type=positive_int, default=50,
+                            help='number of codons per window for the windows partition (default: %(default)s)')
+        parser.add_argument('--window-step', type=positive_int,
+                            help='number of codons between the starts of windows (default: window size)')
+        parser.add_argument('--dnds-estimator', choices=ESTIMATORS, default='codeml',
+                            help='estimate dN/dS with codeml or in process with Nei-Gojobori counting '
+                            '(default: %(default)s)')
 
         # Process arguments
         args = parser.parse_args(argv)
@@ -800,7 +1047,10 @@ USAGE
                               args.sico_zip[0],
                               args.table_a[0],
                               args.table_b[0],
-                              args.append_odd_even)
+                              'odd-even' if args.append_odd_even else args.partition,
+                              args.dnds_estimator,
+                              args.window_size,
+                              args.window_step)
 
         return 0
     except KeyboardInterrupt:
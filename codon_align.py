@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""Module to align coding sequences in process: translate, align proteins progressively and back-thread codons.
+
+This avoids the Perl startup, temporary files and muscle subprocesses of TranslatorX, which dominate for short SICOs."""
+
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.SubsMat.MatrixInfo import blosum62
+from shared import CODON_TABLE_ID
+import argparse
+import logging as log
+import numpy
+import os
+import shutil
+import tempfile
+import time
+
+__author__ = "Tim te Beek"
+__copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
+__license__ = "MIT"
+
+# Included in alignment cache keys, so cached alignments are invalidated when the scoring below changes
+CODON_ALIGN_VERSION = 'codon_align 1.0; BLOSUM62; linear gap 8'
+
+_ALPHABET = 'ARNDCQEGHILKMFPSTWYVBZX*-'
+_GAP_PENALTY = 8
+_DIAG, _UP, _LEFT = 0, 1, 2
+
+
+def _substitution_matrix():
+    """Return BLOSUM62 as a symmetric matrix over _ALPHABET, where stops only score positively against stops.
+
+    Residues aligned to gaps already present within a profile are penalized, so new gaps are not hidden in gappy
+    columns; gaps aligned to gaps are free."""
+    matrix = numpy.empty((len(_ALPHABET), len(_ALPHABET)))
+    matrix.fill(-4)
+    for (first, second), score in blosum62.iteritems():
+        matrix[_ALPHABET.index(first), _ALPHABET.index(second)] = score
+        matrix[_ALPHABET.index(second), _ALPHABET.index(first)] = score
+    matrix[-2, -2] = 4
+    matrix[-1, :] = matrix[:, -1] = -_GAP_PENALTY / 2
+    matrix[-1, -1] = 0
+    return matrix
+
+_SCORES = _substitution_matrix()
+
+# Lookup table from byte value to index in _ALPHABET, where any unknown residue maps to X
+_INDEX = numpy.empty(256, dtype=int)
+_INDEX.fill(_ALPHABET.index('X'))
+for _index, _residue in enumerate(_ALPHABET):
+    _INDEX[ord(_residue)] = _index
+
+
+def _profile(proteins):
+    """Return the (columns x alphabet) residue and gap frequency matrix of equal length aligned proteins."""
+    indices = _INDEX[numpy.frombuffer(''.join(proteins), dtype=numpy.uint8)].reshape(len(proteins), -1)
+    columns = numpy.tile(numpy.arange(indices.shape[1]), len(proteins))
+    counts = numpy.zeros((indices.shape[1], len(_ALPHABET)))
+    numpy.add.at(counts, (columns, indices.ravel()), 1)
+    return counts / len(proteins)
+
+
+def _align_profiles(first, second):
+    """Align two groups of aligned proteins using Needleman-Wunsch on their profiles, and return the merged group."""
+    scores = _profile(first).dot(_SCORES).dot(_profile(second).T)
+    rows, cols = scores.shape
+
+    # Fill the dynamic programming matrix row by row; within a row, diagonal and vertical moves are independent
+    pointers = numpy.empty((rows + 1, cols + 1), dtype=numpy.int8)
+    pointers[0, :] = _LEFT
+    pointers[:, 0] = _UP
+    offsets = _GAP_PENALTY * numpy.arange(cols + 1)
+    previous = -offsets.astype(float)
+    for row in range(1, rows + 1):
+        diagonal = previous[:-1] + scores[row - 1]
+        vertical = previous[1:] - _GAP_PENALTY
+        current = numpy.empty(cols + 1)
+        current[0] = -_GAP_PENALTY * row
+        current[1:] = numpy.maximum(diagonal, vertical)
+        pointers[row, 1:] = numpy.where(diagonal >= vertical, _DIAG, _UP)
+
+        # Horizontal moves chain within a row; with linear gaps they reduce to a running maximum, which is compared
+        # before subtracting the offsets again, to prevent rounding errors from introducing spurious horizontal moves
+        shifted = current + offsets
+        best = numpy.maximum.accumulate(shifted)
+        pointers[row, 1:][best[1:] > shifted[1:]] = _LEFT
+        previous = best - offsets
+
+    # Trace back from the bottom right corner to pair up columns of both groups, where None indicates a gap column
+    pairs = []
+    row, col = rows, cols
+    while row or col:
+        move = pointers[row, col]
+        if move == _DIAG:
+            row, col = row - 1, col - 1
+            pairs.append((row, col))
+        elif move == _UP:
+            row -= 1
+            pairs.append((row, None))
+        else:
+            col -= 1
+            pairs.append((None, col))
+    pairs.reverse()
+
+    # Merge both groups by inserting gap columns where the other group advanced
+    merged = [''.join('-' if index is None else protein[index] for index, _ in pairs) for protein in first]
+    merged += [''.join('-' if index is None else protein[index] for _, index in pairs) for protein in second]
+    return merged
+
+
+def _kmer_distance(first, second, k=2):
+    """Return the fraction of k-mers not shared between two unaligned proteins."""
+    kmers_first = set(first[i:i + k] for i in range(len(first) - k + 1))
+    kmers_second = set(second[i:i + k] for i in range(len(second) - k + 1))
+    return 1 - len(kmers_first & kmers_second) / float(min(len(kmers_first), len(kmers_second)) or 1)
+
+
+def align_proteins(proteins):
+    """Align proteins and return the aligned proteins in input order.
+
+    Identical proteins are returned as they are; otherwise they are aligned progressively along a UPGMA guide tree of
+    k-mer distances, merging the two closest groups at each step. Proteins of equal length are aligned as well, as they
+    can still differ by offsetting insertions and deletions."""
+    if len(set(proteins)) <= 1:
+        return list(proteins)
+
+    # Each group holds the input indices of its members along with their aligned proteins
+    groups = dict((index, ([index], [protein])) for index, protein in enumerate(proteins))
+    pairwise = numpy.array([[_kmer_distance(first, second) for second in proteins] for first in proteins])
+    distances = dict(((first, second), pairwise[first, second])
+                     for first in groups for second in groups if first < second)
+    next_group = len(proteins)
+    while 1 < len(groups):
+        first, second = min(distances, key=distances.get)
+        members = groups[first][0] + groups[second][0]
+        groups[next_group] = members, _align_profiles(groups.pop(first)[1], groups.pop(second)[1])
+
+        # Average linkage distance from the merged group to all remaining groups
+        for other in groups:
+            if other != next_group:
+                distances[(other, next_group)] = pairwise[numpy.ix_(members, groups[other][0])].mean()
+        distances = dict((key, value) for key, value in distances.iteritems()
+                         if first not in key and second not in key)
+        next_group += 1
+
+    members, aligned = groups.values()[0]
+    return [protein for _, protein in sorted(zip(members, aligned))]
+
+
+def _backthread(dna, aligned_protein):
+    """Replace each residue in aligned_protein by its codon from dna, and each gap by a gap codon."""
+    codons = iter(dna[index:index + 3] for index in range(0, len(dna) - len(dna) % 3, 3))
+    return ''.join('---' if residue == '-' else next(codons) for residue in aligned_protein)
+
+
+def codon_align(sico_file, dna_alignment, translation_table=CODON_TABLE_ID):
+    """Align the coding sequences in sico_file at the protein level, and write the codon alignment to dna_alignment."""
+    records = list(SeqIO.parse(sico_file, 'fasta'))
+    dnas = [str(seqr.seq).upper() for seqr in records]
+
+    # Translate only full codons, and keep translating past any internal stop codons
+    proteins = [str(Seq(dna[:len(dna) - len(dna) % 3]).translate(table=translation_table)) for dna in dnas]
+    aligned = align_proteins(proteins)
+
+    with open(dna_alignment, mode='w') as write_handle:
+        SeqIO.write((SeqRecord(Seq(_backthread(dna, protein)), id=seqr.id, description=seqr.description)
+                     for seqr, dna, protein in zip(records, dnas, aligned)), write_handle, 'fasta')
+    return dna_alignment
+
+
+def _aligned_residue_pairs(alignment_file):
+    """Return the set of residue pairs aligned in the same column, as tuples of sequence IDs and residue positions."""
+    records = list(SeqIO.parse(alignment_file, 'fasta'))
+    positions = [numpy.cumsum([char != '-' for char in str(seqr.seq)]) - 1 for seqr in records]
+    pairs = set()
+    for first in range(len(records)):
+        for second in range(first + 1, len(records)):
+            for column in range(len(records[first])):
+                if records[first][column] != '-' and records[second][column] != '-':
+                    pairs.add((records[first].id, positions[first][column],
+                               records[second].id, positions[second][column]))
+    return pairs
+
+
+def benchmark(sico_files):
+    """Align sico_files with both TranslatorX and codon_align, and return their timings and the fraction of residue
+    pairs aligned by TranslatorX that are aligned identically by codon_align."""
+    from align_trim_orthologs import _run_translatorx
+
+    run_dir = tempfile.mkdtemp(prefix='codon_align_benchmark_')
+    timings = {'translatorx': 0, 'codon_align': 0}
+    shared_pairs = reference_pairs = 0
+    try:
+        for sico_file in sico_files:
+            file_base = os.path.join(run_dir, os.path.splitext(os.path.split(sico_file)[1])[0])
+
+            start = time.time()
+            translatorx_alignment = _run_translatorx(sico_file, file_base)
+            timings['translatorx'] += time.time() - start
+
+            start = time.time()
+            native_alignment = codon_align(sico_file, file_base + '.codon_align.fasta')
+            timings['codon_align'] += time.time() - start
+
+            reference = _aligned_residue_pairs(translatorx_alignment)
+            shared_pairs += len(reference & _aligned_residue_pairs(native_alignment))
+            reference_pairs += len(reference)
+    finally:
+        shutil.rmtree(run_dir)
+    return timings, shared_pairs / float(reference_pairs or 1)
+
+
+def main():
+    '''
+    Benchmark codon_align against TranslatorX for the SICO files given as arguments.
+    '''
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('sico_files', nargs='+', help='FASTA files of unaligned orthologous coding sequences')
+    args = parser.parse_args()
+
+    timings, agreement = benchmark(args.sico_files)
+    for aligner, seconds in sorted(timings.iteritems()):
+        log.info('%s aligned %d SICOs in %.2f seconds', aligner, len(args.sico_files), seconds)
+    log.info('codon_align agrees on %.1f%% of residue pairs aligned by TranslatorX', agreement * 100)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,9 @@
 """Module to create concatemer per genome of orthologs, create a phylogenetic tree and deduce taxa from that tree."""
 
 from Bio import AlignIO, Phylo, SeqIO
-from shared import create_directory, parse_options, extract_archive_of_files, create_archive_of_files
+from phylogeny import alignment_tree, root_bipartition
+from shared import create_directory, parse_options, extract_archive_of_files, create_archive_of_files, parse_header
 from select_taxa import select_genomes_by_ids
-from versions import DNADIST, NEIGHBOR
-from subprocess import Popen, PIPE, STDOUT
 import logging as log
 import matplotlib
 import os.path
@@ -31,7 +30,7 @@ def coding_regions_per_genome(run_dir, trimmed_sicos):
     for trimmed_sico in trimmed_sicos:
         for seqr in SeqIO.parse(trimmed_sico, 'fasta'):
             # Sample header line: >58191|NC_010067.1|YP_001569097.1|COG4948MR|core
-            project_id = seqr.id.split('|')[0]
+            project_id = parse_header(seqr.id).genome
 
             # Try to retrieve write handle from dictionary of cached write handles per genome
             write_handle = write_handles.get(project_id)
@@ -97,53 +96,6 @@ def create_super_concatemer(concatemer_files, destination_path):
             SeqIO.write(seqr, write_handle, 'fasta')
 
 
-def _run_dna_dist(run_dir, aligned_file):
-    """Run dnadist to calculate distances between individual strains in a distance matrix, as input for neighbor."""
-    # Run calculations inside a directory
-    dnadist_dir = create_directory('dnadist/', inside_dir=run_dir)
-
-    # Read alignment file
-    alignment = AlignIO.read(aligned_file, 'fasta')
-
-    # Convert alignment in to proper input file for dnadist according to specification
-    nr_of_species = len(alignment)
-    nr_of_sites = len(alignment[0])
-    infile = os.path.join(dnadist_dir, 'infile')
-    with open(infile, mode='w') as write_handle:
-        write_handle.write('   {0}   {1}\n'.format(nr_of_species, nr_of_sites))
-
-        for seq_record in alignment:
-            name = seq_record.id.split('|')[0]
-            name = name if len(name) < 10 else name[:10]
-            write_handle.write('{0:10}{1}\n'.format(name, seq_record.seq))
-
-    # Actually run the dnadist program in the correct directory, and send input to it for the first prompt
-    process = Popen(DNADIST, cwd=dnadist_dir, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-    process.communicate(input='Y\n')
-
-    # Retrieve outputfile
-    outfile = os.path.join(dnadist_dir, 'outfile')
-    assert os.path.exists(outfile) and 0 < os.path.getsize(outfile), outfile + ' should exist with some content now'
-    return outfile
-
-
-def _run_neighbor(run_dir, distance_file):
-    """Run neighbor to generate a tree of the distances in the distance file, and return the generated tree file."""
-    neighbor_dir = create_directory('neighbor', inside_dir=run_dir)
-
-    # Copy outfile from dnadist to infile inside neighbor_dir
-    shutil.copy(distance_file, os.path.join(neighbor_dir, 'infile'))
-
-    # Actually run neighbor
-    process = Popen(NEIGHBOR, cwd=neighbor_dir, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-    process.communicate(input='N\nY\n')
-
-    # Retrieve newick tree file
-    treefile = os.path.join(neighbor_dir, 'outtree')
-    assert os.path.exists(treefile) and 0 < os.path.getsize(treefile), treefile + ' should exist with some content now'
-    return treefile
-
-
 def _fix_misinterpreted_names(tree):
     """Bio.Phylo.read(file, 'newick') misinterprets numerical names as confidence scores. Fix that here in place."""
     for leaf in tree.get_terminals():
@@ -152,22 +104,6 @@ def _fix_misinterpreted_names(tree):
             leaf.confidence = None
 
 
-def _read_taxa_from_tree(tree_file):
-    """Read tree_file in Newick format to identify the first two clades that split up this tree and their leafs."""
-    # Parse tree using BioPython, which interprets the GenBank Project IDs as confidence scores, but that'll do for now.
-    phylo_tree = Phylo.read(tree_file, 'newick')
-    _fix_misinterpreted_names(phylo_tree)
-
-    # Of the full tree retrieve the clades from the root clade, expecting exactly two distinct clades after UPGMA
-    clades = phylo_tree.clade.clades
-    assert len(clades) == 2, 'Expected two clades as child of tree\'s first clade, but was {0}'.format(len(clades))
-
-    # Get all the leafs for the above two clades in a similar format to the genome_ids
-    clade_one = sorted(leaf.name for leaf in clades[0].get_terminals())
-    clade_two = sorted(leaf.name for leaf in clades[1].get_terminals())
-    return clade_one, clade_two
-
-
 def visualize_tree(super_tree_file, id_to_name_map, tree_output):
     """Visualize the phylogenetic tree encoded in the Newick format super_tree_file, and write graphic to ascii_tree."""
     # Draw phylogenetic tree
@@ -231,9 +167,12 @@ Usage: concatenate_orthologs.py
 
     # Determine the taxa present in the super concatemer tree by building a phylogenetic tree from genome concatemer and
     # reading genome ids in the two largest clades.
-    super_distance_file = _run_dna_dist(run_dir, target_concat_file)
-    super_tree_file = _run_neighbor(run_dir, super_distance_file)
-    genome_ids_a, genome_ids_b = _read_taxa_from_tree(super_tree_file)
+    super_tree = alignment_tree(AlignIO.read(target_concat_file, 'fasta'))
+    genome_ids_a, genome_ids_b = root_bipartition(super_tree)
+
+    # Write out the tree in Newick format for visualization
+    super_tree_file = os.path.join(run_dir, 'outtree')
+    Phylo.write(super_tree, super_tree_file, 'newick')
 
     # Map Project IDs to Organism names
     id_to_name_map = dict((gid, genome['Organism/Name'])
@@ -2,9 +2,9 @@
 """Module to create a crosstable between orthologs & genomes showing gene IDs at intersections."""
 
 from Bio import SeqIO
-from shared import find_cogs_in_sequence_records, get_most_recent_gene_name, parse_options, extract_archive_of_files
+from shared import find_cogs_in_sequence_records, get_most_recent_gene_name, parse_options, extract_archive_of_files, \
+    parse_header, GenomeRanking
 from select_taxa import select_genomes_by_ids
-from operator import itemgetter
 import logging
 import os.path
 import shutil
@@ -19,32 +19,32 @@ __license__ = "MIT"
 def create_crosstable(sico_files, target_crosstable):
     """Create crosstable with vertically the orthologs, horizontally the genomes, and gene IDs at intersections."""
     with open(target_crosstable, mode='w') as write_handle:
-        # Create dictionaries mapping genomes to gene IDs per sico file
-        row_data = [(sico_file, dict(itemgetter(0, 2)(fasta_record.id.split('|'))
-                         for fasta_record in SeqIO.parse(sico_file, 'fasta')))
-                    for sico_file in sico_files]
+        # Parse headers per sico file once, for gene IDs as well as COGs and products
+        headers_per_file = [(sico_file, [parse_header(fasta_record.description)
+                                         for fasta_record in SeqIO.parse(sico_file, 'fasta')])
+                            for sico_file in sico_files]
 
-        # Retrieve unique genomes across all sico files, just to be safe
-        genomes = sorted(set(key for row in row_data for key in row[1].keys()))
-        genome_dicts = select_genomes_by_ids(genomes).values()
+        # Retrieve unique genomes across all sico files, just to be safe, and rank them by date only once
+        genomes = sorted(set(header.genome for headers in headers_per_file for header in headers[1]))
+        ranking = GenomeRanking(select_genomes_by_ids(genomes).values())
 
         # Write out values to file
         write_handle.write('\t' + '\t'.join(genomes))
         write_handle.write('\tCOGs\tProduct\n')
-        for sico_file, row in row_data:
+        for sico_file, headers in headers_per_file:
             ortholog = os.path.split(sico_file)[1].split('.')[0]
             write_handle.write(ortholog + '\t')
-            write_handle.write('\t'.join(row.get(genome, '') for genome in genomes))
 
-            # Parse sequence records again, but now to retrieve cogs and products
-            seq_records = list(SeqIO.parse(sico_file, 'fasta'))
+            # Map genomes to gene IDs
+            row = dict((header.genome, header.protein) for header in headers)
+            write_handle.write('\t'.join(row.get(genome, '') for genome in genomes))
 
             # COGs
-            cogs = find_cogs_in_sequence_records(seq_records)
+            cogs = find_cogs_in_sequence_records(headers)
             write_handle.write('\t' + ','.join(cogs))
 
             # Product
-            product = get_most_recent_gene_name(genome_dicts, seq_records)
+            product = get_most_recent_gene_name(ranking, headers)
             write_handle.write('\t' + product)
 
             # New line
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""Module to estimate pairwise dN/dS in process by Nei-Gojobori counting, as an alternative to codeml runmode -2.
+
+Synonymous sites and differences are tabulated once for all 64 x 64 codon pairs, so each pair of sequences reduces to
+table lookups, without the nexus, control and output files of a codeml subprocess."""
+
+from __future__ import division
+from Bio.Data import CodonTable
+from itertools import permutations
+from shared import CODON_TABLE_ID
+import argparse
+import logging as log
+import math
+import numpy
+
+__author__ = "Tim te Beek"
+__copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
+__license__ = "MIT"
+
+# Distances are bounded for saturated sequences, for which the Jukes-Cantor correction is undefined, as codeml bounds t
+SATURATED = 50.
+# Value reported for dN/dS when there are no synonymous differences, as by codeml
+UNDEFINED_RATIO = 99.
+
+_BASES = 'TCAG'
+_CODONS = [first + second + third for first in _BASES for second in _BASES for third in _BASES]
+
+# Lookup table from byte value to index in _BASES, where anything but an unambiguous nucleotide maps to -1
+_BASE_INDEX = numpy.empty(256, dtype=int)
+_BASE_INDEX.fill(-1)
+for _index, _base in enumerate(_BASES):
+    _BASE_INDEX[ord(_base)] = _index
+    _BASE_INDEX[ord(_base.lower())] = _index
+
+
+def _codon_tables(table_id):
+    """Return the synonymous sites per codon, the synonymous and non-synonymous differences per pair of codons, and
+    whether each codon is a sense codon, for translation table table_id.
+
+    Differences between codons that differ at more than one position are averaged over all mutational pathways between
+    them, leaving out pathways through stop codons."""
+    forward_table = CodonTable.unambiguous_dna_by_id[table_id].forward_table
+    amino_acids = [forward_table.get(codon) for codon in _CODONS]
+    sense = numpy.array([amino_acid is not None for amino_acid in amino_acids])
+
+    # Synonymous sites are the fraction of single nucleotide changes at each position that keep the amino acid
+    synonymous_sites = numpy.zeros(64)
+    for index, codon in enumerate(_CODONS):
+        if sense[index]:
+            synonymous_sites[index] = sum(amino_acids[_CODONS.index(codon[:pos] + base + codon[pos + 1:])]
+                                          == amino_acids[index]
+                                          for pos in range(3) for base in _BASES if base != codon[pos]) / 3
+
+    # Count synonymous and non-synonymous steps along each pathway between two sense codons
+    differences = numpy.zeros((64, 64, 2))
+    for first, codon_a in enumerate(_CODONS):
+        for second, codon_b in enumerate(_CODONS):
+            if not (sense[first] and sense[second]) or first == second:
+                continue
+            pathways = []
+            for order in permutations([pos for pos in range(3) if codon_a[pos] != codon_b[pos]]):
+                steps = [codon_a]
+                for pos in order:
+                    steps.append(steps[-1][:pos] + codon_b[pos] + steps[-1][pos + 1:])
+                residues = [amino_acids[_CODONS.index(step)] for step in steps]
+                if None not in residues:
+                    synonymous = sum(one == two for one, two in zip(residues, residues[1:]))
+                    pathways.append((synonymous, len(order) - synonymous))
+            differences[first, second] = numpy.mean(pathways, axis=0)
+    return synonymous_sites, differences, sense
+
+_TABLES = {}
+
+
+def _tables(table_id):
+    """Return the codon tables for table_id, calculated once per translation table."""
+    if table_id not in _TABLES:
+        _TABLES[table_id] = _codon_tables(table_id)
+    return _TABLES[table_id]
+
+
+def codon_indices(sequence):
+    """Return the index in _CODONS of each full codon in sequence, or -1 for codons with gaps or ambiguous bases."""
+    bases = _BASE_INDEX[numpy.frombuffer(str(sequence), dtype=numpy.uint8)]
+    codons = bases[:len(bases) - len(bases) % 3].reshape(-1, 3)
+    return numpy.where((codons < 0).any(axis=1), -1, codons.dot([16, 4, 1]))
+
+
+def _jukes_cantor(proportion):
+    """Return the Jukes-Cantor corrected distance for a proportion of differing sites, bounded by SATURATED."""
+    if not proportion:
+        return 0.
+    argument = 1 - 4 * proportion / 3
+    if argument <= 0:
+        return SATURATED
+    return min(-0.75 * math.log(argument), SATURATED)
+
+
+def nei_gojobori(sequence_a, sequence_b, table_id=CODON_TABLE_ID):
+    """Return S, N, dN, dS, dN/dS and t for two aligned coding sequences, along with Dn & Ds, keyed as the values
+    returned by run_codeml.parse_codeml_output.
+
+    Codons with gaps, ambiguous nucleotides or stops in either sequence are left out. Distances are corrected for
+    multiple hits following Jukes & Cantor, and t is the number of nucleotide substitutions per codon."""
+    synonymous_sites, differences, sense = _tables(table_id)
+    codons_a = codon_indices(sequence_a)
+    codons_b = codon_indices(sequence_b)
+    valid = (0 <= codons_a) & (0 <= codons_b)
+    valid[valid] = sense[codons_a[valid]] & sense[codons_b[valid]]
+    codons_a, codons_b = codons_a[valid], codons_b[valid]
+
+    # Sites are averaged over both sequences, while differences are summed over all codon pairs
+    sites_s = (synonymous_sites[codons_a].sum() + synonymous_sites[codons_b].sum()) / 2
+    sites_n = 3 * len(codons_a) - sites_s
+    diffs_s, diffs_n = differences[codons_a, codons_b].sum(axis=0) if len(codons_a) else (0, 0)
+
+    d_s = _jukes_cantor(diffs_s / sites_s) if sites_s else 0
+    d_n = _jukes_cantor(diffs_n / sites_n) if sites_n else 0
+    total = sites_s + sites_n
+    return {'t': 3 * (sites_s * d_s + sites_n * d_n) / total if total else 0,
+            'S': sites_s,
+            'N': sites_n,
+            'dN/dS': d_n / d_s if d_s else UNDEFINED_RATIO,
+            'dN': d_n,
+            'dS': d_s,
+            'Dn': d_n * sites_n,
+            'Ds': d_s * sites_s}
+
+
+def agreement(sico_files, keys=('N', 'S', 'dN', 'dS', 'Dn', 'Ds')):
+    """Estimate dN/dS with both codeml and nei_gojobori for the first two sequences in each of sico_files, and return
+    the Pearson correlation and mean absolute difference between both estimators for each of keys."""
+    from Bio import AlignIO
+    from run_codeml import pairwise_dnds
+
+    estimates = {'codeml': [], 'nei_gojobori': []}
+    for sico_file in sico_files:
+        alignment = AlignIO.read(sico_file, 'fasta')
+        for estimator in estimates:
+            estimates[estimator].append(pairwise_dnds(alignment[:1], alignment[1:2], estimator))
+
+    report = {}
+    for key in keys:
+        codeml = numpy.array([values[key] for values in estimates['codeml']])
+        native = numpy.array([values[key] for values in estimates['nei_gojobori']])
+        correlation = numpy.corrcoef(codeml, native)[0, 1] if 1 < len(codeml) else float('nan')
+        report[key] = correlation, numpy.abs(codeml - native).mean()
+    return report
+
+
+def main():
+    '''
+    Report agreement between codeml and Nei-Gojobori dN/dS estimates for the SICO files given as arguments.
+    '''
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('sico_files', nargs='+', help='FASTA files of aligned orthologous coding sequences')
+    args = parser.parse_args()
+
+    for key, (correlation, difference) in sorted(agreement(args.sico_files).iteritems()):
+        log.info('%s: correlation %.3f, mean absolute difference %.4f', key, correlation, difference)
+
+
+if __name__ == '__main__':
+    main()
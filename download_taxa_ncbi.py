@@ -1,14 +1,19 @@
 #!/usr/bin/env python
 """Module to download files from NCBI FTP."""
-from Bio import SeqIO
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from ftplib import FTP, error_perm
+from ftplib import FTP, error_perm, error_temp, all_errors
 import logging
+from multiprocessing.pool import ThreadPool
 import os.path
+from Queue import Queue, Empty
 import shutil
+import socket
 import tempfile
+import threading
 import time
 
+from genome_cache import default_manifest
 from shared import create_directory
 
 
@@ -16,89 +21,182 @@ __author__ = "Tim te Beek"
 __copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
 __license__ = "MIT"
 
-
-def download_plasmid_files(genome):
+NCBI_FTP_HOST = 'ftp.ncbi.nlm.nih.gov'
+NCBI_FTP_PASSWD = 'timtebeek+odose@gmail.com'
+
+
+class FTPSessionPool(object):
+    """Bounded pool of logged in FTP sessions, which are reused across downloads rather than logging in per file."""
+
+    def __init__(self, host=NCBI_FTP_HOST, port=21, passwd=NCBI_FTP_PASSWD, size=4, retries=3, backoff=2):
+        self.host = host
+        self.port = port
+        self.passwd = passwd
+        self.size = size
+        self.retries = retries
+        self.backoff = backoff
+        self.logins = 0
+        self._idle = Queue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _login(self):
+        """Open a new connection and login, keeping count of the number of logins."""
+        ftp = FTP()
+        ftp.connect(self.host, self.port)
+        ftp.login(passwd=self.passwd)
+        with self._lock:
+            self.logins += 1
+        return ftp
+
+    @contextmanager
+    def session(self):
+        """Borrow an idle FTP session, or login a new one while fewer than size sessions are in use."""
+        self._slots.acquire()
+        try:
+            try:
+                ftp = self._idle.get_nowait()
+            except Empty:
+                ftp = self._login()
+            try:
+                yield ftp
+            except error_perm:
+                # Permanent errors such as missing files leave the session itself in a usable state
+                self._idle.put(ftp)
+                raise
+            except all_errors:
+                # Discard sessions after any other error, as they might have been closed by the server
+                ftp.close()
+                raise
+            self._idle.put(ftp)
+        finally:
+            self._slots.release()
+
+    def retrieve(self, remote_path, local_file):
+        """Retrieve remote_path into local_file, retrying with exponential backoff on temporary FTP errors, and on
+        connections that are closed or reset while logging in or transferring."""
+        for attempt in range(self.retries + 1):
+            try:
+                with self.session() as ftp:
+                    # Reopen local_file for each attempt, so partial downloads from failed attempts are overwritten
+                    with open(local_file, mode='wb') as writer:
+                        ftp.retrbinary('RETR {0}'.format(remote_path), writer.write)
+                return
+            except (error_temp, EOFError, socket.error, IOError) as err:
+                if self.retries <= attempt:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logging.warn('Temporary error retrieving %s; retrying in %s seconds: %s', remote_path, delay, err)
+                time.sleep(delay)
+
+    def close(self):
+        """Be nice and close all idle sessions."""
+        while True:
+            try:
+                ftp = self._idle.get_nowait()
+            except Empty:
+                break
+            try:
+                ftp.quit()
+            except all_errors:
+                ftp.close()
+
+
+def download_genomes(genomes, download_log=None, require_ptt=False, ftp_pool=None):
+    """Download genome files for all genomes concurrently over shared FTP sessions, and return files per genome.
+
+    Download log lines are written in the order of genomes, regardless of the order in which downloads complete."""
+    return list(iterate_genome_files(genomes, download_log, require_ptt, ftp_pool))
+
+
+def iterate_genome_files(genomes, download_log=None, require_ptt=False, ftp_pool=None):
+    """Download files for all accessioncodes of all genomes in a single pool of threads over shared FTP sessions.
+
+    Yield the files per genome in the order of genomes as soon as they are available, or None for skipped genomes."""
+    # Download using FTP sessions from a pool, which we only close if we created it here
+    owns_pool = ftp_pool is None
+    if owns_pool:
+        ftp_pool = FTPSessionPool()
+    pool = ThreadPool(ftp_pool.size)
+    try:
+        # Submit the downloads for all genomes up front, so the pool stays busy while earlier genomes are consumed
+        downloads = [(genome, _submit_genome_downloads(pool, ftp_pool, genome, require_ptt)) for genome in genomes]
+        for genome, (chromosomes, plasmids) in downloads:
+            yield _collect_genome_files(genome, chromosomes, plasmids, download_log, ftp_pool.host)
+    finally:
+        pool.close()
+        pool.join()
+        if owns_pool:
+            ftp_pool.close()
+
+
+def download_plasmid_files(genome, ftp_pool=None):
     '''
     Download plasmid files from FTP site, by taking accession codes from other columns.
     :param genome:
+    :param ftp_pool: pool of FTP sessions to reuse
     '''
-    return download_genome_files(genome, download_log=None, refseq_column='Plasmids/RefSeq')
+    return download_genome_files(genome, download_log=None, refseq_column='Plasmids/RefSeq', ftp_pool=ftp_pool)
 
 
-def download_genome_files(genome, download_log=None, require_ptt=False, refseq_column='Chromosomes/RefSeq'):
+def download_genome_files(genome, download_log=None, require_ptt=False, refseq_column='Chromosomes/RefSeq',
+                          ftp_pool=None):
     """Download genome .gbk & .ptt files from ncbi ftp and return pairs per accessioncode in tuples of three."""
+    # Download using FTP sessions from a pool, which we only close if we created it here
+    owns_pool = ftp_pool is None
+    if owns_pool:
+        ftp_pool = FTPSessionPool()
+    pool = ThreadPool(ftp_pool.size)
+    try:
+        chromosomes, plasmids = _submit_genome_downloads(pool, ftp_pool, genome, require_ptt, refseq_column)
+        return _collect_genome_files(genome, chromosomes, plasmids, download_log, ftp_pool.host)
+    finally:
+        # Be nice and close the connections
+        pool.close()
+        pool.join()
+        if owns_pool:
+            ftp_pool.close()
+
+
+def _submit_genome_downloads(pool, ftp_pool, genome, require_ptt=False, refseq_column='Chromosomes/RefSeq'):
+    """Submit downloads of .gbk & .ptt files for all accessioncodes of genome to pool, and return the pending results
+    for the accessioncodes in refseq_column, along with those for plasmids when downloading chromosomes."""
     logging.debug('Downloading: %s', genome)
 
     # ftp://ftp.ncbi.nih.gov/genbank/genomes/Bacteria/Sulfolobus_islandicus_M_14_25_uid18871/CP001400.ffn
-    # Download using FTP
-    ftp = FTP('ftp.ncbi.nlm.nih.gov')
-    ftp.login(passwd='timtebeek+odose@gmail.com')
-
     # Try to find project directory in RefSeq curated listing
     projectid = genome['Assembly Accession']
-    folder = '/genomes/ASSEMBLY_BACTERIA/{}'.format(genome['FTP Path'])
-    accessioncodes = genome[refseq_column]
+    folder = _genome_folder(genome)
     target_dir = create_directory('genomes/' + projectid)
 
     # Determine last modified date to see if we should redownload the file following changes
     last_change_date = genome['Modify Date'] if genome['Modify Date'] else genome['Release Date']
 
-    # Download .gbk & .ptt files for all genome accessioncodes and append them to this list as tuples of gbk + ptt
-    genome_files = []
+    def _submit(accessioncodes, require_ptt):
+        """Submit downloads of .gbk & .ptt files for accessioncodes, retaining the pending results in order."""
+        return [pool.apply_async(_download_accession_files,
+                                 (ftp_pool, folder, acc, target_dir, projectid, last_change_date, require_ptt))
+                for acc in accessioncodes]
 
-    for acc in accessioncodes:
-        # Remove version suffixes to accessioncodes, such as NC_0012345.2
-        acc = acc.split('.')[0]
+    # Plasmid files are downloaded alongside, reusing the same FTP sessions
+    chromosomes = _submit(genome[refseq_column], require_ptt)
+    plasmids = _submit(genome['Plasmids/RefSeq'], False) if refseq_column == 'Chromosomes/RefSeq' else []
+    return chromosomes, plasmids
 
-        # Try genbank file, which is always required
-        try:
-            gbk_file = _download_genome_file(ftp, folder, acc + '.gbk', target_dir, last_change_date)
-
-            # Try to parse Bio.GenBank.Record to see if it contains more than five (arbitrary) feature records
-            features = SeqIO.read(gbk_file, 'genbank').features
-            if not any(feature.type == 'CDS' for feature in features):
-                # Skip when genbank file does not contain any coding sequence features
-                logging.warn('GenBank file %s did not contain any coding sequence features', acc)
-                continue
-        except error_perm as err:
-            if 'No such file or directory' not in str(err):
-                raise err
-            logging.warn(err)
-            logging.warn('GenBank file %s missing for %s', acc, projectid)
-            continue
-        except IOError as err:
-            if 'Target file was empty after download' not in str(err):
-                raise err
-            logging.warn(err)
-            continue
-
-        # Try protein table file, which could be optional
-        ptt_file = None
-        try:
-            ptt_file = _download_genome_file(ftp, folder, acc + '.ptt', target_dir, last_change_date)
-        except error_perm as err:
-            if 'No such file or directory' not in str(err):
-                raise err
-            logging.warn(err)
-            if require_ptt:
-                logging.warn('Protein table file %s missing for %s: Probably no coding sequences', acc, projectid)
-                continue
-        except IOError as err:
-            if 'Target file was empty after download' not in str(err):
-                raise err
-            logging.warn(err)
-            continue
-        genome_files.append((projectid, gbk_file, ptt_file))
-
-    # Be nice and close the connection
-    ftp.close()
+
+def _collect_genome_files(genome, chromosomes, plasmids, download_log, host):
+    """Wait for pending downloads of genome, and return its files extended with plasmid files, or None if skipped."""
+    genome_files = [files for files in (result.get() for result in chromosomes) if files is not None]
 
     if len(genome_files) == 0:
         # Write out commented out line to the logfile detailing this error
-        if download_log:
-            with open(download_log, mode='a') as append_handle:
-                append_handle.write('#{0}\t{1}\t'.format(projectid, genome['Organism/Name']))
-                append_handle.write('# Genome skipped because of missing files\n')
+        _write_download_log(download_log, genome, None, host)
 
         # Return nothing when:
         #- none of the accessioncodes resulted in files
@@ -108,20 +206,111 @@ def download_genome_files(genome, download_log=None, require_ptt=False, refseq_c
 
     # Write out provenance logfile with sources of retrieved files
     # This file could coincidentally also serve as genome ID file for extract taxa
-    if download_log:
-        with open(download_log, mode='a') as append_handle:
-            append_handle.write('{0}\t{1}\t{2}{3}\n'.format(projectid, genome['Organism/Name'], ftp.host, folder))
+    _write_download_log(download_log, genome, genome_files, host)
 
-    # Extend with
-    if refseq_column == 'Chromosomes/RefSeq':
-        plasmid_files = download_plasmid_files(genome)
-        if plasmid_files:
-            genome_files.extend(plasmid_files)
+    # Extend with plasmid files
+    genome_files.extend(files for files in (result.get() for result in plasmids) if files is not None)
 
     # Return genome files
     return genome_files
 
 
+def _genome_folder(genome):
+    """Return the remote folder containing the files for genome."""
+    return '/genomes/ASSEMBLY_BACTERIA/{}'.format(genome['FTP Path'])
+
+
+def _write_download_log(download_log, genome, genome_files, host):
+    """Append line for genome to download_log, or a commented out line when no genome files were retrieved."""
+    if not download_log:
+        return
+    with open(download_log, mode='a') as append_handle:
+        if genome_files:
+            append_handle.write('{0}\t{1}\t{2}{3}\n'.format(genome['Assembly Accession'], genome['Organism/Name'],
+                                                            host, _genome_folder(genome)))
+        else:
+            append_handle.write('#{0}\t{1}\t'.format(genome['Assembly Accession'], genome['Organism/Name']))
+            append_handle.write('# Genome skipped because of missing files\n')
+
+
+def _download_accession_files(ftp_pool, folder, acc, target_dir, projectid, last_change_date, require_ptt):
+    """Download .gbk & .ptt files for a single accessioncode and return them as a tuple, or None if skipped."""
+    # Remove version suffixes to accessioncodes, such as NC_0012345.2
+    acc = acc.split('.')[0]
+
+    # Try genbank file, which is always required
+    try:
+        gbk_file = _download_genome_file(ftp_pool, folder, acc + '.gbk', target_dir, last_change_date, projectid)
+
+        # Probe the feature table rather than parse the full Bio.GenBank.Record to see if it contains coding sequences
+        if not _genbank_has_cds(gbk_file):
+            # Skip when genbank file does not contain any coding sequence features
+            logging.warn('GenBank file %s did not contain any coding sequence features', acc)
+            return None
+    except error_perm as err:
+        if 'No such file or directory' not in str(err):
+            raise err
+        logging.warn(err)
+        logging.warn('GenBank file %s missing for %s', acc, projectid)
+        return None
+    except IOError as err:
+        if 'Target file was empty after download' not in str(err):
+            raise err
+        logging.warn(err)
+        return None
+
+    # Try protein table file, which could be optional
+    ptt_file = None
+    try:
+        ptt_file = _download_genome_file(ftp_pool, folder, acc + '.ptt', target_dir, last_change_date, projectid)
+    except error_perm as err:
+        if 'No such file or directory' not in str(err):
+            raise err
+        logging.warn(err)
+        if require_ptt:
+            logging.warn('Protein table file %s missing for %s: Probably no coding sequences', acc, projectid)
+            return None
+    except IOError as err:
+        if 'Target file was empty after download' not in str(err):
+            raise err
+        logging.warn(err)
+        return None
+    return projectid, gbk_file, ptt_file
+
+
+def _genbank_has_cds(gbk_file, manifest=None):
+    """Return whether gbk_file contains any CDS features, reusing the answer stored in the genome cache manifest for
+    as long as the file is not downloaded again."""
+    manifest = manifest or default_manifest()
+    entry = manifest.lookup(gbk_file)
+    if entry is not None and entry['has_cds'] is not None:
+        return bool(entry['has_cds'])
+
+    has_cds = _scan_for_cds_feature(gbk_file)
+    if entry is not None:
+        manifest.set_has_cds(gbk_file, has_cds)
+    return has_cds
+
+
+def _scan_for_cds_feature(gbk_file):
+    """Scan the feature table lines of gbk_file for a CDS feature key, without parsing the sequence or qualifiers."""
+    in_features = False
+    with open(gbk_file) as read_handle:
+        for line in read_handle:
+            if line.startswith('FEATURES'):
+                in_features = True
+            elif in_features:
+                # Feature keys start at column 6, qualifiers at column 22
+                #      CDS             190..255
+                #                      /protein_id="NP_414542.1"
+                if line.startswith('     CDS '):
+                    return True
+                # The feature table ends with the first line not indented, such as ORIGIN or CONTIG
+                if not line.startswith(' '):
+                    in_features = False
+    return False
+
+
 def _find_project_dir(ftp, base_dir, projectid):
     """Find a genome project directory in ftp directory based upon directory name postfix. Return None if not found."""
     # Retrieve listing of directories under base_dir
@@ -135,35 +324,48 @@ def _find_project_dir(ftp, base_dir, projectid):
     return None
 
 
-def _download_genome_file(ftp, remote_dir, filename, target_dir, last_change_date):
+def _download_genome_file(ftp_pool, remote_dir, filename, target_dir, last_change_date, genome=None, manifest=None):
     """Download a single file from remote folder to target folder, only if it does not already exist."""
     # Move completed tmp_file to actual output path when done
     out_file = os.path.join(target_dir, filename)
+    remote_path = '{0}/{1}'.format(remote_dir, filename)
 
     # We know when genomes were last updated. Use this information to determine when to download again, or every 60 days
     last_changed_stamp = time.mktime(last_change_date.timetuple())
     sixty_day_stamp = time.mktime((datetime.now() - timedelta(days=60)).timetuple())
     file_age_limit = max(last_changed_stamp, sixty_day_stamp)
 
-    # Do not retrieve existing files if they exist and have content and are newer than the file_age_limit
-    if not os.path.exists(out_file) or 0 == os.path.getsize(out_file) or os.path.getmtime(out_file) < file_age_limit:
-        # Use a temporary file as write handle here, so we can not pollute cache when download is interrupted
-        tmp_file = tempfile.mkstemp(prefix=filename + '_')[1]
+    # Do not retrieve existing files if the manifest shows they were retrieved after the file_age_limit
+    manifest = manifest or default_manifest()
+    if manifest.is_fresh(out_file, file_age_limit):
+        logging.info('Cache hit on file %s', out_file)
+        manifest.record_hit('genomes', out_file)
+        return out_file
 
-        # Retrieve genbank & protein table files from FTP
-        logging.info('Retrieving genome file %s%s/%s to %s', ftp.host, remote_dir, filename, target_dir)
+    # Files cached before the manifest was introduced are validated by modification time once, and then recorded
+    if (manifest.lookup(out_file) is None and os.path.exists(out_file) and 0 < os.path.getsize(out_file)
+            and file_age_limit <= os.path.getmtime(out_file)):
+        logging.info('Cache hit on file %s dated %s', out_file, datetime.fromtimestamp(os.path.getmtime(out_file)))
+        manifest.record_file(out_file, genome, remote_path, last_changed_stamp, retrieved=os.path.getmtime(out_file))
+        manifest.record_hit('genomes', out_file)
+        return out_file
 
-        # Write retrieved contents to file
-        with open(tmp_file, mode='wb') as writer:
-            ftp.retrbinary('RETR {0}/{1}'.format(remote_dir, filename), writer.write)
+    # Use a temporary file as write handle here, so we can not pollute cache when download is interrupted
+    tmp_file = tempfile.mkstemp(prefix=filename + '_')[1]
 
-        # Assert file was actually written to
-        if not os.path.isfile(tmp_file) or 0 == os.path.getsize(tmp_file):
-            raise IOError('Target file was empty after download: Did source have content?\n' + tmp_file)
+    # Retrieve genbank & protein table files from FTP
+    logging.info('Retrieving genome file %s%s to %s', ftp_pool.host, remote_path, target_dir)
 
-        # Actually move now that we've finished downloading files
-        shutil.move(tmp_file, out_file)
-    else:
-        logging.info('Cache hit on file %s dated %s', out_file, datetime.fromtimestamp(os.path.getmtime(out_file)))
+    # Write retrieved contents to file
+    ftp_pool.retrieve(remote_path, tmp_file)
+
+    # Assert file was actually written to
+    if not os.path.isfile(tmp_file) or 0 == os.path.getsize(tmp_file):
+        raise IOError('Target file was empty after download: Did source have content?\n' + tmp_file)
+
+    # Actually move now that we've finished downloading files, and record the retrieved file in the manifest
+    shutil.move(tmp_file, out_file)
+    manifest.record_file(out_file, genome, remote_path, last_changed_stamp)
+    manifest.record_miss('genomes', out_file)
 
     return out_file
@@ -13,7 +13,7 @@ import tempfile
 import logging as log
 from select_taxa import select_genomes_by_ids
 from shared import create_directory, extract_archive_of_files, create_archive_of_files, parse_options, \
-    get_most_recent_gene_name, find_cogs_in_sequence_records
+    parse_header, ortholog_metadata, GenomeRanking
 
 
 __author__ = "Tim te Beek"
@@ -25,18 +25,16 @@ def _produce_heatmap(genome_ids, sico_files, muco_files, accessory_files):
     """Produce heatmap of orthologs, and how many times ortholog ooccurs in genome, with the COGs added as well. """
     def _occurences_and_cogs(genome_ids, ortholog_files):
         """Generator that returns how many sequences exist per genome in each ortholog in order and which COGs occur."""
-        genomes = select_genomes_by_ids(genome_ids).values()
         for fasta_file in ortholog_files:
-            records = tuple(SeqIO.parse(fasta_file, 'fasta'))
-            ids = [record.id.split('|')[0] for record in records]
+            # Parse headers, COGs and product at once, from descriptions as SeqIO mucks up ids containing spaces
+            metadata = ortholog_metadata(fasta_file, ranking)
+            ids = [header.genome for header in metadata.headers]
             count_per_id = [ids.count(genome_id) for genome_id in genome_ids]
-            cogs = sorted(find_cogs_in_sequence_records(records))
             ortholog_nr = os.path.splitext(os.path.split(fasta_file)[1])[0]
-            for record in records:
-                # SeqIO mucks up ids containing spaces, so we have to assign description as value for id
-                record.id = record.description
-            product = get_most_recent_gene_name(genomes, records)
-            yield count_per_id, ortholog_nr, cogs, product
+            yield count_per_id, ortholog_nr, sorted(metadata.cogs), metadata.product
+
+    # Rank genomes by date only once for all ortholog files
+    ranking = GenomeRanking(select_genomes_by_ids(genome_ids).values())
 
     heatmap = tempfile.mkstemp(suffix='.tsv', prefix='genome_ortholog_heatmap_')[1]
     with open(heatmap, mode='w') as write_handle:
@@ -73,10 +71,10 @@ def _append_orfans_to_heatmap(orfans_file, genomes, heatmap_file):
     """
     with open(heatmap_file, mode='a') as append_handle:
         for seq in SeqIO.parse(orfans_file, 'fasta'):
-            genome, accession, gene, cog, product = seq.id.split('|')  # @UnusedVariable # pylint: disable=W0612
+            header = parse_header(seq.id)
             for gid in genomes:
-                append_handle.write('{}\t'.format(1 if gid == genome else 0))
-            append_handle.write('\t'.join((gene, cog if cog != 'None' else '', product)))
+                append_handle.write('{}\t'.format(1 if gid == header.genome else 0))
+            append_handle.write('\t'.join((header.protein, header.cog if header.cog != 'None' else '', header.product)))
             append_handle.write('\n')
 
 
@@ -187,12 +185,15 @@ def _dna_file_per_sico(run_dir, dna_files, shared_single_copy, shared_multi_copy
         for record in SeqIO.parse(dna_file, 'fasta'):
             number_of_sequences += 1
 
+            # Parse header once for lookups in all three collections of orthologs below
+            header = parse_header(record.id)
+
             # Find record in each list of dictionaries, to append it to the corresponding ortholog files
-            aff_sico_files = _write_record_to_ortholog_file(sico_dir, shared_single_copy, record)
+            aff_sico_files = _write_record_to_ortholog_file(sico_dir, shared_single_copy, record, header)
             sico_files.update(aff_sico_files)
-            aff_muco_files = _write_record_to_ortholog_file(muco_dir, shared_multi_copy, record)
+            aff_muco_files = _write_record_to_ortholog_file(muco_dir, shared_multi_copy, record, header)
             muco_files.update(aff_muco_files)
-            aff_nonsha_files = _write_record_to_ortholog_file(subset_dir, non_shared, record)
+            aff_nonsha_files = _write_record_to_ortholog_file(subset_dir, non_shared, record, header)
             subset_files.update(aff_nonsha_files)
 
             # ORFans do not fall into any of the above three categories: Add them to a separate file
@@ -203,13 +204,12 @@ def _dna_file_per_sico(run_dir, dna_files, shared_single_copy, shared_multi_copy
     return sorted(sico_files), sorted(muco_files), sorted(subset_files), number_of_sequences, orfans_file
 
 
-def _write_record_to_ortholog_file(directory, ortholog_dictionaries, record):
+def _write_record_to_ortholog_file(directory, ortholog_dictionaries, record, header):
     """Find sequence record in list of ortholog dictionaries, to write the record to corresponding ortholog file."""
     # Sample header line:    >58191|NC_010067.1|YP_001569097.1|COG4948MR|core
     # Corresponding ortholog: {'58191': ['YP_001569097.1'], ...}
-    split_header = record.id.split('|')
-    project_id = split_header[0]
-    protein_id = split_header[2]
+    project_id = header.genome
+    protein_id = header.protein
 
     affected_ortholog_files = set()
     # Find the current sequence record in dictionaries of orthologs to append it to the right target file(s?)
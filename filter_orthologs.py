@@ -2,13 +2,15 @@
 """Module to filter orthologs either with multiple COG annotations or when recombination is found."""
 
 from __future__ import division
-from Bio import SeqIO
+from Bio import AlignIO, SeqIO
 from Bio.SeqRecord import SeqRecord
 from shared import create_directory, extract_archive_of_files, create_archive_of_files, parse_options, \
-    find_cogs_in_sequence_records
+    find_cogs_in_sequence_records, parse_header
 from compare_taxa import main as ctaxa_main
-from concatemer_tree import _run_dna_dist, _run_neighbor, _read_taxa_from_tree, main as ctree_main
+from concatemer_tree import main as ctree_main
 from crosstable_gene_ids import create_crosstable
+from phylogeny import alignment_tree, root_bipartition
+from multiprocessing import cpu_count, Pool
 import logging as log
 import os.path
 import shutil
@@ -74,14 +76,14 @@ def _assign_cog_to_sequences(fasta_file, cog, transfered_cogs):
             for seqr in seqrecords:
                 # Sample header line: >58191|NC_010067.1|YP_001569097.1|COG4948MR|core
                 # Or for missing COG: >58191|NC_010067.1|YP_001569097.1|None|core
-                split = seqr.id.split('|')
-                assert split[3] in (cog, 'None'), 'COG should be either {0} or None, but was {1}'.format(cog, split[3])
-                if split[3] == 'None':
+                header = parse_header(seqr.id)
+                assert header.cog in (cog, 'None'), 'COG should be {0} or None, but was {1}'.format(cog, header.cog)
+                if header.cog == 'None':
                     # Assign cog and alter seqr variable to include assigned cog
-                    split[3] = cog
-                    seqr = SeqRecord(seqr.seq, id='|'.join(split), description='')
+                    header = header._replace(cog=cog)
+                    seqr = SeqRecord(seqr.seq, id='|'.join(header), description='')
                     # Append this COG transfer to append_handle
-                    append_handle.write('\t'.join(split) + '\n')
+                    append_handle.write('\t'.join(header) + '\n')
                 SeqIO.write(seqr, write_handle, 'fasta')
 
 
@@ -98,7 +100,7 @@ def _log_cog_statistics(cog_conflicts, cog_transferable, cog_missing):
         log.info('{0}\tOrthologs did not contain any COG annotations'.format(len(cog_missing)))
 
 
-def _phipack_for_all_orthologs(run_dir, aligned_files, genome_ids_a, genome_ids_b):
+def _phipack_for_all_orthologs(aligned_files, genome_ids_a, genome_ids_b, jobs=1):
     """Filter aligned fasta files where there is evidence of recombination when inspecting phylogenetic trees.
     Return two collections of aligned files, the first without recombination, the second with recombination."""
 
@@ -108,23 +110,23 @@ def _phipack_for_all_orthologs(run_dir, aligned_files, genome_ids_a, genome_ids_
     non_recomb = []
     recombined = []
 
-    # Assign ortholog files to the correct collection based on whether they show recombination
-    for ortholog_file in aligned_files:
-        # Determine input file base name to create an ortholog run specific directory
-        base_name = os.path.split(os.path.splitext(ortholog_file)[0])[1]
-        ortholog_dir = create_directory(base_name, inside_dir=run_dir)
-
-        # Create distance file
-        distance_file = _run_dna_dist(ortholog_dir, ortholog_file)
-
-        # Create tree file
-        tree_file = _run_neighbor(ortholog_dir, distance_file)
-
-        # Parse tree file to ensure all genome_ids_a & genome_ids_b group together in the tree
-        if _tree_shows_recombination(genome_ids_a, genome_ids_b, tree_file):
-            recombined.append(ortholog_file)
-        else:
-            non_recomb.append(ortholog_file)
+    # Build the trees in a pool of worker processes; ordered imap retains the order of aligned_files in the output
+    pool = Pool(jobs) if 1 < jobs else None
+    try:
+        bipartitions = pool.imap(_ortholog_bipartition, aligned_files, chunksize=16) if pool else \
+            (_ortholog_bipartition(ortholog_file) for ortholog_file in aligned_files)
+
+        # Assign ortholog files to the correct collection based on whether they show recombination
+        for ortholog_file, clades in zip(aligned_files, bipartitions):
+            # Ensure all genome_ids_a & genome_ids_b group together in the tree
+            if _tree_shows_recombination(genome_ids_a, genome_ids_b, clades, ortholog_file):
+                recombined.append(ortholog_file)
+            else:
+                non_recomb.append(ortholog_file)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
 
     log.info('%i Orthologs out of %i were filtered out due to recombination, leaving %i non recombined orthologs',
              len(recombined), len(aligned_files), len(non_recomb))
@@ -132,7 +134,12 @@ def _phipack_for_all_orthologs(run_dir, aligned_files, genome_ids_a, genome_ids_
     return non_recomb, recombined
 
 
-def _tree_shows_recombination(genome_ids_a, genome_ids_b, tree_file):
+def _ortholog_bipartition(ortholog_file):
+    """Build the tree of ortholog_file in process, and return the genome IDs in the two clades split at its root."""
+    return root_bipartition(alignment_tree(AlignIO.read(ortholog_file, 'fasta')))
+
+
+def _tree_shows_recombination(genome_ids_a, genome_ids_b, (clade_one, clade_two), ortholog_file=None):
     """Look for evidence of recombination by seeing if all genomes of the separate taxa group together in the tree."""
 
     # Sample tree: (((((59245:0.00000,58803:0.00000):0.00000,59391:0.00000):0.01222,
@@ -141,15 +148,13 @@ def _tree_shows_recombination(genome_ids_a, genome_ids_b, tree_file):
     #(58973:0.00000,58831:0.00000):0.00367):0.00117,(((58917:0.00000,59247:0.00000):0.00000,59249:0.00000):0.00367,
     #(59269:0.00000,58201:0.00000):0.00367):0.00117):0.00172,58017:0.00655):0.02311):0.05199)
 
-    clade_one, clade_two = _read_taxa_from_tree(tree_file)
-
     # Use first genome of clade A to determine which collections should match with one another
     first_a_id = genome_ids_a[0]
     if first_a_id in clade_one:
         # We'll declare to have found recombination when the taxa identified through the tree do not match the user taxa
         return set(genome_ids_a) != set(clade_one) or set(genome_ids_b) != set(clade_two)
 
-    assert first_a_id in clade_two, '{0}\n{1}\n{2}\n{3}'.format(tree_file, clade_one, clade_two, first_a_id)
+    assert first_a_id in clade_two, '{0}\n{1}\n{2}\n{3}'.format(ortholog_file, clade_one, clade_two, first_a_id)
     return set(genome_ids_a) != set(clade_two) or set(genome_ids_b) != set(clade_one)
 
 
@@ -198,11 +203,14 @@ Usage: filter_orthologs.py
 
 --orthologs-per-genome=FILE      destination file path for orthologs split out per genome, based on the retained.zip
 --concatemer=FILE                destination file path for super-concatemer of all genomes
+--jobs=NUMBER                    number of orthologs to build trees for simultaneously, defaults to number of CPUs
 """
     options = ('orthologs-zip', 'filter-multiple-cogs=?', 'filter-recombination=?', 'recombined-crosstable=?',
-               'taxon-a=?', 'taxon-b=?', 'retained-zip', 'orthologs-per-genome', 'concatemer')
+               'taxon-a=?', 'taxon-b=?', 'retained-zip', 'orthologs-per-genome', 'concatemer', 'jobs=?')
     orthologs_zip, filter_cogs, filter_recombination, recombined_crosstable, \
-    taxona, taxonb, retained_zip, target_orth_per_genome, target_concat_file = parse_options(usage, options, args)
+    taxona, taxonb, retained_zip, target_orth_per_genome, target_concat_file, jobs = \
+        parse_options(usage, options, args)
+    jobs = int(jobs) if jobs else cpu_count()
 
     # Run filtering in a temporary folder, to prevent interference from simultaneous runs
     run_dir = tempfile.mkdtemp(prefix='filter_orthologs_')
@@ -224,8 +232,8 @@ Usage: filter_orthologs.py
             genome_ids_a = [line.split()[0] for line in read_handle]
         with open(taxonb) as read_handle:
             genome_ids_b = [line.split()[0] for line in read_handle]
-        ortholog_files, recombined_files = _phipack_for_all_orthologs(run_dir, ortholog_files,
-                                                                       genome_ids_a, genome_ids_b)
+        ortholog_files, recombined_files = _phipack_for_all_orthologs(ortholog_files, genome_ids_a, genome_ids_b,
+                                                                       jobs)
         # Create crosstable
         create_crosstable(recombined_files, recombined_crosstable)
 
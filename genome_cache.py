@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""Module to keep a manifest of the files in the genome cache, so cache hits can be decided with a single lookup."""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from shared import create_directory
+
+
+__author__ = "Tim te Beek"
+__copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
+__license__ = "MIT"
+
+# Columns stored per cached file; derived translations are stored on the row of the GenBank file they came from
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    genome TEXT,
+    source TEXT,
+    size INTEGER,
+    checksum TEXT,
+    remote_date REAL,
+    retrieved REAL,
+    has_cds INTEGER,
+    dna_file TEXT,
+    protein_file TEXT,
+    translated_checksum TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_genome ON files (genome);
+CREATE TABLE IF NOT EXISTS accessed (
+    path TEXT PRIMARY KEY,
+    last_access REAL
+);
+CREATE TABLE IF NOT EXISTS hit_rates (
+    tree TEXT PRIMARY KEY,
+    hits INTEGER DEFAULT 0,
+    misses INTEGER DEFAULT 0
+);
+'''
+
+
+def file_checksum(path, blocksize=1 << 20):
+    """Return the MD5 hexdigest of the contents of path, read in blocks."""
+    md5 = hashlib.md5()
+    with open(path, mode='rb') as read_handle:
+        for block in iter(lambda: read_handle.read(blocksize), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class GenomeCacheManifest(object):
+    """SQLite manifest of cached genome files, with their size, checksum, remote date and derived translations.
+
+    Each method uses its own short lived connection, so a manifest can be shared between threads and processes."""
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        """Open a connection which returns rows as dictionary like objects."""
+        conn = sqlite3.connect(self.manifest_file, timeout=60)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def lookup(self, path):
+        """Return the manifest row for path, or None when path is not in the manifest."""
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT * FROM files WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        finally:
+            conn.close()
+
+    def is_fresh(self, path, file_age_limit):
+        """Return whether path was retrieved after file_age_limit and still has the size it had when retrieved."""
+        entry = self.lookup(path)
+        if entry is None or entry['retrieved'] < file_age_limit:
+            return False
+        return os.path.isfile(path) and os.path.getsize(path) == entry['size']
+
+    def record_file(self, path, genome=None, source=None, remote_date=None, retrieved=None):
+        """Add or replace the manifest row for a newly retrieved path, which resets any previously derived values."""
+        values = (os.path.abspath(path), genome, source, os.path.getsize(path), file_checksum(path), remote_date,
+                  retrieved if retrieved is not None else time.time())
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO files (path, genome, source, size, checksum, remote_date, retrieved) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)', values)
+
+    def set_has_cds(self, path, has_cds):
+        """Store whether the GenBank file at path contains any coding sequence features."""
+        with self._connect() as conn:
+            conn.execute('UPDATE files SET has_cds = ? WHERE path = ?', (int(has_cds), os.path.abspath(path)))
+
+    def record_translation(self, path, dna_file, protein_file):
+        """Store the DNA & protein files translated from the GenBank file at path, along with its current checksum."""
+        with self._connect() as conn:
+            conn.execute('UPDATE files SET dna_file = ?, protein_file = ?, translated_checksum = checksum '
+                         'WHERE path = ?', (dna_file, protein_file, os.path.abspath(path)))
+
+    def translation_of(self, path):
+        """Return DNA & protein files translated from the current contents of path, or None if not translated yet."""
+        entry = self.lookup(path)
+        if entry is None or entry['dna_file'] is None or entry['translated_checksum'] != entry['checksum']:
+            return None
+        if not (os.path.isfile(entry['dna_file']) and os.path.isfile(entry['protein_file'])):
+            return None
+        return entry['dna_file'], entry['protein_file']
+
+    def record_hit(self, tree, *paths):
+        """Count a cache hit in tree, and mark paths as accessed just now for least recently used eviction."""
+        self._record_access(tree, 'hits', paths)
+
+    def record_miss(self, tree, *paths):
+        """Count a cache miss in tree, and mark the newly created paths as accessed just now."""
+        self._record_access(tree, 'misses', paths)
+
+    def _record_access(self, tree, column, paths):
+        """Increment the hits or misses column for tree, and update the last access time of paths."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO hit_rates (tree) VALUES (?)', (tree,))
+            conn.execute('UPDATE hit_rates SET {0} = {0} + 1 WHERE tree = ?'.format(column), (tree,))
+            conn.executemany('INSERT OR REPLACE INTO accessed (path, last_access) VALUES (?, ?)',
+                             [(os.path.abspath(path), now) for path in paths])
+
+    def last_accesses(self):
+        """Return a dictionary of path to the time it was last created or hit in the cache."""
+        conn = self._connect()
+        try:
+            return dict(conn.execute('SELECT path, last_access FROM accessed').fetchall())
+        finally:
+            conn.close()
+
+    def hit_rates(self):
+        """Return a dictionary of tree to tuples of hits, misses and hit rate."""
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT tree, hits, misses FROM hit_rates ORDER BY tree').fetchall()
+        finally:
+            conn.close()
+        return dict((row['tree'], (row['hits'], row['misses'], row['hits'] / float(row['hits'] + row['misses'] or 1)))
+                    for row in rows)
+
+    def forget(self, path):
+        """Remove all manifest entries for an evicted path, including translations derived from it."""
+        path = os.path.abspath(path)
+        with self._connect() as conn:
+            conn.execute('DELETE FROM files WHERE path = ?', (path,))
+            conn.execute('DELETE FROM accessed WHERE path = ?', (path,))
+            conn.execute('UPDATE files SET dna_file = NULL, protein_file = NULL, translated_checksum = NULL '
+                         'WHERE dna_file = ? OR protein_file = ?', (path, path))
+
+
+def default_manifest():
+    """Return the manifest stored in the base output directory, creating the manifest file if needed."""
+    # Guard against concurrent download threads each creating the manifest schema
+    with default_manifest.lock:
+        if default_manifest.instance is None:
+            default_manifest.instance = GenomeCacheManifest(os.path.join(create_directory(''), 'manifest.sqlite'))
+    return default_manifest.instance
+
+# Lazily assigned, such that tests can override this value
+default_manifest.instance = None
+default_manifest.lock = threading.Lock()
@@ -5,7 +5,6 @@ import argparse
 from collections import defaultdict
 from csv import DictReader
 from datetime import datetime, timedelta
-from ftplib import FTP
 import logging
 from operator import itemgetter
 import os
@@ -30,13 +29,10 @@ def _download_genomes_table():
     # Only download when existing file is older than a day
     time_between_downloads = 24 * 60 * 60
     if not os.path.isfile(output_file) or os.path.getmtime(output_file) < time.time() - time_between_downloads:
-        # Login to FTP site
-        ftp = FTP('ftp.ncbi.nlm.nih.gov')
-        ftp.login(passwd='timtebeek+odose@gmail.com')
-
         # Download ftp://ftp.ncbi.nlm.nih.gov/genomes/GENOME_REPORTS/prokaryotes.txt
-        from download_taxa_ncbi import _download_genome_file
-        _download_genome_file(ftp, '/genomes/GENOME_REPORTS', prokaryotes, cache_dir, datetime.now())
+        from download_taxa_ncbi import _download_genome_file, FTPSessionPool
+        with FTPSessionPool(size=1) as ftp_pool:
+            _download_genome_file(ftp_pool, '/genomes/GENOME_REPORTS', prokaryotes, cache_dir, datetime.now())
 
     # Read file and return content
     with open(output_file) as read_handle:
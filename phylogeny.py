@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Module to calculate distance matrices and UPGMA trees of DNA alignments in process, replacing PHYLIP dnadist and
+neighbor, which needed infiles, interactive subprocesses and tree files for each alignment."""
+
+from Bio.Phylo.BaseTree import Clade, Tree
+from shared import parse_header
+import numpy
+
+__author__ = "Tim te Beek"
+__copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
+__license__ = "MIT"
+
+# Purines and pyrimidines at their index in 'ACGT', used to tell transitions from transversions
+_NUCLEOTIDES = 'ACGT'
+_PURINE = numpy.array([True, False, True, False])
+
+
+def _nucleotide_indicators(alignment):
+    """Return a (4 x sequences x sites) float matrix indicating which nucleotide is present at each site.
+
+    Gaps and ambiguous nucleotides are indicated by none of the four rows, and so ignored in pairwise comparisons."""
+    matrix = numpy.frombuffer(''.join(str(seqr.seq).upper() for seqr in alignment),
+                              dtype=numpy.uint8).reshape(len(alignment), -1)
+    return numpy.array([matrix == ord(nucleotide) for nucleotide in _NUCLEOTIDES], dtype=numpy.float32)
+
+
+def distance_matrix(alignment, model='F84'):
+    """Return the pairwise evolutionary distances between sequences in alignment as a symmetric matrix.
+
+    Distances follow either the F84 model with empirical base frequencies, as by default in PHYLIP dnadist, or the
+    Kimura 2-parameter (K80) model. Sites with a gap or ambiguous nucleotide in either sequence of a pair are ignored.
+    Saturated pairs, for which the distance is undefined, are assigned twice the largest defined distance."""
+    indicators = _nucleotide_indicators(alignment)
+
+    # Count all 16 combinations of nucleotides between all pairs of sequences, using one matrix product per combination
+    pair_counts = numpy.array([[indicators[first].dot(indicators[second].T) for second in range(4)]
+                               for first in range(4)], dtype=float)
+    compared = pair_counts.sum(axis=(0, 1))
+    identical = sum(pair_counts[index, index] for index in range(4))
+    transitions = pair_counts[0, 2] + pair_counts[2, 0] + pair_counts[1, 3] + pair_counts[3, 1]
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        fraction_transitions = transitions / compared
+        fraction_transversions = (compared - identical - transitions) / compared
+
+        if model == 'K80':
+            distances = (-0.5 * numpy.log(1 - 2 * fraction_transitions - fraction_transversions)
+                         - 0.25 * numpy.log(1 - 2 * fraction_transversions))
+        elif model == 'F84':
+            # Empirical base frequencies over all sequences
+            freqs = indicators.sum(axis=(1, 2)) / indicators.sum()
+            purines, pyrimidines = freqs[_PURINE].sum(), freqs[~_PURINE].sum()
+            a_value = freqs[1] * freqs[3] / pyrimidines + freqs[0] * freqs[2] / purines
+            b_value = freqs[1] * freqs[3] + freqs[0] * freqs[2]
+            c_value = purines * pyrimidines
+            distances = (-2 * a_value * numpy.log(1 - fraction_transitions / (2 * a_value)
+                                                  - (a_value - b_value) * fraction_transversions
+                                                  / (2 * a_value * c_value))
+                         + 2 * (a_value - b_value - c_value) * numpy.log(1 - fraction_transversions / (2 * c_value)))
+        else:
+            raise ValueError('Unsupported distance model: ' + model)
+
+    # Distances between a sequence and itself are zero, and saturated distances are replaced by a large finite value
+    numpy.fill_diagonal(distances, 0)
+    defined = numpy.isfinite(distances)
+    distances[~defined] = 2 * distances[defined].max() if defined.any() and distances[defined].max() else 1
+    return numpy.maximum(distances, 0)
+
+
+def upgma(names, distances):
+    """Return a rooted UPGMA tree of names clustered on their distances, as PHYLIP neighbor does with its N option.
+
+    Clusters are merged by smallest average distance, with ties resolved in favor of the first pair in names order."""
+    distances = numpy.array(distances, dtype=float)
+    numpy.fill_diagonal(distances, numpy.inf)
+    clades = [Clade(name=name) for name in names]
+    heights = [0.] * len(names)
+    sizes = [1] * len(names)
+    active = range(len(names))
+
+    while 1 < len(active):
+        # Find the closest pair of active clusters
+        sub_matrix = distances[numpy.ix_(active, active)]
+        first, second = sorted(numpy.unravel_index(numpy.argmin(sub_matrix), sub_matrix.shape))
+        first, second = active[first], active[second]
+
+        # Join both clusters in a new clade placed at half their distance
+        height = distances[first, second] / 2
+        clades[first].branch_length = max(height - heights[first], 0)
+        clades[second].branch_length = max(height - heights[second], 0)
+        clades[first] = Clade(clades=[clades[first], clades[second]])
+        heights[first] = height
+
+        # Distances to the joined cluster are averages over all members, so weighted by cluster size
+        merged = (distances[first] * sizes[first] + distances[second] * sizes[second]) / (sizes[first] + sizes[second])
+        distances[first, :] = distances[:, first] = merged
+        distances[first, first] = numpy.inf
+        sizes[first] += sizes[second]
+        active.remove(second)
+
+    return Tree(root=clades[active[0]], rooted=True)
+
+
+def root_bipartition(tree):
+    """Return the sorted leaf names of the two clades that split up the tree at its root."""
+    clades = tree.root.clades
+    assert len(clades) == 2, 'Expected two clades as child of tree\'s first clade, but was {0}'.format(len(clades))
+    return tuple(sorted(leaf.name for leaf in clade.get_terminals()) for clade in clades)
+
+
+def alignment_tree(alignment, model='F84'):
+    """Return the UPGMA tree of the sequences in alignment, named after the genome ID in their header."""
+    names = [parse_header(seqr.id).genome for seqr in alignment]
+    return upgma(names, distance_matrix(alignment, model))
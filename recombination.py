@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""Module to test alignments for recombination in process, with the PHI, Max Chi^2 and NSS statistics of PhiPack.
+
+Statistics follow Bruen, Philippe & Bryant (2006), who introduced PHI and implemented all three tests in PhiPack."""
+
+from __future__ import division
+from alignment_matrix import alignment_matrix
+from multiprocessing import Pool
+import math
+import numpy
+
+__author__ = "Tim te Beek"
+__copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
+__license__ = "MIT"
+
+# PhiPack defaults: pairs of informative sites within a window of 100 sites contribute to PHI, 1000 permutations
+WINDOW = 100
+PERMUTATIONS = 1000
+_CHUNK = 100
+# Number of sites for which incompatibilities with all other sites are scored at once, which bounds memory use
+_BLOCK = 64
+
+_NUCLEOTIDES = numpy.array([ord(nucleotide) for nucleotide in 'ACGT'], dtype=numpy.uint8)
+
+
+def informative_sites(matrix):
+    """Return a (sequences x informative sites) matrix of nucleotide states 0 to 3.
+
+    Sites are informative when at least two states occur at least twice each. As sites with gaps or ambiguous
+    nucleotides can not be compared across all sequences, such sites are left out."""
+    states = numpy.argmax(matrix[:, :, numpy.newaxis] == _NUCLEOTIDES, axis=2)
+    unambiguous = numpy.in1d(matrix, _NUCLEOTIDES).reshape(matrix.shape).all(axis=0)
+    counts = numpy.array([(states == state).sum(axis=0) for state in range(4)])
+    informative = unambiguous & (2 <= (2 <= counts).sum(axis=0))
+    return states[:, informative]
+
+
+def incompatibility_matrix(sites):
+    """Return the refined incompatibility scores between all pairs of informative sites.
+
+    The score of a pair is the minimum number of homoplasies needed to explain both sites on any tree: the number of
+    distinct state pairs, minus the number of states, plus the number of connected components of the graph linking
+    states observed together in a sequence."""
+    one_hot = (sites[:, :, numpy.newaxis] == numpy.arange(4)).astype(numpy.float32)
+    # Score blocks of sites against all sites, rather than materializing (sites x sites x 4 x 4) arrays at once
+    return numpy.concatenate([_incompatibility_rows(one_hot[:, start:start + _BLOCK], one_hot)
+                              for start in range(0, one_hot.shape[1], _BLOCK)] or [numpy.zeros((0, 0), dtype=int)])
+
+
+def _incompatibility_rows(row_one_hot, one_hot):
+    """Return the refined incompatibility scores between the sites in row_one_hot and all sites in one_hot."""
+    # Boolean (rows x sites x 4 x 4) matrix of the state pairs observed together in any of the sequences
+    rows, size = row_one_hot.shape[1], one_hot.shape[1]
+    counts = numpy.dot(row_one_hot.reshape(-1, rows * 4).T, one_hot.reshape(-1, size * 4))
+    pairs = 0 < counts.reshape(rows, 4, size, 4).transpose(0, 2, 1, 3)
+    edges = pairs.sum(axis=(2, 3))
+    row_states = pairs.any(axis=3)
+    vertices = row_states.sum(axis=2) + pairs.any(axis=2).sum(axis=2)
+
+    # Connect states of the first site through shared states of the second site, until all paths are closed
+    weights = pairs.astype(numpy.float32)
+    reach = 0 < numpy.matmul(weights, weights.swapaxes(2, 3))
+    for _ in range(2):
+        weights = reach.astype(numpy.float32)
+        reach = 0 < numpy.matmul(weights, weights)
+
+    # Each component contributes one over its size for each of its states of the first site
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        components = numpy.where(row_states, 1 / reach.sum(axis=3).astype(float), 0).sum(axis=2)
+    return numpy.rint(edges - vertices + components).astype(int)
+
+
+def _matrix_sums(matrix):
+    """Return the sum of all elements, the sum of all squared elements, and the sum of squared row sums."""
+    return matrix.sum(), (matrix ** 2).sum(), (matrix.sum(axis=1) ** 2).sum()
+
+
+def _window_sums(size, window):
+    """Return the sums of _matrix_sums for the symmetric matrix indicating pairs of positions within window of each
+    other, without creating that (size x size) matrix."""
+    # Each position has up to window neighbours on either side, and all elements are zero or one
+    positions = numpy.arange(size)
+    row_sums = (numpy.minimum(positions, window) + numpy.minimum(size - 1 - positions, window)).astype(float)
+    return row_sums.sum(), row_sums.sum(), (row_sums ** 2).sum()
+
+
+def _window_sum(matrix, window):
+    """Return the sum of all elements of matrix for pairs of positions within window of each other."""
+    return sum(numpy.diagonal(matrix, offset).sum() + numpy.diagonal(matrix, -offset).sum()
+               for offset in range(1, min(window, len(matrix) - 1) + 1))
+
+
+def _permutation_moments(size, first_sums, second_sums):
+    """Return the mean and variance of sum(first[i, j] * second[p(i), p(j)]) over all ordered pairs i != j, when p
+    is a uniformly random permutation, for symmetric (size x size) matrices with zero diagonals, given their
+    _matrix_sums."""
+    a_1, a_2, a_3 = first_sums
+    b_1, b_2, b_3 = second_sums
+
+    pairs = size * (size - 1)
+    mean = a_1 * b_1 / pairs
+    variance = (2 * a_2 * b_2 / pairs
+                + 4 * (a_3 - a_2) * (b_3 - b_2) / (pairs * (size - 2))
+                + (a_1 ** 2 + 2 * a_2 - 4 * a_3) * (b_1 ** 2 + 2 * b_2 - 4 * b_3) / (pairs * (size - 2) * (size - 3))
+                - mean ** 2)
+    return mean, variance
+
+
+def phi_normal(incompatibility, window=WINDOW):
+    """Return the p-value of PHI under the normal approximation of its permutation distribution, or None when PHI can
+    not be calculated for lack of informative sites.
+
+    Low PHI values, with compatible sites close together, indicate recombination."""
+    size = len(incompatibility)
+    if size < 4:
+        return None
+    observed = _window_sum(incompatibility, window)
+    mean, variance = _permutation_moments(size, _window_sums(size, window),
+                                          _matrix_sums(incompatibility.astype(float)))
+    if variance <= 0:
+        return None
+    return 0.5 * math.erfc(-(observed - mean) / math.sqrt(2 * variance))
+
+
+def _max_chi2(sites, order):
+    """Return the maximum chi square over all pairs of sequences and all breakpoints, for sites in order."""
+    first, second = numpy.triu_indices(len(sites), 1)
+    differences = (sites[first][:, order] != sites[second][:, order]).astype(float)
+    total_sites = differences.shape[1]
+    total_differences = differences.sum(axis=1)[:, numpy.newaxis]
+
+    # Contingency of differences left and right of each breakpoint between consecutive sites
+    left_sites = numpy.arange(1, total_sites)
+    right_sites = total_sites - left_sites
+    left_differences = numpy.cumsum(differences, axis=1)[:, :-1]
+    right_differences = total_differences - left_differences
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        chi2 = (total_sites * (left_differences * (right_sites - right_differences)
+                               - right_differences * (left_sites - left_differences)) ** 2
+                / (left_sites * right_sites * total_differences * (total_sites - total_differences)))
+    chi2[~numpy.isfinite(chi2)] = 0
+    return chi2.max() if chi2.size else 0
+
+
+def _neighbour_similarity(incompatibility, orders):
+    """Return the fraction of neighbouring informative sites that are compatible, for each of the site orders."""
+    return (incompatibility[orders[:, :-1], orders[:, 1:]] == 0).mean(axis=1)
+
+
+def _permuted_statistics((sites, incompatibility, permutations, seed)):
+    """Return Max Chi^2 and NSS for each of a number of random permutations of the informative sites."""
+    random = numpy.random.RandomState(seed)
+    orders = numpy.array([random.permutation(sites.shape[1]) for _ in range(permutations)])
+    return numpy.array([_max_chi2(sites, order) for order in orders]), _neighbour_similarity(incompatibility, orders)
+
+
+def recombination_values(alignment, window=WINDOW, permutations=PERMUTATIONS, jobs=1, seed=0, pool=None):
+    """Return the number of informative sites and the PHI, Max Chi^2 and NSS p-values for alignment, keyed as the
+    values returned by run_phipack.
+
+    Permutations are split over the worker processes of pool when given, such that callers can share a single pool
+    across alignments, or otherwise over jobs worker processes when jobs is larger than one."""
+    sites = informative_sites(alignment_matrix(alignment))
+    values = {'PhiPack sites': sites.shape[1], 'Phi': None, 'Max Chi^2': None, 'NSS': None}
+    if sites.shape[1] < 2:
+        return values
+
+    incompatibility = incompatibility_matrix(sites)
+    values['Phi'] = phi_normal(incompatibility, window)
+
+    # Compare observed Max Chi^2 and NSS against those of permuted site orders, where high values indicate recombination
+    identity = numpy.arange(sites.shape[1])
+    observed_chi2 = _max_chi2(sites, identity)
+    observed_nss = _neighbour_similarity(incompatibility, identity[numpy.newaxis])[0]
+    # Permutations are drawn in chunks with their own seed, so results do not depend on the number of jobs
+    chunks = [(sites, incompatibility, min(_CHUNK, permutations - start), seed + index)
+              for index, start in enumerate(range(0, permutations, _CHUNK))]
+    if pool is not None:
+        results = pool.map(_permuted_statistics, chunks)
+    elif 1 < jobs:
+        pool = Pool(jobs)
+        try:
+            results = pool.map(_permuted_statistics, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_permuted_statistics(chunk) for chunk in chunks]
+    permuted_chi2 = numpy.concatenate([chi2 for chi2, _ in results])
+    permuted_nss = numpy.concatenate([nss for _, nss in results])
+
+    values['Max Chi^2'] = (permuted_chi2 >= observed_chi2).mean()
+    values['NSS'] = (permuted_nss >= observed_nss).mean()
+    return values
@@ -3,17 +3,21 @@
 
 from Bio import AlignIO
 from Bio.Align import MultipleSeqAlignment
-from Bio.Data import CodonTable
 from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import logging
 import os.path
+import re
 import shutil
 from subprocess import check_call, STDOUT
 import sys
 import tempfile
 
+from alignment_matrix import alignment_matrix, without_stop_codons
+from dnds import nei_gojobori
 from shared import create_directory, extract_archive_of_files, create_archive_of_files, parse_options, \
-    CODON_TABLE_ID
+    parse_header, CODON_TABLE_ID
 from versions import CODEML
 
 
@@ -22,16 +26,30 @@ __copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
 __license__ = "MIT"
 
 
-def run_codeml_for_sicos(codeml_dir, genome_ids_a, genome_ids_b, sico_files):
-    """Run codeml for representatives of clades A and B in each of the SICO files, to calculate dN/dS."""
+# Estimators of pairwise dN/dS: codeml from PAML, or Nei-Gojobori counting in process
+ESTIMATORS = ('codeml', 'nei_gojobori')
+
+# Number of sequence pairs passed to a single codeml run as separate data sets, to amortize its startup and file I/O
+# Batching is opt in, as parsing the output of multiple data sets has not been verified against real codeml output yet
+BATCH_SIZE = 1
+
+
+def run_codeml_for_sicos(codeml_dir, genome_ids_a, genome_ids_b, sico_files, estimator='codeml', batch_size=1,
+                         jobs=None):
+    """Run codeml for representatives of clades A and B in each of the SICO files, to calculate dN/dS.
+
+    With the nei_gojobori estimator, or codeml in batches of more than one pair, values are written to files in the same
+    format as the last line of codeml output."""
     logging.info('Running codeml for %s aligned and trimmed SICOs', len(sico_files))
 
     codeml_files = []
+    pairs = []
     for sico_file in sico_files:
         # Separate alignments for clade A & clade B genomes
         ali = AlignIO.read(sico_file, 'fasta')
-        alignment_a = MultipleSeqAlignment(seqr for seqr in ali if seqr.id.split('|')[0] in genome_ids_a)
-        alignment_b = MultipleSeqAlignment(seqr for seqr in ali if seqr.id.split('|')[0] in genome_ids_b)
+        genomes = [parse_header(seqr.id).genome for seqr in ali]
+        alignment_a = MultipleSeqAlignment(seqr for seqr, genome in zip(ali, genomes) if genome in genome_ids_a)
+        alignment_b = MultipleSeqAlignment(seqr for seqr, genome in zip(ali, genomes) if genome in genome_ids_b)
 
         # Create sub directory for this run based on sico_file name
         filename = os.path.split(sico_file)[1]
@@ -39,35 +57,97 @@ def run_codeml_for_sicos(codeml_dir, genome_ids_a, genome_ids_b, sico_files):
         base_name = filename[:filename.find('.')]
         sub_dir = create_directory(base_name, inside_dir=codeml_dir)
 
-        # Submit for asynchronous calculation
-        codeml_file = run_codeml(sub_dir, alignment_a, alignment_b)
-        codeml_files.append(codeml_file)
+        # Run codeml for this SICO alone, or collect pairs for batched or in process estimation below
+        if estimator == 'codeml' and batch_size <= 1:
+            codeml_files.append(run_codeml(sub_dir, alignment_a, alignment_b))
+        else:
+            codeml_files.append(os.path.join(sub_dir, base_name + '.codeml'))
+            pairs.append((alignment_a, alignment_b))
 
-    return codeml_files
+    # Write out values per SICO, in the same order as the SICO files
+    if pairs:
+        for value_dict, codeml_file in zip(pairwise_dnds_for_all(pairs, estimator, batch_size, jobs), codeml_files):
+            _write_codeml_values(value_dict, codeml_file)
 
-# Using the standard NCBI Bacterial, Archaeal and Plant Plastid Code translation table (11).
-BACTERIAL_CODON_TABLE = CodonTable.unambiguous_dna_by_id.get(CODON_TABLE_ID)
+    return codeml_files
 
 
-def run_codeml(sub_dir, alignment_a, alignment_b):
-    """Run codeml from PAML for selected sequence records from sico_file, returning main nexus output file."""
+def _representative_sequences(alignment_a, alignment_b):
+    """Return the first sequences of alignment_a and alignment_b as representatives, without codons that are a stop
+    codon in either sequence."""
     # Note on whether or not I should be randomizing the below representative selection:
     # "both alternatives have their advantages - just selecting one strain for the shared calculation means that you
     # know exactly which strains the shared comes from - but if this strain is anomalous then you might get some
     # strange results. i think i would stick with a single strain" - AEW
 
     # Select first sequences from each clade as representatives
-    ab_alignment = MultipleSeqAlignment([alignment_a[0], alignment_b[0]])
+    ab_matrix = alignment_matrix([alignment_a[0], alignment_b[0]])
 
     # Codeml chokes when presented with an sequence containing stopcodons: strip those out
-    sequence_a = ''
-    sequence_b = ''
-    for index in range(0, len(ab_alignment[0]), 3):
-        codon_a = str(ab_alignment[0][index:index + 3].seq)
-        codon_b = str(ab_alignment[1][index:index + 3].seq)
-        if codon_a not in BACTERIAL_CODON_TABLE.stop_codons and codon_b not in BACTERIAL_CODON_TABLE.stop_codons:
-            sequence_a += codon_a
-            sequence_b += codon_b
+    sequence_a, sequence_b = without_stop_codons(ab_matrix, CODON_TABLE_ID)
+    return sequence_a.tostring(), sequence_b.tostring()
+
+
+def pairwise_dnds(alignment_a, alignment_b, estimator='codeml'):
+    """Return the dN/dS values for representatives of alignment_a and alignment_b, as by parse_codeml_output."""
+    assert estimator in ESTIMATORS, 'Estimator should be one of {0}: {1}'.format(ESTIMATORS, estimator)
+    if estimator == 'nei_gojobori':
+        return nei_gojobori(*_representative_sequences(alignment_a, alignment_b))
+
+    # Run codeml in a temporary directory, as it writes a number of files to its working directory
+    subdir = tempfile.mkdtemp(prefix='codeml_')
+    try:
+        return parse_codeml_output(run_codeml(subdir, alignment_a, alignment_b))
+    finally:
+        shutil.rmtree(subdir)
+
+
+def pairwise_dnds_for_all(pairs, estimator='codeml', batch_size=BATCH_SIZE, jobs=None):
+    """Return the dN/dS values for each of the pairs of alignments, in order, as by parse_codeml_output.
+
+    Codeml runs once per pair, or once per batch of batch_size pairs when larger than one, divided over jobs
+    simultaneous codeml processes."""
+    if estimator != 'codeml':
+        return [pairwise_dnds(alignment_a, alignment_b, estimator) for alignment_a, alignment_b in pairs]
+
+    # Codeml runs as a subprocess, so a pool of threads suffices to keep multiple codeml processes busy
+    pool = ThreadPool(jobs or cpu_count())
+    try:
+        if batch_size <= 1:
+            return pool.map(lambda (alignment_a, alignment_b): pairwise_dnds(alignment_a, alignment_b), pairs)
+        batches = [pairs[start:start + batch_size] for start in range(0, len(pairs), batch_size)]
+        return [value_dict for values in pool.map(_run_codeml_batch, batches) for value_dict in values]
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _run_codeml_batch(pairs):
+    """Run codeml once for all pairs of alignments as separate data sets, and return the values per data set."""
+    sub_dir = tempfile.mkdtemp(prefix='codeml_batch_')
+    try:
+        # Write all representative sequence pairs to a single file as consecutive data sets
+        phylip_file = os.path.join(sub_dir, 'batch.phy')
+        _write_phylip_datasets([_representative_sequences(alignment_a, alignment_b)
+                                for alignment_a, alignment_b in pairs], phylip_file)
+
+        # Generate codeml configuration file for the number of data sets
+        output_file = os.path.join(sub_dir, 'batch.codeml')
+        config_file = os.path.join(sub_dir, 'codeml.ctl')
+        _write_config_file(phylip_file, output_file, config_file, ndata=len(pairs))
+
+        # Run codeml
+        command = [CODEML, os.path.split(config_file)[1]]
+        with open(os.devnull, mode='w') as devnull:
+            check_call(command, cwd=sub_dir, stdout=devnull, stderr=STDOUT)
+        return parse_codeml_batch_output(output_file, len(pairs))
+    finally:
+        shutil.rmtree(sub_dir)
+
+
+def run_codeml(sub_dir, alignment_a, alignment_b):
+    """Run codeml from PAML for selected sequence records from sico_file, returning main nexus output file."""
+    sequence_a, sequence_b = _representative_sequences(alignment_a, alignment_b)
 
     # Write the representative sequence records out to file in codeml compatible format
     base_name = os.path.split(sub_dir)[1]
@@ -81,7 +161,8 @@ def run_codeml(sub_dir, alignment_a, alignment_b):
 
     # Run codeml
     command = [CODEML, os.path.split(config_file)[1]]
-    check_call(command, cwd=sub_dir, stdout=open('/dev/null', mode='w'), stderr=STDOUT)
+    with open(os.devnull, mode='w') as devnull:
+        check_call(command, cwd=sub_dir, stdout=devnull, stderr=STDOUT)
 
     assert os.path.isfile(output_file) and os.path.getsize(output_file), 'Expected some content in ' + output_file
     return output_file
@@ -104,12 +185,21 @@ end;
         write_handle.write(nexus_contents)
 
 
-def _write_config_file(nexus_file, output_file, config_file):
+def _write_phylip_datasets(sequence_pairs, phylip_file):
+    """Write pairs of representative sequences to a single file as consecutive data sets in sequential PHYLIP format."""
+    with open(phylip_file, mode='w') as write_handle:
+        for sequence_a, sequence_b in sequence_pairs:
+            write_handle.write('  2  {0}\nclade_a  {1}\nclade_b  {2}\n\n'.format(len(sequence_a), sequence_a,
+                                                                               sequence_b))
+
+
+def _write_config_file(nexus_file, output_file, config_file, ndata=1):
     """Write a codeml configuration file using relative paths to the nexus file and output file."""
     config_contents = '''
       seqfile = {0} * sequence data filename
       outfile = {1}           * main result file name
      treefile = test.tree      * tree structure file name
+        ndata = {2}  * number of data sets in seqfile
 
         noisy = 9  * 0,1,2,3,9: how much rubbish on the screen
       verbose = 0  * 1: detailed output, 0: concise output
@@ -162,7 +252,7 @@ def _write_config_file(nexus_file, output_file, config_file):
 *   cleandata = 0  * remove sites with ambiguity data (1:yes, 0:no)?
 * fix_blength = 0
        method = 0   * 0: simultaneous; 1: one branch at a time
-'''.format(os.path.split(nexus_file)[1], os.path.split(output_file)[1])
+'''.format(os.path.split(nexus_file)[1], os.path.split(output_file)[1], ndata)
     with open(config_file, mode='w') as write_handle:
         write_handle.write(config_contents)
 
@@ -171,22 +261,44 @@ def parse_codeml_output(codeml_file):
     """Parse last line of codeml output file to read initial values, and calculate Dn & Ds as derived values."""
     with open(codeml_file) as read_handle:
         # Extract & parse last line
-        last_line = deque(read_handle).pop()
-        # Example lines:
-        # t=50.0000  S=    97.9  N=   328.1  dN/dS= 0.0113  dN= 0.7872  dS=69.8724
-        # t= 1.0569  S=   387.3  N=   950.7  dN/dS= 0.0236  dN= 0.0272  dS= 1.1503
+        return _parse_codeml_values(deque(read_handle).pop())
+
+
+def parse_codeml_batch_output(codeml_file, ndata):
+    """Parse the values of each of ndata data sets from a codeml output file, in order, as by parse_codeml_output."""
+    with open(codeml_file) as read_handle:
+        contents = read_handle.read()
+
+    # Output for each data set starts with a 'Data set N' line, and ends with the line of pairwise values
+    sections = re.split(r'(?m)^\s*Data set \d+\s*$', contents)[1:]
+    assert len(sections) == ndata, 'Expected {0} data sets in {1}, but found {2}'.format(ndata, codeml_file,
+                                                                                        len(sections))
+    return [_parse_codeml_values(re.findall(r'(?m)^t=.*$', section)[-1]) for section in sections]
+
+
+def _parse_codeml_values(last_line):
+    """Parse a line of pairwise codeml values, and calculate Dn & Ds as derived values."""
+    # Example lines:
+    # t=50.0000  S=    97.9  N=   328.1  dN/dS= 0.0113  dN= 0.7872  dS=69.8724
+    # t= 1.0569  S=   387.3  N=   950.7  dN/dS= 0.0236  dN= 0.0272  dS= 1.1503
+    iterator = iter(item.strip() for item in last_line.replace('=', ' ').split())
+    # Use the same above iterator twice in zip to create pairs from sequential items, which we can feed into dict
+    value_dict = dict(zip(iterator, iterator))
+
+    for key, value in value_dict.iteritems():
+        value_dict[key] = float(value)
 
-        iterator = iter(item.strip() for item in last_line.replace('=', ' ').split())
-        # Use the same above iterator twice in zip to create pairs from sequential items, which we can feed into dict
-        value_dict = dict(zip(iterator, iterator))
+    # Below calculations according to AEW to get large D values
+    value_dict['Dn'] = float(value_dict['dN']) * float(value_dict['N'])
+    value_dict['Ds'] = float(value_dict['dS']) * float(value_dict['S'])
+    return value_dict
 
-        for key, value in value_dict.iteritems():
-            value_dict[key] = float(value)
 
-        # Below calculations according to AEW to get large D values
-        value_dict['Dn'] = float(value_dict['dN']) * float(value_dict['N'])
-        value_dict['Ds'] = float(value_dict['dS']) * float(value_dict['S'])
-        return value_dict
+def _write_codeml_values(value_dict, codeml_file):
+    """Write values to codeml_file in the format of the last line of codeml output, for parse_codeml_output."""
+    with open(codeml_file, mode='w') as write_handle:
+        write_handle.write('t={0[t]:8.4f}  S={0[S]:8.1f}  N={0[N]:8.1f}  dN/dS={0[dN/dS]:7.4f}  dN={0[dN]:7.4f}  '
+                           'dS={0[dS]:7.4f}\n'.format(value_dict))
 
 
 def _write_dnds_per_ortholog(dnds_file, codeml_files):
@@ -215,9 +327,15 @@ Usage: run_codeml.py
 --sico-zip=FILE      archive of aligned & trimmed single copy orthologous (SICO) genes
 --codeml-zip=FILE     destination file path for archive of codeml output per SICO gene
 --dnds-stats=FILE     destination file path for file with dN, dS & dN/dS values per SICO gene
+--estimator=NAME      estimate dN/dS with codeml (default) or in process with nei_gojobori
+--jobs=NUMBER         number of codeml processes to run simultaneously, defaults to number of CPUs
 """
-    options = ['genomes-a', 'genomes-b', 'sico-zip', 'codeml-zip', 'dnds-stats']
-    genome_a_ids_file, genome_b_ids_file, sico_zip, codeml_zip, dnds_file = parse_options(usage, options, args)
+    options = ['genomes-a', 'genomes-b', 'sico-zip', 'codeml-zip', 'dnds-stats', 'estimator=?', 'jobs=?']
+    genome_a_ids_file, genome_b_ids_file, sico_zip, codeml_zip, dnds_file, estimator, jobs = \
+        parse_options(usage, options, args)
+    estimator = estimator or 'codeml'
+    jobs = int(jobs) if jobs else cpu_count()
+    assert estimator in ESTIMATORS, 'Estimator should be one of {0}: {1}'.format(ESTIMATORS, estimator)
 
     # Parse file to extract GenBank Project IDs
     with open(genome_a_ids_file) as read_handle:
@@ -231,8 +349,9 @@ Usage: run_codeml.py
     # Extract files from zip archive
     sico_files = extract_archive_of_files(sico_zip, create_directory('sicos', inside_dir=run_dir))
 
-    # Actually run codeml
-    codeml_files = run_codeml_for_sicos(run_dir, genome_ids_a, genome_ids_b, sico_files)
+    # Actually run codeml, one pair at a time; batched runs are not offered here until verified against real codeml
+    # output of multiple data sets
+    codeml_files = run_codeml_for_sicos(run_dir, genome_ids_a, genome_ids_b, sico_files, estimator, jobs=jobs)
 
     # Write dnds values to single output file
     _write_dnds_per_ortholog(dnds_file, codeml_files)
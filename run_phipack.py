@@ -2,12 +2,18 @@
 """Module to filter orthologs when recombination is found through PhiPack."""
 
 from __future__ import division
-from Bio import SeqIO
-from shared import create_directory, extract_archive_of_files, parse_options, get_most_recent_gene_name, \
-    find_cogs_in_sequence_records
+from Bio import AlignIO, SeqIO
+from genome_cache import default_manifest
+from shared import create_directory, extract_archive_of_files, parse_options, parse_header, ortholog_metadata, \
+    GenomeRanking
 from select_taxa import select_genomes_by_ids
+from recombination import recombination_values, PERMUTATIONS, WINDOW
 from versions import PHIPACK
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 from subprocess import check_call, CalledProcessError
+import hashlib
+import json
 import logging as log
 import os.path
 import re
@@ -20,7 +26,14 @@ __copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
 __license__ = "MIT"
 
 
-def _phipack_for_all_orthologs(run_dir, aligned_files, stats_file):
+# Arguments passed to PhiPack besides the input file: Output NSS & Max Chi^2
+PHIPACK_ARGS = ('-o',)
+
+# Backends to calculate recombination values with: the PhiPack executable, or the in process recombination module
+BACKENDS = ('phipack', 'native')
+
+
+def _phipack_for_all_orthologs(run_dir, aligned_files, stats_file, jobs=1, backend='phipack'):
     """Filter aligned fasta files where there is evidence of recombination when inspecting PhiPack values.
     Return two collections of aligned files, the first without recombination, the second with recombination."""
 
@@ -39,28 +52,25 @@ def _phipack_for_all_orthologs(run_dir, aligned_files, stats_file):
                                       'Product']) + '\n')
 
         # Retrieve unique genomes from first ortholog file
-        genome_ids = set(fasta_record.id.split('|')[0] for fasta_record in SeqIO.parse(aligned_files[0], 'fasta'))
-        genome_dicts = select_genomes_by_ids(genome_ids).values()
+        genome_ids = set(parse_header(fasta_record.id).genome
+                         for fasta_record in SeqIO.parse(aligned_files[0], 'fasta'))
+        ranking = GenomeRanking(select_genomes_by_ids(genome_ids).values())
+
+        # Run PhiPack for all orthologs in parallel, before writing out their values in order
+        all_phipack_values = run_phipack_for_all(phipack_dir, aligned_files, jobs, backend)
 
         # Assign ortholog files to the correct collection based on whether they show recombination
-        for ortholog_file in aligned_files:
+        for ortholog_file, phipack_values in zip(aligned_files, all_phipack_values):
             orth_name = os.path.split(ortholog_file)[1].split('.')[0]
 
-            # Parse tree file to ensure all genome_ids_a & genome_ids_b group together in the tree
-            phipack_values = run_phipack(phipack_dir, ortholog_file)
-
             # Write PhiPack values to line
             write_handle.write('{0}\t{1[PhiPack sites]}\t{1[Phi]}\t{1[Max Chi^2]}\t{1[NSS]}'.format(orth_name,
                                                                                                     phipack_values))
 
-            # Parse sequence records again, but now to retrieve cogs and products
-            seq_records = list(SeqIO.parse(ortholog_file, 'fasta'))
-            # COGs
-            cogs = find_cogs_in_sequence_records(seq_records)
-            write_handle.write('\t' + ','.join(cogs))
-            # Product
-            product = get_most_recent_gene_name(genome_dicts, seq_records)
-            write_handle.write('\t' + product)
+            # Parse sequence headers once to retrieve COGs and product
+            metadata = ortholog_metadata(ortholog_file, ranking)
+            write_handle.write('\t' + ','.join(metadata.cogs))
+            write_handle.write('\t' + metadata.product)
 
             # End line
             write_handle.write('\n')
@@ -68,16 +78,71 @@ def _phipack_for_all_orthologs(run_dir, aligned_files, stats_file):
     # Nothing to return, the stats_file is the product
 
 
-def run_phipack(phipack_dir, dna_file):
-    """Run PhiPack and return the number of informative sites, PHI, Max Chi^2 and NSS."""
+def run_phipack_for_all(phipack_dir, dna_files, jobs=None, backend='phipack', cache_dir=None, manifest=None):
+    """Run PhiPack for all dna_files in a pool of jobs, and return their values in the same order as dna_files."""
+    jobs = jobs or cpu_count()
+    if jobs <= 1:
+        return [run_phipack(phipack_dir, dna_file, backend, cache_dir, manifest) for dna_file in dna_files]
+
+    # The native backend splits the permutations of each file over worker processes, in a single pool for all files
+    if backend == 'native':
+        pool = Pool(jobs)
+        try:
+            return [run_phipack(phipack_dir, dna_file, backend, cache_dir, manifest, pool=pool)
+                    for dna_file in dna_files]
+        finally:
+            pool.close()
+            pool.join()
+
+    # PhiPack runs as a subprocess, so a pool of threads keeps cores busy
+    pool = ThreadPool(jobs)
+    try:
+        return pool.map(lambda dna_file: run_phipack(phipack_dir, dna_file, backend, cache_dir, manifest), dna_files)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _phipack_cache_file(dna_file, backend='phipack', cache_dir=None):
+    """Return the path to the cached PhiPack values for the sequences in dna_file with the current backend arguments."""
+    # Default to the shared cache directory, which callers such as tests can override
+    cache_dir = cache_dir or create_directory('phipack')
+    if backend == 'phipack':
+        sha1 = hashlib.sha1('{0}\n{1}\n'.format(PHIPACK, ' '.join(PHIPACK_ARGS)))
+    else:
+        sha1 = hashlib.sha1('native\nwindow {0}\npermutations {1}\n'.format(WINDOW, PERMUTATIONS))
+    for seqr in SeqIO.parse(dna_file, 'fasta'):
+        sha1.update(str(seqr.seq).upper() + '\n')
+    key = sha1.hexdigest()
+    return os.path.join(create_directory(key[:2], inside_dir=cache_dir), key + '.json')
+
+
+def run_phipack(phipack_dir, dna_file, backend='phipack', cache_dir=None, manifest=None, jobs=1, pool=None):
+    """Run PhiPack or its native backend and return the number of informative sites, PHI, Max Chi^2 and NSS.
+
+    Values are cached by alignment content, so reruns on the same orthologs reuse values from earlier runs. The native
+    backend runs its permutations in the worker processes of pool, or else in jobs worker processes."""
+    assert backend in BACKENDS, 'Backend should be one of {0}: {1}'.format(BACKENDS, backend)
+    cache_file = _phipack_cache_file(dna_file, backend, cache_dir)
+    if os.path.isfile(cache_file):
+        (manifest or default_manifest()).record_hit('phipack', cache_file)
+        with open(cache_file) as read_handle:
+            return json.load(read_handle)
+
+    if backend == 'native':
+        phipack_values = recombination_values(AlignIO.read(dna_file, 'fasta'), jobs=jobs, pool=pool)
+        _store_phipack_values(cache_file, phipack_values, manifest)
+        return phipack_values
+
     # Create directory for PhiPack to run in, so files get created there
     orth_name = os.path.split(dna_file)[1].split('.')[0]
     rundir = create_directory(orth_name, inside_dir=phipack_dir)
 
     # Build up list of commands
-    command = PHIPACK, '-f', dna_file, '-o'  # Output NSS & Max Chi^2
+    command = (PHIPACK, '-f', dna_file) + PHIPACK_ARGS
     try:
-        check_call(command, cwd=rundir, stdout=open('/dev/null', mode='w'))
+        with open(os.devnull, mode='w') as devnull:
+            check_call(command, cwd=rundir, stdout=devnull)
     except CalledProcessError as err:
         log.warn('Error running PhiPack for %s:\n%s', dna_file, err)
         return {'PhiPack sites': None, 'Phi': None, 'Max Chi^2': None, 'NSS': None}
@@ -97,7 +162,18 @@ def run_phipack(phipack_dir, dna_file):
     phi = float(raw_phi) if raw_phi != '--' else None
     chi = float(re.search('Max Chi\^2:\s+(.*)\s+\(1000 permutations\)', contents).group(1))
     nss = float(re.search('NSS:\s+(.*)\s+\(1000 permutations\)', contents).group(1))
-    return {'PhiPack sites': sites, 'Phi': phi, 'Max Chi^2': chi, 'NSS': nss}
+    phipack_values = {'PhiPack sites': sites, 'Phi': phi, 'Max Chi^2': chi, 'NSS': nss}
+    _store_phipack_values(cache_file, phipack_values, manifest)
+    return phipack_values
+
+
+def _store_phipack_values(cache_file, phipack_values, manifest=None):
+    """Store values in cache through a temporary file, so simultaneous runs never read incomplete values."""
+    tmp_file = tempfile.mkstemp(suffix='.json', dir=os.path.dirname(cache_file))[1]
+    with open(tmp_file, mode='w') as write_handle:
+        json.dump(phipack_values, write_handle)
+    os.rename(tmp_file, cache_file)
+    (manifest or default_manifest()).record_miss('phipack', cache_file)
 
 
 def main(args):
@@ -106,9 +182,13 @@ def main(args):
 Usage: run_phipack.py
 --orthologs-zip=FILE     archive of orthologous genes in FASTA format
 --stats-file=FILE        destination file path for values found through PhiPack for each ortholog
+--jobs=NUMBER            number of PhiPack processes to run simultaneously, defaults to number of CPUs
+--backend=NAME           calculate values with phipack (default) or with the in process native implementation
 """
-    options = ('orthologs-zip', 'stats-file')
-    orthologs_zip, stats_file = parse_options(usage, options, args)
+    options = ('orthologs-zip', 'stats-file', 'jobs=?', 'backend=?')
+    orthologs_zip, stats_file, jobs, backend = parse_options(usage, options, args)
+    jobs = int(jobs) if jobs else cpu_count()
+    backend = backend or 'phipack'
 
     # Run filtering in a temporary folder, to prevent interference from simultaneous runs
     run_dir = tempfile.mkdtemp(prefix='run_phipack_')
@@ -118,7 +198,7 @@ Usage: run_phipack.py
     ortholog_files = extract_archive_of_files(orthologs_zip, extraction_dir)
 
     # Find recombination in all ortholog_files
-    _phipack_for_all_orthologs(run_dir, ortholog_files, stats_file)
+    _phipack_for_all_orthologs(run_dir, ortholog_files, stats_file, jobs, backend)
 
     # Remove unused files to free disk space
     shutil.rmtree(run_dir)
@@ -5,7 +5,7 @@ import logging
 from operator import itemgetter
 import sys
 
-from download_taxa_ncbi import download_genome_files
+from download_taxa_ncbi import download_genomes
 from load_prokaryotes import _parse_genomes_table
 from shared import parse_options
 
@@ -73,9 +73,8 @@ Usage: select_taxa.py
     open(genomes_file, mode='a').close()
 
     # Write IDs to file, with organism name as second column to make the project ID files more self explanatory.
-    for genome in genomes:
-        # Download files here, but ignore returned files: These can be retrieved from cache during extraction/translation
-        download_genome_files(genome, genomes_file, require_ptt=require_ptt)
+    # Download files here, but ignore returned files: These can be retrieved from cache during extraction/translation
+    download_genomes(genomes, genomes_file, require_ptt=require_ptt)
 
     # Post check after translation to see if more than one genome actually had some genomic contents
     with open(genomes_file) as read_handle:
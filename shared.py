@@ -4,6 +4,9 @@ Functionality shared between different modules.
 '''
 
 import Bio
+from Bio import SeqIO
+from StringIO import StringIO
+from collections import namedtuple
 import getopt
 import logging
 import os
@@ -70,9 +73,9 @@ def concatenate(target_path, source_files):
     assert os.path.isfile(target_path) and 0 < os.path.getsize(target_path), target_path + ' should exist with content'
 
 
-def create_archive_of_files(archive_file, file_iterable):
+def create_archive_of_files(archive_file, file_iterable, compression=ZIP_DEFLATED):
     """Write files in file_iterable to archive_file, using only filename for target path within archive_file."""
-    zipfile_handle = ZipFile(archive_file, mode='w', compression=ZIP_DEFLATED)
+    zipfile_handle = ZipFile(archive_file, mode='w', compression=compression)
     if len(file_iterable):
         for some_file in file_iterable:
             zipfile_handle.write(some_file, os.path.split(some_file)[1])
@@ -96,6 +99,53 @@ def extract_archive_of_files(archive_file, target_dir):
     return extracted_files
 
 
+def iterate_archive_of_files(archive_file):
+    """Yield the filename and a file-like read handle for each file in archive_file, reading contents straight from the
+    archive without extracting them to disk.
+
+    Handles are only valid until the next file is yielded. Empty files, such as the placeholder written for archives
+    without files, are skipped."""
+    assert 0 < os.path.getsize(archive_file), 'Zipfile was zero bytes!'
+    with ZipFile(archive_file, mode='r') as read_handle:
+        for zipinfo in read_handle.infolist():
+            if zipinfo.file_size:
+                yield zipinfo.filename, read_handle.open(zipinfo)
+
+
+def create_archive_of_records(archive_file, named_records, file_format='fasta', compression=ZIP_DEFLATED):
+    """Write each of the (filename, records) pairs in named_records to archive_file as a file in file_format, formatting
+    records in memory rather than in temporary files, and return the filenames written."""
+    return create_archives_of_records([archive_file], ([pair] for pair in named_records), file_format, compression)[0]
+
+
+def create_archives_of_records(archive_files, named_records_per_archive, file_format='fasta',
+                               compression=ZIP_DEFLATED):
+    """Write records to each of archive_files at once, where named_records_per_archive yields a list of a (filename,
+    records) pair for each of archive_files in turn, and return the filenames written to each of archive_files.
+
+    This allows callers to produce the records for all archives in a single pass over their input. Pass ZIP_STORED as
+    compression to skip compressing intermediate archives that are read again shortly after."""
+    filenames = [[] for _ in archive_files]
+    zipfile_handles = [ZipFile(archive_file, mode='w', compression=compression) for archive_file in archive_files]
+    try:
+        for named_records in named_records_per_archive:
+            for zipfile_handle, written, (filename, records) in zip(zipfile_handles, filenames, named_records):
+                contents = StringIO()
+                SeqIO.write(records, contents, file_format)
+                zipfile_handle.writestr(filename, contents.getvalue())
+                written.append(filename)
+        for archive_file, zipfile_handle, written in zip(archive_files, zipfile_handles, filenames):
+            if not written:
+                logging.warn('No files in named_records: %s will be empty!', archive_file)
+                zipfile_handle.writestr('empty', '')
+    finally:
+        for zipfile_handle in zipfile_handles:
+            zipfile_handle.close()
+    for archive_file in archive_files:
+        assert is_zipfile(archive_file), 'File should now have been a valid zipfile: ' + archive_file
+    return filenames
+
+
 def parse_options(usage, options, args):
     """Parse command line arguments in args. Options require argument by default; flags are indicated with '?' postfix.
 
@@ -150,20 +200,63 @@ def parse_options(usage, options, args):
     return [arguments[option] for option in options]
 
 
+class SequenceHeader(namedtuple('SequenceHeader', 'genome accession protein cog product')):
+    """Fasta header split into its fields: project_id|genbank_ac|protein_id|cog|product."""
+    __slots__ = ()
+
+
+def parse_header(header):
+    """Split header into a SequenceHeader once, interning genome IDs and COGs which recur across many records.
+
+    Missing trailing fields, as in headers of externally provided or concatemer sequences, are set to None."""
+    # Sample header line: 58191|NC_010067.1|YP_001569097.1|COG4948MR|some gene name
+    values = header.split('|', 4)
+    values.extend([None] * (5 - len(values)))
+    genome, accession, protein, cog, product = values
+    return SequenceHeader(intern(genome), accession, protein, intern(cog) if cog is not None else None, product)
+
+
+def _as_header(record):
+    """Return record as SequenceHeader, only parsing the record id when it was not already parsed by the caller."""
+    if isinstance(record, SequenceHeader):
+        return record
+    return parse_header(record.id)
+
+
+class GenomeRanking(object):
+    """Rank of each genome assembly accession by the modification & release dates of published genomes, newest first.
+
+    Build once per run and pass to get_most_recent_gene_name, rather than sorting all genomes for each ortholog."""
+
+    def __init__(self, genomes):
+        # Sorting is stable, so genomes with equal dates keep their order, as when sorting genomes for each ortholog
+        ranked = sorted(genomes, key=lambda x: x['Modify Date'] or x['Release Date'], reverse=True)
+        self.ranks = {}
+        for rank, genome in enumerate(ranked):
+            self.ranks.setdefault(genome['Assembly Accession'], rank)
+
+    def __len__(self):
+        return len(self.ranks)
+
+    def most_recent(self, accessions):
+        """Return the most recent of accessions that are ranked, or None when none of them are."""
+        ranked = [accession for accession in accessions if accession in self.ranks]
+        return min(ranked, key=self.ranks.get) if ranked else None
+
+
 def get_most_recent_gene_name(genomes, sequence_records):
-    """Return gene name annotation for most recently updated genome from sequence records in ortholog."""
+    """Return gene name annotation for most recently updated genome from sequence records or headers in ortholog.
+
+    Genomes are either genome dicts or a GenomeRanking of them, where the latter saves ranking genomes for each call."""
     # Special handling of the common annotation: 'hypothetical_protein'
     hypo_skipped = False
     hypothetical = 'hypothetical_protein'
 
     ortholog_products = {}
     for record in sequence_records:
-        # Sample header line: >58191|NC_010067.1|YP_001569097.1|COG4948MR|some gene name
-        values = record.id.split('|')
-        genome = values[0]
-        gene_name = values[4]
-        if gene_name != 'hypothetical_protein':
-            ortholog_products[genome] = gene_name
+        header = _as_header(record)
+        if header.product != 'hypothetical_protein':
+            ortholog_products[header.genome] = header.product
         else:
             hypo_skipped = True
 
@@ -178,24 +271,39 @@ def get_most_recent_gene_name(genomes, sequence_records):
     # When no genomes are found, for instance when all genomes are external genomes, just return the first annotation
     if not genomes:
         return ortholog_products.values()[0]
+    ranking = genomes if isinstance(genomes, GenomeRanking) else GenomeRanking(genomes)
 
     # Determine which genome is the most recent by looking at the modification & release dates of published genomes
-    # Starting at the newest genomes, return the first gene name annotation we find
-    for genome in sorted(genomes, key=lambda x: x['Modify Date'] or x['Release Date'], reverse=True):
-        if genome['Assembly Accession'] in ortholog_products:
-            return ortholog_products[genome['Assembly Accession']]
+    # Of the genomes with a gene name annotation, return the annotation of the newest genome
+    most_recent = ranking.most_recent(ortholog_products)
+    if most_recent is not None:
+        return ortholog_products[most_recent]
 
     # Shouldn't really happen, but write this clause anyhow
     logging.warn('Could not retrieve gene name annotation based on date; returning first gene name annotation instead')
     return ortholog_products.values()[0]
 
 
+class OrthologMetadata(namedtuple('OrthologMetadata', 'headers cogs product')):
+    """Parsed sequence headers of an ortholog file, along with the COGs and most recent product derived from them."""
+    __slots__ = ()
+
+
+def ortholog_metadata(ortholog_file, ranking):
+    """Parse the headers in ortholog_file once, and return them along with their COGs and most recent gene name.
+
+    Headers are parsed from the full record description, as record ids are cut short at spaces within products."""
+    headers = [parse_header(record.description) for record in SeqIO.parse(ortholog_file, 'fasta')]
+    return OrthologMetadata(headers,
+                            find_cogs_in_sequence_records(headers),
+                            get_most_recent_gene_name(ranking, headers))
+
+
 def find_cogs_in_sequence_records(sequence_records, include_none=False):
-    """Find unique COG annotations assigned to sequences within a single alignment."""
+    """Find unique COG annotations assigned to sequences or headers within a single alignment."""
     cogs = set()
     for record in sequence_records:
-        # Sample header line: >58191|NC_010067.1|YP_001569097.1|COG4948MR|core
-        cog = record.id.split('|')[3]
+        cog = _as_header(record).cog
         if cog in cogs:
             continue
         if cog == 'None':
@@ -3,49 +3,34 @@
 
 from Bio import AlignIO
 from Bio.Align import MultipleSeqAlignment
-from shared import parse_options, extract_archive_of_files, create_directory, create_archive_of_files
+from shared import parse_options, iterate_archive_of_files, create_archives_of_records, parse_header
+from zipfile import ZIP_STORED
 import logging as log
 import os.path
 import re
-import shutil
 import sys
-import tempfile
 
 __author__ = "Tim te Beek"
 __copyright__ = "Copyright 2011, Netherlands Bioinformatics Centre"
 __license__ = "MIT"
 
 
-def split_alignment_by_taxa(run_dir, ortholog_files, (genome_ids_a, prefix_a), (genome_ids_b, prefix_b)):
-    """Separate multiple sequence alignments with sequences from two taxa out into separate files per taxon."""
-    # Collections to hold split files
-    taxon_a_files = []
-    taxon_b_files = []
-
-    # For each alignment create separate alignments for clade A & clade B genomes
-    for ortholog_file in ortholog_files:
+def split_alignment_by_taxa(orthologs_zip, taxa):
+    """Yield for each multiple sequence alignment in orthologs_zip a list of a filename and sub alignment with only the
+    sequences of genome_ids for each of the (genome_ids, prefix) pairs in taxa, reading and parsing each alignment
+    straight from the archive only once."""
+    for filename, read_handle in iterate_archive_of_files(orthologs_zip):
         # Determine input file base name
-        base_name, extension = os.path.splitext(os.path.split(ortholog_file)[1])
+        base_name, extension = os.path.splitext(os.path.split(filename)[1])
 
         # Separate alignment according to which taxon the genome_ids belong to
-        alignment = AlignIO.read(ortholog_file, 'fasta')
-        alignment_a = MultipleSeqAlignment(seqr for seqr in alignment if seqr.id.split('|')[0] in genome_ids_a)
-        alignment_b = MultipleSeqAlignment(seqr for seqr in alignment if seqr.id.split('|')[0] in genome_ids_b)
-
-        # Build up target output files
-        taxon_a_file = os.path.join(run_dir, '{0}.{1}{2}'. format(base_name, prefix_a, extension))
-        taxon_b_file = os.path.join(run_dir, '{0}.{1}{2}'. format(base_name, prefix_b, extension))
-
-        # Actually write out sub alignments
-        AlignIO.write(alignment_a, taxon_a_file, 'fasta')
-        AlignIO.write(alignment_b, taxon_b_file, 'fasta')
-
-        # Append the written files to the correct collections of files
-        taxon_a_files.append(taxon_a_file)
-        taxon_b_files.append(taxon_b_file)
+        alignment = AlignIO.read(read_handle, 'fasta')
+        genomes = [parse_header(seqr.id).genome for seqr in alignment]
 
-    # Return collection of files
-    return taxon_a_files, taxon_b_files
+        # Build up target output file names
+        yield [('{0}.{1}{2}'.format(base_name, prefix, extension),
+                MultipleSeqAlignment(seqr for seqr, genome in zip(alignment, genomes) if genome in genome_ids))
+               for genome_ids, prefix in taxa]
 
 
 def _common_prefix(names, fallback=None):
@@ -81,23 +66,11 @@ Usage: split_by_taxa.py
         genome_ids_b = [line[0] for line in lines]
         common_prefix_b = _common_prefix([line[1] for line in lines], 'taxon_b')
 
-    # Create run_dir to hold files related to this run
-    run_dir = tempfile.mkdtemp(prefix='split_by_taxa_')
-
-    # Extract files from zip archive
-    ortholog_files = extract_archive_of_files(orthologs_zip, create_directory('alignments', inside_dir=run_dir))
-
-    # Actually split alignments per taxon
-    taxon_a_files, taxon_b_files = split_alignment_by_taxa(run_dir, ortholog_files,
-                                                           (genome_ids_a, common_prefix_a),
-                                                           (genome_ids_b, common_prefix_b))
-
-    # Write the produced files to command line argument filenames
-    create_archive_of_files(taxon_a_zip, taxon_a_files)
-    create_archive_of_files(taxon_b_zip, taxon_b_files)
-
-    # Remove unused files to free disk space
-    shutil.rmtree(run_dir)
+    # Actually split alignments per taxon, writing them straight to the command line argument filenames, uncompressed
+    # as they are read again by the next step
+    taxa = [(genome_ids_a, common_prefix_a), (genome_ids_b, common_prefix_b)]
+    create_archives_of_records([taxon_a_zip, taxon_b_zip], split_alignment_by_taxa(orthologs_zip, taxa),
+                               compression=ZIP_STORED)
 
     # Exit after a comforting log message
     log.info("Produced: \n%s\n%s", taxon_a_zip, taxon_b_zip)
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from alignment_cache import alignment_cache_key, retrieve_alignment, store_alignment
+from genome_cache import GenomeCacheManifest
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='alignment_cache_')
+        self.cache_dir = os.path.join(self.directory, 'alignments')
+        self.manifest = GenomeCacheManifest(os.path.join(self.directory, 'manifest.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, filename, contents):
+        '''Write contents to filename in the temporary directory and return the path.'''
+        path = os.path.join(self.directory, filename)
+        with open(path, mode='w') as write_handle:
+            write_handle.write(contents)
+        return path
+
+    def test_alignment_cache_key(self):
+        '''
+        Assert the key ignores the order of sequences, but not their contents, translation table or aligner version.
+        '''
+        first = self._write('a.ffn', '>58191|NC_010067.1|YP_001569097.1|COG4948|core\nATGAAA\n>58017|b\nATGTTT\n')
+        reordered = self._write('b.ffn', '>58017|b\nATGTTT\n>58191|NC_010067.1|YP_001569097.1|COG4948|core\nATGAAA\n')
+        changed = self._write('c.ffn', '>58017|b\nATGTTT\n>58191|NC_010067.1|YP_001569097.1|COG4948|core\nATGAAG\n')
+        key = alignment_cache_key(first, 11, 'v1')
+        self.assertEqual(key, alignment_cache_key(reordered, 11, 'v1'))
+        self.assertNotEqual(key, alignment_cache_key(changed, 11, 'v1'))
+        self.assertNotEqual(key, alignment_cache_key(first, 4, 'v1'))
+        self.assertNotEqual(key, alignment_cache_key(first, 11, 'v2'))
+
+    def test_store_and_retrieve(self):
+        '''
+        Assert stored alignments are retrieved under the same key, and counted as cache hits & misses.
+        '''
+        target = os.path.join(self.directory, 'retrieved.nt_ali.fasta')
+        self.assertFalse(retrieve_alignment('ab12', target, self.cache_dir, self.manifest))
+
+        alignment = self._write('aligned.nt_ali.fasta', '>a\nATG---\n>b\nATGTTT\n')
+        store_alignment('ab12', alignment, self.cache_dir, self.manifest)
+        self.assertTrue(retrieve_alignment('ab12', target, self.cache_dir, self.manifest))
+        with open(target) as read_handle:
+            self.assertEqual('>a\nATG---\n>b\nATGTTT\n', read_handle.read())
+        self.assertEqual({'alignments': (1, 1, 0.5)}, self.manifest.hit_rates())
@@ -0,0 +1,63 @@
+import unittest
+
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from alignment_matrix import alignment_matrix, codon_gap_masks, full_codon_columns, longest_gap_runs, \
+    stop_codon_mask, without_stop_codons, codon_columns
+
+
+def _alignment(*sequences):
+    '''Create an alignment of the sequences given as arguments.'''
+    return MultipleSeqAlignment(SeqRecord(Seq(seq), id=str(index)) for index, seq in enumerate(sequences))
+
+
+class Test(unittest.TestCase):
+
+    def test_alignment_matrix(self):
+        '''
+        Assert the alignment is loaded as a sequences by sites matrix.
+        '''
+        matrix = alignment_matrix(_alignment('ACG---', 'ACGTTA'))
+        self.assertEqual((2, 6), matrix.shape)
+        self.assertEqual('ACGTTA', matrix[1].tostring())
+
+    def test_codon_gap_masks(self):
+        '''
+        Assert full gap codons and codons mixing gaps with letters are told apart.
+        '''
+        full_gaps, mixed = codon_gap_masks(alignment_matrix(_alignment('ACG---', 'AC-TTA')))
+        self.assertEqual([[False, True], [False, False]], full_gaps.tolist())
+        self.assertEqual([[False, False], [True, False]], mixed.tolist())
+
+    def test_full_codon_columns(self):
+        '''
+        Assert only codons without gaps in any sequence are returned.
+        '''
+        matrix = alignment_matrix(_alignment('---ACGTTAACG', 'ACGACG---ACG'))
+        self.assertEqual([1, 3], full_codon_columns(matrix).tolist())
+
+    def test_longest_gap_runs(self):
+        '''
+        Assert the longest run of gaps is found per sequence, without runs spanning sequence boundaries.
+        '''
+        matrix = alignment_matrix(_alignment('A--A---', '--AAAA-', 'AAAAAAA'))
+        self.assertEqual([3, 2, 0], longest_gap_runs(matrix).tolist())
+
+    def test_stop_codon_mask(self):
+        '''
+        Assert stop codons are found per sequence, and removed from all sequences when a stop in any of them.
+        '''
+        matrix = alignment_matrix(_alignment('ATGTAACTTTGAA', 'ATGTTACTTTGGA'))
+        self.assertEqual([[False, True, False, True], [False, False, False, False]], stop_codon_mask(matrix).tolist())
+        self.assertEqual(['ATGCTTA', 'ATGCTTA'], [row.tostring() for row in without_stop_codons(matrix)])
+
+    def test_codon_columns(self):
+        '''
+        Assert the sites of selected codons are taken in order.
+        '''
+        matrix = alignment_matrix(_alignment('ATGCTTAAAGGGTA', 'ATGCTCAAGGGATA'))
+        self.assertEqual(['ATGAAA', 'ATGAAG'], [row.tostring() for row in matrix[:, codon_columns([0, 2])]])
+        self.assertEqual(['GGGCTT', 'GGACTC'], [row.tostring() for row in matrix[:, codon_columns([3, 1])]])
+        self.assertEqual([], codon_columns([]).tolist())
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+from zipfile import ZipFile
+
+from alignment_store import AlignmentStore, archive_from_store, store_from_archive, write_store
+from Bio import AlignIO
+from StringIO import StringIO
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='alignment_store_')
+        self.archive = os.path.join(self.directory, 'orthologs.zip')
+        with ZipFile(self.archive, mode='w') as zipfile_handle:
+            zipfile_handle.writestr('COG1.ffn', '>58191|NC_010067.1|YP_1|COG1|core\nATGAAA\n>58017|b\nATG-TT\n')
+            zipfile_handle.writestr('COG2.ffn', '>58191|a\nATGCTTTAA\n>58017|b\nATGCTCTAA\n>58018|c\nATGCTNTAA\n')
+        self.store_file = os.path.join(self.directory, 'orthologs.store')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store_from_archive(self):
+        '''
+        Assert alignments are stored with their headers, and read back as views on the memory mapped block.
+        '''
+        self.assertEqual(['COG1.ffn', 'COG2.ffn'], store_from_archive(self.archive, self.store_file))
+        store = AlignmentStore(self.store_file)
+        self.assertEqual(2, len(store))
+        self.assertTrue('COG2.ffn' in store)
+        self.assertEqual(['58191', '58017', '58018'], store.genomes('COG2.ffn'))
+        matrix = store.matrix('COG1.ffn')
+        self.assertEqual(['ATGAAA', 'ATG-TT'], [row.tostring() for row in matrix])
+        self.assertFalse(matrix.flags.owndata)
+        self.assertEqual(['ATGCTTTAA', 'ATGCTNTAA'],
+                         [row.tostring() for row in store.rows('COG2.ffn', ['58191', '58018'])])
+
+    def test_archive_from_store(self):
+        '''
+        Assert converting a store back into an archive yields the same alignments under the same names.
+        '''
+        store_from_archive(self.archive, self.store_file)
+        roundtrip = os.path.join(self.directory, 'roundtrip.zip')
+        archive_from_store(self.store_file, roundtrip)
+        with ZipFile(self.archive) as original, ZipFile(roundtrip) as converted:
+            self.assertEqual(original.namelist(), converted.namelist())
+            for name in original.namelist():
+                expected = AlignIO.read(StringIO(original.read(name)), 'fasta')
+                actual = AlignIO.read(StringIO(converted.read(name)), 'fasta')
+                self.assertEqual([(seqr.description, str(seqr.seq)) for seqr in expected],
+                                 [(seqr.description, str(seqr.seq)) for seqr in actual])
+
+    def test_empty_store(self):
+        '''
+        Assert a store without alignments can be written and read.
+        '''
+        self.assertEqual([], write_store(self.store_file, []))
+        self.assertEqual([], AlignmentStore(self.store_file).names)
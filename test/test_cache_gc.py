@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from cache_gc import collect_garbage, parse_size
+from genome_cache import GenomeCacheManifest
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='cache_gc_')
+        self.manifest = GenomeCacheManifest(os.path.join(self.directory, 'manifest.sqlite'))
+        self.genomes = os.path.join(self.directory, 'genomes')
+        os.makedirs(os.path.join(self.genomes, '57723'))
+        os.makedirs(os.path.join(self.genomes, '58017'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _cache_file(self, relative_path, size, last_access):
+        '''Write a file of size bytes to the genomes tree, with last access and modification times set.'''
+        path = os.path.join(self.genomes, relative_path)
+        with open(path, mode='w') as write_handle:
+            write_handle.write('A' * size)
+        os.utime(path, (last_access, last_access))
+        return path
+
+    def test_parse_size(self):
+        '''
+        Assert human readable sizes are converted to bytes.
+        '''
+        self.assertEqual(512, parse_size('512'))
+        self.assertEqual(500 << 20, parse_size('500M'))
+        self.assertEqual(20 << 30, parse_size('20GB'))
+        self.assertRaises(ValueError, parse_size, 'lots')
+
+    def test_collect_garbage(self):
+        '''
+        Assert least recently used files are evicted first, where cache hits count as use, until within budget.
+        '''
+        now = time.time()
+        oldest = self._cache_file('57723/NC_009801.gbk', 100, now - 300)
+        hit = self._cache_file('57723/NC_009801.ptt', 100, now - 200)
+        newest = self._cache_file('58017/NC_002695.gbk', 100, now - 100)
+        self.manifest.record_file(oldest)
+        self.manifest.record_hit('genomes', hit)
+
+        evicted, remaining = collect_garbage(150, self.manifest, trees=[self.genomes])
+        self.assertEqual([oldest, newest], evicted)
+        self.assertEqual(100, remaining)
+        self.assertTrue(os.path.isfile(hit))
+        self.assertIsNone(self.manifest.lookup(oldest))
+        # Empty project directories are removed as well
+        self.assertFalse(os.path.exists(os.path.dirname(newest)))
+
+    def test_hit_rates(self):
+        '''
+        Assert hits and misses are counted per cache tree.
+        '''
+        path = self._cache_file('57723/NC_009801.gbk', 10, time.time())
+        self.manifest.record_miss('genomes', path)
+        for _ in range(3):
+            self.manifest.record_hit('genomes', path)
+        self.assertEqual({'genomes': (3, 1, 0.75)}, self.manifest.hit_rates())
+
+    def test_dry_run(self):
+        '''
+        Assert a dry run reports files to evict, without removing them.
+        '''
+        path = self._cache_file('57723/NC_009801.gbk', 100, time.time())
+        evicted, remaining = collect_garbage(0, self.manifest, trees=[self.genomes], dry_run=True)
+        self.assertEqual([path], evicted)
+        self.assertEqual(0, remaining)
+        self.assertTrue(os.path.isfile(path))
@@ -0,0 +1,215 @@
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from collections import defaultdict
+
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+import calculations_new
+from shared import GenomeRanking
+
+
+def _values(dn, dos, phi=None):
+    '''Return clade_calcs like values for a single ortholog.'''
+    values = defaultdict(int)
+    values[calculations_new.ORTHOLOG] = 'COG1'
+    values[calculations_new.PRODUCT] = 'some product'
+    values[calculations_new.DN] = dn
+    values[calculations_new.DOS] = dos
+    values[calculations_new.PHI] = phi
+    values[calculations_new.PHIPACK_SITES] = None
+    values[calculations_new.DS_PN_PS_DS] = None
+    values[calculations_new.DN_PS_PS_DS] = None
+    for sfs in calculations_new.SFS_COLUMNS:
+        values[sfs] = defaultdict(int)
+    values[calculations_new.SYNONYMOUS_SFS][2] = 3
+    return values
+
+
+def _sfs_values(alignment, codon_indices=None):
+    '''Return the SFS related values of clade_calcs for alignment, optionally restricted to codon_indices.'''
+    if codon_indices is None:
+        instance = calculations_new.clade_calcs(alignment, GenomeRanking([]))
+        classes = None
+    else:
+        instance = calculations_new.clade_calcs(alignment, GenomeRanking([]), sequence_lengths=3 * len(codon_indices))
+        classes = calculations_new._classify_codons(alignment)
+    instance.values[calculations_new.SYNONYMOUS_SITES] = 1
+    instance.values[calculations_new.NON_SYNONYMOUS_SITES] = 1
+    calculations_new._codon_site_freq_spec(instance, classes, codon_indices)
+    return instance.values
+
+
+class Test(unittest.TestCase):
+
+    def test_ortholog_record(self):
+        '''
+        Assert ortholog records format rows as the values they were created from, including SFS and missing values.
+        '''
+        schema = calculations_new.RecordSchema(2)
+        record = calculations_new.OrthologRecord(schema, _values(1.5, None, 0.25))
+        fields = dict(zip(schema.headers, record.row().split('\t')))
+        self.assertEqual('COG1', fields[calculations_new.ORTHOLOG])
+        self.assertEqual('1.5', fields[calculations_new.DN])
+        self.assertEqual('None', fields[calculations_new.DOS])
+        self.assertEqual('None', fields[calculations_new.PHIPACK_SITES])
+        self.assertEqual('0.25', fields[calculations_new.PHI])
+        self.assertEqual('3', fields['synonymous sfs doubletons'])
+        self.assertEqual('0', fields['synonymous sfs singletons'])
+
+    def test_results_table(self):
+        '''
+        Assert sums and means skip None values, and that means without any values are not a number.
+        '''
+        schema = calculations_new.RecordSchema(2)
+        statistics = calculations_new.ResultsTable(schema)
+        for dn, dos in ((1, 0.5), (2, None), (None, None)):
+            statistics.add(calculations_new.OrthologRecord(schema, _values(dn, dos)))
+        sum_stats, mean_stats = statistics.statistics()[:2]
+        self.assertEqual(3, sum_stats.values[calculations_new.DN])
+        self.assertEqual(1.5, mean_stats.values[calculations_new.DN])
+        self.assertEqual(0.5, mean_stats.values[calculations_new.DOS])
+        self.assertEqual(9, sum_stats.values['synonymous sfs doubletons'])
+        self.assertTrue(math.isnan(mean_stats.values[calculations_new.PHI]))
+
+    def test_neutrality_indices_undefined_limits(self):
+        '''
+        Assert the bootstrapped limits are left undefined when a sample has a zero divisor, rather than resampled.
+        '''
+        random.seed(0)
+        ni_stats, ni_lower_stats, ni_upper_stats = calculations_new._neutrality_indices([1.0] * 10, [0.0] * 9 + [1.0])
+        self.assertEqual(10.0, ni_stats.values[calculations_new.NEUTRALITY_INDEX])
+        self.assertTrue(ni_lower_stats.values[calculations_new.NEUTRALITY_INDEX].startswith('Failed to bootstrap'))
+        self.assertTrue(ni_upper_stats.values[calculations_new.NEUTRALITY_INDEX].startswith('Failed to bootstrap'))
+
+        # Without zero divisors the limits are the bootstrapped values
+        ni_stats, ni_lower_stats, ni_upper_stats = calculations_new._neutrality_indices([1.0, 2.0], [1.0, 1.0])
+        self.assertEqual(1.5, ni_stats.values[calculations_new.NEUTRALITY_INDEX])
+        self.assertLessEqual(1.0, ni_lower_stats.values[calculations_new.NEUTRALITY_INDEX])
+        self.assertLessEqual(ni_lower_stats.values[calculations_new.NEUTRALITY_INDEX],
+                             ni_upper_stats.values[calculations_new.NEUTRALITY_INDEX])
+        self.assertLessEqual(ni_upper_stats.values[calculations_new.NEUTRALITY_INDEX], 2.0)
+
+    def test_partitions(self):
+        '''
+        Assert codons are partitioned into odd & even codons, thirds and windows, counting codons from zero.
+        '''
+        self.assertEqual([('odd', [0, 2, 4]), ('even', [1, 3])],
+                         [(part, indices.tolist()) for part, indices in calculations_new.odd_even_partition(5)])
+        self.assertEqual([('first_third', [0, 1, 2]), ('middle_third', [3, 4]), ('last_third', [5, 6])],
+                         [(part, indices.tolist()) for part, indices in calculations_new.thirds_partition(7)])
+        windows = calculations_new.sliding_window_partition(3, 2)
+        self.assertEqual([('codons_1-3', [0, 1, 2]), ('codons_3-5', [2, 3, 4]), ('codons_5-7', [4, 5, 6])],
+                         [(part, indices.tolist()) for part, indices in windows(7)])
+
+    def test_sliding_window_partition_edges(self):
+        '''
+        Assert codons after the last full window are covered by a trailing window, and genes shorter than a window
+        are left out. Window sizes and steps should be positive.
+        '''
+        windows = calculations_new.sliding_window_partition(3)
+        self.assertEqual([('codons_1-3', [0, 1, 2]), ('codons_4-6', [3, 4, 5]), ('last_3_codons', [5, 6, 7])],
+                         [(part, indices.tolist()) for part, indices in windows(8)])
+        self.assertEqual([('codons_1-3', [0, 1, 2])], [(part, indices.tolist()) for part, indices in windows(3)])
+        self.assertEqual([], windows(2))
+        self.assertEqual([('codons_1-2', [0, 1]), ('last_2_codons', [1, 2])],
+                         [(part, indices.tolist()) for part, indices in
+                          calculations_new.sliding_window_partition(2, 4)(3)])
+        self.assertRaises(AssertionError, calculations_new.sliding_window_partition, 0)
+        self.assertRaises(AssertionError, calculations_new.sliding_window_partition, 3, -1)
+
+    def test_codon_site_freq_spec_parts(self):
+        '''
+        Assert SFS values over a part of the codons match those of an alignment of only those codons.
+        '''
+        header = '58191|NC|YP_{0}|COG1A|some product'
+        alignment = MultipleSeqAlignment(SeqRecord(Seq(sequence), id=header.format(index).split()[0],
+                                                   description=header.format(index))
+                                         for index, sequence in enumerate(['ATGCTTAAAGGGTTTGAT',
+                                                                           'ATGCTCAAGGGATTTGAT',
+                                                                           'ATACTCAAAGGGTTCGAC',
+                                                                           'ATGCTTAAAGGATTTGAC']))
+        for codon_indices in ([0, 2, 4], [1, 3, 5], [3, 4]):
+            expected = _sfs_values(calculations_new._codons_alignment(alignment, codon_indices))
+            actual = _sfs_values(alignment, codon_indices)
+            for key in (calculations_new.GLOBAL_SFS, calculations_new.SYNONYMOUS_SFS,
+                        calculations_new.NON_SYNONYMOUS_SFS, calculations_new.FOUR_FOLD_SYNONYMOUS_SFS,
+                        calculations_new.FOUR_FOLD_SYNONYMOUS_SITES, calculations_new.CODONS, calculations_new.PI,
+                        calculations_new.SYNONYMOUS_PI):
+                self.assertEqual(expected[key], actual[key])
+
+    def test_partition_calculations_phipack_values(self):
+        '''
+        Assert PhiPack values of the full alignment are given for the full alignment only, and left out for its parts.
+        '''
+        directory = tempfile.mkdtemp(prefix='calculations_new_')
+        original_select_genomes_by_ids = calculations_new.select_genomes_by_ids
+        calculations_new.select_genomes_by_ids = lambda genome_ids: {}
+        try:
+            sico_file = os.path.join(directory, 'COG1.ffn')
+            with open(sico_file, mode='w') as write_handle:
+                for genome, sequence in (('a1', 'ATGCTTAAAGGGTTTGAT'), ('a2', 'ATGCTCAAGGGATTTGAT'),
+                                         ('b1', 'ATACTCAAAGGGTTCGAT'), ('b2', 'ATGCTTAAAGGATTTGAC')):
+                    write_handle.write('>{0}|NC|YP_1|COG1A|some product\n{1}\n'.format(genome, sequence))
+            phipack_values = {sico_file: {'PhiPack sites': 12, 'Phi': 0.5, 'Max Chi^2': 0.25, 'NSS': 0.75}}
+            records = [(part, record) for part, record in calculations_new._partition_calculations(
+                ['a1', 'a2'], ['b1', 'b2'], [sico_file], phipack_values, 'nei_gojobori',
+                calculations_new.odd_even_partition) if isinstance(record, calculations_new.OrthologRecord)]
+        finally:
+            calculations_new.select_genomes_by_ids = original_select_genomes_by_ids
+            shutil.rmtree(directory)
+        self.assertEqual([None, 'odd', 'even'], [part for part, _ in records])
+        self.assertEqual('some product', records[0][1].value(calculations_new.PRODUCT))
+        self.assertEqual([12, 0.5, 0.25, 0.75], [records[0][1].value(header) for header in
+                                                 (calculations_new.PHIPACK_SITES, calculations_new.PHI,
+                                                  calculations_new.MAX_CHI_2, calculations_new.NSS)])
+        for _, record in records[1:]:
+            self.assertEqual([None] * 4, [record.value(header) for header in
+                                          (calculations_new.PHIPACK_SITES, calculations_new.PHI,
+                                           calculations_new.MAX_CHI_2, calculations_new.NSS)])
+
+    def test_write_tables_per_part(self):
+        '''
+        Assert interleaved rows of each part are written as a table per part, in the order in which parts first occur.
+        '''
+        schema = calculations_new.RecordSchema(2)
+        calculations = []
+        for dn in (1.5, 2.5):
+            for part in (None, 'odd', 'even'):
+                calculations.append((part, calculations_new.OrthologRecord(schema, _values(dn, None))))
+        directory = tempfile.mkdtemp(prefix='calculations_new_')
+        try:
+            table_dest = os.path.join(directory, 'table.tsv')
+            calculations_new._write_tables_per_part(table_dest, ['a1', 'a2', 'a3', 'a4'], ['b1', 'b2', 'b3', 'b4'],
+                                                    'a', 'b', calculations)
+            with open(table_dest) as read_handle:
+                lines = read_handle.read().splitlines()
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(3 * 6, len(lines))
+        self.assertEqual(3, lines.count('#4 a strains compared with 4 b strains'))
+        dn_column = schema.headers.index(calculations_new.DN)
+        self.assertEqual(['1.5', '2.5'] * 3,
+                         [line.split('\t')[dn_column] for line in lines if not line.startswith('#')])
+
+    def test_main_partition_options(self):
+        '''
+        Assert window sizes and steps should be positive integers, and that odd & even codons exclude other partitions.
+        '''
+        directory = tempfile.mkdtemp(prefix='calculations_new_')
+        try:
+            readable = os.path.join(directory, 'readable')
+            open(readable, mode='w').close()
+            required = ['--genomes-a', readable, '--genomes-b', readable, '--sico-zip', readable]
+            for options in (['--partition', 'windows', '--window-size', '0'],
+                            ['--partition', 'windows', '--window-size', '-5'],
+                            ['--partition', 'windows', '--window-step', 'two'],
+                            ['--append-odd-even', '--partition', 'thirds']):
+                self.assertRaises(SystemExit, calculations_new.main, required + options)
+        finally:
+            shutil.rmtree(directory)
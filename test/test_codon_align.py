@@ -0,0 +1,62 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from Bio import AlignIO
+
+from codon_align import align_proteins, codon_align
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='codon_align_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_align_proteins_equal_length(self):
+        '''
+        Assert proteins of equal length are aligned, including an insertion and deletion that offset each other.
+        '''
+        self.assertEqual(['MKTAY', 'MRTAY'], align_proteins(['MKTAY', 'MRTAY']))
+        self.assertEqual(['MKTA-IAKQRW', 'MKTAYIAKQR-'], align_proteins(['MKTAIAKQRW', 'MKTAYIAKQR']))
+        self.assertEqual(['MKTAY', 'MKTAY'], align_proteins(['MKTAY', 'MKTAY']))
+
+    def test_align_proteins(self):
+        '''
+        Assert a deletion is aligned as a gap, with aligned proteins returned in input order.
+        '''
+        aligned = align_proteins(['MKTAYIAKQR', 'MKTIAKQR', 'MKTAYIAKQR'])
+        self.assertEqual(['MKTAYIAKQR', 'MKT--IAKQR', 'MKTAYIAKQR'], aligned)
+
+    def test_align_proteins_progressive(self):
+        '''
+        Assert proteins derived from one ancestor through deletions only are aligned back to the ancestor length.
+        '''
+        rand = random.Random(0)
+        ancestor = ''.join(rand.choice('ACDEFGHIKLMNPQRSTVWY') for _ in range(100))
+        proteins = []
+        for _ in range(20):
+            residues = list(ancestor)
+            for _ in range(rand.randint(0, 5)):
+                del residues[rand.randrange(len(residues))]
+            proteins.append(''.join(residues))
+        aligned = align_proteins(proteins)
+        self.assertEqual(proteins, [protein.replace('-', '') for protein in aligned])
+        self.assertEqual(100, len(aligned[0]))
+
+    def test_codon_align(self):
+        '''
+        Assert codons are back-threaded onto the protein alignment, keeping full codon gaps and sequence headers.
+        '''
+        sico_file = os.path.join(self.directory, 'COG4948.ffn')
+        with open(sico_file, mode='w') as write_handle:
+            write_handle.write('>58191|NC_010067.1|YP_001569097.1|COG4948|core\nATGAAAACCGCTTATTAA\n'
+                               '>58017|NC_002695.1|NP_308913.1|COG4948|core\nATGAAAACCTATTAA\n')
+        alignment = AlignIO.read(codon_align(sico_file, sico_file + '.nt_ali.fasta'), 'fasta')
+        self.assertEqual('58191|NC_010067.1|YP_001569097.1|COG4948|core', alignment[0].id)
+        self.assertEqual('ATGAAAACCGCTTATTAA', str(alignment[0].seq))
+        self.assertEqual('ATGAAAACC---TATTAA', str(alignment[1].seq))
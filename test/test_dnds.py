@@ -0,0 +1,58 @@
+import math
+import os
+import tempfile
+import unittest
+
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from dnds import nei_gojobori, codon_indices, UNDEFINED_RATIO
+import run_codeml
+
+
+class Test(unittest.TestCase):
+
+    def test_codon_indices(self):
+        '''
+        Assert codons are indexed in TCAG order, with gapped and ambiguous codons marked -1.
+        '''
+        self.assertEqual([0, 63, -1, -1], codon_indices('TTTGGG---ANTAC').tolist())
+
+    def test_nei_gojobori_identical(self):
+        '''
+        Assert identical sequences have no substitutions, with sites adding up to three per codon.
+        '''
+        values = nei_gojobori('ATGCTTAAA', 'ATGCTTAAA')
+        self.assertEqual(0, values['dN'])
+        self.assertEqual(0, values['dS'])
+        self.assertEqual(UNDEFINED_RATIO, values['dN/dS'])
+        self.assertAlmostEqual(9, values['S'] + values['N'])
+        # ATG has no synonymous sites, CTT has one and AAA a third
+        self.assertAlmostEqual(4 / 3., values['S'])
+
+    def test_nei_gojobori_synonymous(self):
+        '''
+        Assert a single synonymous difference yields a Jukes-Cantor corrected dS, and no dN.
+        '''
+        # Stop codons are left out, leaving ten thirds synonymous sites of which one differs
+        values = nei_gojobori('ATGCTTAAAGGGCCCTAA', 'ATGCTCAAAGGGCCCTAG')
+        self.assertEqual(0, values['dN'])
+        self.assertAlmostEqual(10 / 3., values['S'])
+        self.assertAlmostEqual(-0.75 * math.log(1 - 4 / 3. * 0.3), values['dS'])
+        self.assertEqual(0, values['dN/dS'])
+        self.assertAlmostEqual(values['dS'] * values['S'], values['Ds'])
+
+    def test_pairwise_dnds(self):
+        '''
+        Assert native values written in codeml output format are parsed back as from codeml.
+        '''
+        alignment_a = MultipleSeqAlignment([SeqRecord(Seq('ATGCTTAAAGGGCCC'), id='a')])
+        alignment_b = MultipleSeqAlignment([SeqRecord(Seq('ATGCTCAAAGAGCCC'), id='b')])
+        values = run_codeml.pairwise_dnds(alignment_a, alignment_b, 'nei_gojobori')
+        codeml_file = tempfile.mkstemp(suffix='.codeml')[1]
+        run_codeml._write_codeml_values(values, codeml_file)
+        parsed = run_codeml.parse_codeml_output(codeml_file)
+        os.remove(codeml_file)
+        for key in ('N', 'S', 'dN', 'dS'):
+            self.assertAlmostEqual(values[key], parsed[key], places=1)
@@ -4,11 +4,39 @@ Created on Jun 8, 2014
 @author: tim
 '''
 import datetime
+import errno
+from ftplib import error_temp
 import os
+import shutil
+import socket
 import tempfile
+import threading
 import unittest
 
 import download_taxa_ncbi
+from genome_cache import GenomeCacheManifest
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+except ImportError:
+    ThreadedFTPServer = None
+
+# Minimal GenBank record containing a single coding sequence feature
+GENBANK = '''LOCUS       {0:<16}          12 bp    DNA     linear   CON 31-JAN-2014
+DEFINITION  Test record.
+ACCESSION   {0}
+VERSION     {0}.1
+FEATURES             Location/Qualifiers
+     source          1..12
+     CDS             1..12
+                     /protein_id="YP_{0}.1"
+                     /transl_table=11
+ORIGIN
+        1 atgaaattta aa
+//
+'''
 
 
 class Test(unittest.TestCase):
@@ -59,3 +87,187 @@ class Test(unittest.TestCase):
         finally:
             os.remove(log)
         self.assertNotIn('Genome skipped because of missing files', logcontent)
+
+
+@unittest.skipIf(ThreadedFTPServer is None, 'pyftpdlib is required to run a local FTP server')
+class TestFTPSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        # Serve a local directory with the same layout as the NCBI FTP site
+        self.root = tempfile.mkdtemp(prefix='ftproot_')
+        self.genomes = []
+        for number in range(3):
+            ftp_path = 'Test_genus/GCF_{0}'.format(number)
+            folder = os.path.join(self.root, 'genomes/ASSEMBLY_BACTERIA', ftp_path)
+            os.makedirs(folder)
+            accessions = ['NC_{0}0'.format(number), 'NC_{0}1'.format(number)]
+            for acc in accessions:
+                with open(os.path.join(folder, acc + '.gbk'), mode='w') as write_handle:
+                    write_handle.write(GENBANK.format(acc))
+            self.genomes.append({'Assembly Accession': 'ftp_pool_test_{0}.1'.format(number),
+                                 'Organism/Name': 'Test genus {0}'.format(number),
+                                 'FTP Path': ftp_path,
+                                 'Chromosomes/RefSeq': [acc + '.1' for acc in accessions],
+                                 'Plasmids/RefSeq': [],
+                                 'Modify Date': None,
+                                 'Release Date': datetime.datetime(2007, 9, 11, 0, 0)})
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_anonymous(self.root)
+
+        class Handler(FTPHandler):
+            """Handler with its own authorizer, rather than the authorizer shared by all FTPHandler instances."""
+            pass
+        Handler.authorizer = authorizer
+        self.server = ThreadedFTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={'timeout': 0.1})
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.close_all()
+        shutil.rmtree(self.root)
+        for genome in self.genomes:
+            shutil.rmtree(download_taxa_ncbi.create_directory('genomes/' + genome['Assembly Accession']))
+
+    def test_download_genomes_reuses_sessions(self):
+        '''
+        Download multiple genomes with multiple accessions each, and assert the number of logins is bound by pool size.
+        '''
+        log = tempfile.mkstemp()[1]
+        try:
+            with download_taxa_ncbi.FTPSessionPool('127.0.0.1', port=self.server.address[1], size=2) as ftp_pool:
+                all_genome_files = download_taxa_ncbi.download_genomes(self.genomes, log, ftp_pool=ftp_pool)
+            with open(log) as reader:
+                loglines = reader.readlines()
+        finally:
+            os.remove(log)
+
+        self.assertLessEqual(ftp_pool.logins, 2)
+        self.assertEqual(3, len(all_genome_files))
+        for genome, genome_files in zip(self.genomes, all_genome_files):
+            self.assertEqual(2, len(genome_files))
+            for projectid, gbk_file, ptt_file in genome_files:
+                self.assertEqual(genome['Assembly Accession'], projectid)
+                self.assertTrue(os.path.getsize(gbk_file))
+                self.assertIsNone(ptt_file)
+
+        # Log lines should appear in the order of genomes
+        self.assertEqual([genome['Assembly Accession'] for genome in self.genomes],
+                         [line.split('\t')[0] for line in loglines])
+
+
+class TestFTPSessionPoolRetries(unittest.TestCase):
+
+    def test_retrieve_retries_transient_errors(self):
+        '''
+        Fail a login with a connection reset and a transfer with a temporary error, and assert both are retried.
+        '''
+        ftp_pool = download_taxa_ncbi.FTPSessionPool('127.0.0.1', size=1, retries=2, backoff=0)
+        failures = [socket.error(errno.ECONNRESET, 'Connection reset by peer'), error_temp('421 Timeout')]
+        sessions = []
+
+        class _Session(object):
+            """Session whose transfer raises the next failure, if any, or writes a GenBank record otherwise."""
+
+            def __init__(self, failure):
+                self.failure = failure
+                self.closed = False
+
+            def retrbinary(self, command, callback):
+                if self.failure:
+                    raise self.failure
+                callback(GENBANK.format('NC_00'))
+
+            def close(self):
+                self.closed = True
+
+            def quit(self):
+                self.closed = True
+
+        def _flaky_login():
+            """Raise the first failure while logging in, and hand out a session failing the transfer second."""
+            failure = failures.pop(0) if failures else None
+            if isinstance(failure, socket.error):
+                raise failure
+            sessions.append(_Session(failure))
+            return sessions[-1]
+        ftp_pool._login = _flaky_login
+
+        target = tempfile.mkstemp()[1]
+        try:
+            with ftp_pool:
+                ftp_pool.retrieve('/genomes/ASSEMBLY_BACTERIA/Test_genus/GCF_0/NC_00.gbk', target)
+            with open(target) as reader:
+                contents = reader.read()
+        finally:
+            os.remove(target)
+        self.assertEqual(GENBANK.format('NC_00'), contents)
+        self.assertEqual(2, len(sessions))
+        self.assertTrue(all(session.closed for session in sessions))
+
+    def test_retrieve_gives_up_after_retries(self):
+        '''
+        Assert transient errors are raised once all retries are exhausted.
+        '''
+        ftp_pool = download_taxa_ncbi.FTPSessionPool('127.0.0.1', size=1, retries=1, backoff=0)
+        attempts = []
+
+        def _reset_login():
+            """Fail every login with a connection reset."""
+            attempts.append(None)
+            raise socket.error(errno.ECONNRESET, 'Connection reset by peer')
+        ftp_pool._login = _reset_login
+        self.assertRaises(socket.error, ftp_pool.retrieve, '/genomes/NC_00.gbk', os.devnull)
+        self.assertEqual(2, len(attempts))
+
+
+class TestGenbankProbe(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='genbank_probe_')
+        self.manifest = GenomeCacheManifest(os.path.join(self.directory, 'manifest.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write_genbank(self, contents):
+        """Write contents to a GenBank file in the temporary directory and return its path."""
+        gbk_file = os.path.join(self.directory, 'NC_00.gbk')
+        with open(gbk_file, mode='w') as write_handle:
+            write_handle.write(contents)
+        return gbk_file
+
+    def test_genbank_has_cds(self):
+        '''
+        Assert a CDS feature is found in the feature table, and the answer is stored in the manifest.
+        '''
+        gbk_file = self._write_genbank(GENBANK.format('NC_00'))
+        self.manifest.record_file(gbk_file, '17745.1')
+        self.assertTrue(download_taxa_ncbi._genbank_has_cds(gbk_file, self.manifest))
+        self.assertEqual(1, self.manifest.lookup(gbk_file)['has_cds'])
+
+    def test_genbank_without_cds(self):
+        '''
+        Assert CDS mentioned outside of the feature table, for instance in a definition, are ignored.
+        '''
+        contents = GENBANK.format('NC_00').replace('DEFINITION  Test record.', 'DEFINITION  CDS test record.')
+        contents = contents.replace('     CDS             1..12\n', '     gene            1..12\n')
+        gbk_file = self._write_genbank(contents)
+        self.assertFalse(download_taxa_ncbi._genbank_has_cds(gbk_file, self.manifest))
+
+    def test_genbank_has_cds_reset_on_download(self):
+        '''
+        Assert the stored answer is reused until the file is recorded as retrieved again.
+        '''
+        gbk_file = self._write_genbank(GENBANK.format('NC_00'))
+        self.manifest.record_file(gbk_file, '17745.1')
+        self.assertTrue(download_taxa_ncbi._genbank_has_cds(gbk_file, self.manifest))
+
+        # Remove the CDS without recording a new download: the stored answer should be reused
+        self._write_genbank(GENBANK.format('NC_00').replace('     CDS ', '     gene'))
+        self.assertTrue(download_taxa_ncbi._genbank_has_cds(gbk_file, self.manifest))
+
+        # Once the file is recorded as retrieved again the file should be scanned again
+        self.manifest.record_file(gbk_file, '17745.1')
+        self.assertFalse(download_taxa_ncbi._genbank_has_cds(gbk_file, self.manifest))
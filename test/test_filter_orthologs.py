@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing.pool import RUN
+
+import filter_orthologs
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='filter_orthologs_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _aligned_file(self, name, **sequences):
+        '''Write the sequences given as keyword arguments to an aligned file, with headers named after their keyword.'''
+        aligned_file = os.path.join(self.directory, name + '.trimmed')
+        with open(aligned_file, mode='w') as write_handle:
+            for genome, sequence in sorted(sequences.items()):
+                write_handle.write('>{0}|trimmed\n{1}\n'.format(genome, sequence))
+        return aligned_file
+
+    def test_ortholog_bipartition(self):
+        '''
+        Assert the bipartition of a tree tells whether the genomes of either taxon group together.
+        '''
+        separate = self._aligned_file('COG1', a1='ACGTACGTACGTACGTACGT', a2='ACGTACGTACGTACGTACGA',
+                                      b1='TCGAACCTACGAACGTTCGT', b2='TCGAACCTACGAACGTTCGA')
+        clades = filter_orthologs._ortholog_bipartition(separate)
+        self.assertEqual((['a1', 'a2'], ['b1', 'b2']), clades)
+        self.assertFalse(filter_orthologs._tree_shows_recombination(['a1', 'a2'], ['b1', 'b2'], clades, separate))
+        self.assertFalse(filter_orthologs._tree_shows_recombination(['b2', 'b1'], ['a2', 'a1'], clades, separate))
+        self.assertTrue(filter_orthologs._tree_shows_recombination(['a1', 'b1'], ['a2', 'b2'], clades, separate))
+
+    def test_phipack_for_all_orthologs(self):
+        '''
+        Assert orthologs are filtered in a pool of worker processes, in order, and that the pool is closed on errors.
+        '''
+        separate = self._aligned_file('COG1', a1='ACGTACGTACGTACGTACGT', a2='ACGTACGTACGTACGTACGA',
+                                      b1='TCGAACCTACGAACGTTCGT', b2='TCGAACCTACGAACGTTCGA')
+        mixed = self._aligned_file('COG2', a1='ACGTACGTACGTACGTACGT', b1='ACGTACGTACGTACGTACGA',
+                                   a2='TCGAACCTACGAACGTTCGT', b2='TCGAACCTACGAACGTTCGA')
+        pools = []
+        original_pool = filter_orthologs.Pool
+
+        def _tracked_pool(*args):
+            '''Keep track of the pools created.'''
+            pools.append(original_pool(*args))
+            return pools[-1]
+        filter_orthologs.Pool = _tracked_pool
+        try:
+            aligned_files = [mixed, separate, mixed]
+            non_recomb, recombined = filter_orthologs._phipack_for_all_orthologs(aligned_files, ['a1', 'a2'],
+                                                                                 ['b1', 'b2'], jobs=2)
+            self.assertEqual([separate], non_recomb)
+            self.assertEqual([mixed, mixed], recombined)
+
+            # Genomes missing from the tree fail the assertion, after which the pool should still be closed
+            self.assertRaises(AssertionError, filter_orthologs._phipack_for_all_orthologs, aligned_files,
+                              ['c1'], ['b1', 'b2'], jobs=2)
+        finally:
+            filter_orthologs.Pool = original_pool
+        self.assertEqual(2, len(pools))
+        self.assertTrue(all(pool._state != RUN for pool in pools))
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from genome_cache import GenomeCacheManifest, file_checksum
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='genome_cache_')
+        self.manifest = GenomeCacheManifest(os.path.join(self.directory, 'manifest.sqlite'))
+        self.gbk_file = os.path.join(self.directory, 'NC_009801.gbk')
+        with open(self.gbk_file, mode='w') as write_handle:
+            write_handle.write('LOCUS\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_file(self):
+        '''
+        Record a retrieved file and assert its size, checksum and source are stored.
+        '''
+        self.manifest.record_file(self.gbk_file, '17745.1', '/genomes/NC_009801.gbk', remote_date=1391122800)
+        entry = self.manifest.lookup(self.gbk_file)
+        self.assertEqual('17745.1', entry['genome'])
+        self.assertEqual('/genomes/NC_009801.gbk', entry['source'])
+        self.assertEqual(6, entry['size'])
+        self.assertEqual(file_checksum(self.gbk_file), entry['checksum'])
+        self.assertEqual(1391122800, entry['remote_date'])
+        self.assertIsNone(self.manifest.lookup(os.path.join(self.directory, 'missing.gbk')))
+
+    def test_is_fresh(self):
+        '''
+        Assert files are fresh when retrieved after the age limit, and their size did not change since.
+        '''
+        self.manifest.record_file(self.gbk_file, retrieved=time.time())
+        self.assertTrue(self.manifest.is_fresh(self.gbk_file, time.time() - 60))
+        self.assertFalse(self.manifest.is_fresh(self.gbk_file, time.time() + 60))
+
+        # Truncated files should no longer be considered fresh
+        open(self.gbk_file, mode='w').close()
+        self.assertFalse(self.manifest.is_fresh(self.gbk_file, time.time() - 60))
+
+    def test_translation_of(self):
+        '''
+        Assert translations are returned only for the contents of the GenBank file they were translated from.
+        '''
+        dna_file = os.path.join(self.directory, 'NC_009801.ffn')
+        protein_file = os.path.join(self.directory, 'NC_009801.faa')
+        for path in (dna_file, protein_file):
+            open(path, mode='w').close()
+
+        self.manifest.record_file(self.gbk_file)
+        self.assertIsNone(self.manifest.translation_of(self.gbk_file))
+        self.manifest.record_translation(self.gbk_file, dna_file, protein_file)
+        self.assertEqual((dna_file, protein_file), self.manifest.translation_of(self.gbk_file))
+
+        # Once different contents are retrieved, the previous translation no longer applies
+        with open(self.gbk_file, mode='a') as write_handle:
+            write_handle.write('//\n')
+        self.manifest.record_file(self.gbk_file)
+        self.assertIsNone(self.manifest.translation_of(self.gbk_file))
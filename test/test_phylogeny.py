@@ -0,0 +1,59 @@
+import math
+import unittest
+
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from phylogeny import alignment_tree, distance_matrix, root_bipartition, upgma
+
+
+def _alignment(**sequences):
+    '''Create an alignment of the sequences given as keyword arguments, named after their keyword.'''
+    return MultipleSeqAlignment(SeqRecord(Seq(seq), id=name + '|trimmed') for name, seq in sorted(sequences.items()))
+
+
+class Test(unittest.TestCase):
+
+    def test_distance_matrix_k80(self):
+        '''
+        Assert Kimura 2-parameter distances are calculated from transitions and transversions, ignoring gapped sites.
+        '''
+        alignment = _alignment(a='ACGTACGTAC--', b='GCGTACGTAATT')
+        distances = distance_matrix(alignment, model='K80')
+        p_value, q_value = 1 / 10., 1 / 10.
+        expected = -0.5 * math.log(1 - 2 * p_value - q_value) - 0.25 * math.log(1 - 2 * q_value)
+        self.assertAlmostEqual(expected, distances[0, 1], places=6)
+        self.assertEqual(0, distances[0, 0])
+
+    def test_distance_matrix_f84_equal_frequencies(self):
+        '''
+        Assert F84 distances equal K80 distances when all base frequencies are equal.
+        '''
+        alignment = _alignment(a='ACGTACGTACGTACGT', b='GCATACGTACGTACGT', c='CAGTACGTACGTACGT', d='ACGTACGTACGTTGCA')
+        f84 = distance_matrix(alignment)
+        k80 = distance_matrix(alignment, model='K80')
+        self.assertTrue(abs(f84 - k80).max() < 1e-6)
+
+    def test_upgma(self):
+        '''
+        Assert UPGMA joins the closest clusters first, placing joins at half their average distance.
+        '''
+        distances = [[0, 2, 6, 6],
+                     [2, 0, 6, 6],
+                     [6, 6, 0, 4],
+                     [6, 6, 4, 0]]
+        tree = upgma(['a', 'b', 'c', 'd'], distances)
+        self.assertEqual((['a', 'b'], ['c', 'd']), root_bipartition(tree))
+        self.assertEqual(1, tree.find_any(name='a').branch_length)
+        self.assertEqual(2, tree.find_any(name='d').branch_length)
+
+    def test_alignment_tree(self):
+        '''
+        Assert two groups of genomes separate at the root of the tree built from their alignment.
+        '''
+        alignment = _alignment(**{'58191': 'ACGTACGTACGTACGTACGT',
+                                  '58017': 'ACGTACGTACGTACGTACGA',
+                                  '59245': 'TCGAACCTACGAACGTTCGT',
+                                  '58803': 'TCGAACCTACGAACGTTCGA'})
+        self.assertEqual((['58017', '58191'], ['58803', '59245']), root_bipartition(alignment_tree(alignment)))
@@ -0,0 +1,116 @@
+import itertools
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from Bio import AlignIO
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+import numpy
+
+from genome_cache import GenomeCacheManifest
+from recombination import informative_sites, incompatibility_matrix, recombination_values
+from versions import PHIPACK
+import recombination
+import run_phipack
+
+
+def _alignment(partitions):
+    '''Create an alignment of eight sequences, with one site per partition of sequences sharing a G instead of an A.'''
+    sequences = [''.join('G' if index in partition else 'A' for partition in partitions) for index in range(8)]
+    return MultipleSeqAlignment(SeqRecord(Seq(sequence), id=str(index)) for index, sequence in enumerate(sequences))
+
+
+class Test(unittest.TestCase):
+
+    def test_informative_sites(self):
+        '''
+        Assert only sites with at least two states occurring twice, and without gaps, are informative.
+        '''
+        matrix = numpy.array([list('AAAAC'), list('AACAC'), list('ACCGT'), list('ACC-T')]).view(numpy.uint8)
+        sites = informative_sites(matrix.reshape(4, 5))
+        self.assertEqual([[0, 1], [0, 1], [1, 3], [1, 3]], sites.tolist())
+
+    def test_incompatibility_matrix(self):
+        '''
+        Assert compatible sites score zero, and that all four gametes between binary sites require a homoplasy.
+        '''
+        sites = numpy.array([[0, 0, 0, 0],
+                             [0, 0, 1, 1],
+                             [1, 0, 0, 2],
+                             [1, 1, 1, 2]])
+        self.assertEqual([[0, 0, 1, 0],
+                          [0, 0, 0, 0],
+                          [1, 0, 0, 0],
+                          [0, 0, 0, 0]], incompatibility_matrix(sites).tolist())
+
+    def test_incompatibility_matrix_blocks(self):
+        '''
+        Assert scoring sites in blocks gives the same incompatibilities as scoring all sites at once.
+        '''
+        sites = numpy.random.RandomState(0).randint(0, 4, size=(12, 150))
+        original_block = recombination._BLOCK
+        try:
+            recombination._BLOCK = len(sites[0])
+            expected = incompatibility_matrix(sites)
+        finally:
+            recombination._BLOCK = original_block
+        self.assertEqual(expected.tolist(), incompatibility_matrix(sites).tolist())
+
+    def test_window_sums(self):
+        '''
+        Assert window sums match those of the explicit matrix of positions within window of each other.
+        '''
+        for size, window in ((5, 1), (10, 3), (10, 100)):
+            distance = numpy.abs(numpy.subtract.outer(numpy.arange(size), numpy.arange(size)))
+            windows = ((0 < distance) & (distance <= window)).astype(float)
+            self.assertEqual(recombination._matrix_sums(windows), recombination._window_sums(size, window))
+            matrix = numpy.arange(size * size).reshape(size, size)
+            self.assertEqual((windows * matrix).sum(), recombination._window_sum(matrix, window))
+
+    def test_recombination_values(self):
+        '''
+        Assert recombination is detected when sites in one half support another tree than sites in the other half.
+        '''
+        first_tree = [(0, 1), (2, 3), (4, 5), (6, 7), (0, 1, 2, 3)]
+        second_tree = [(0, 2), (1, 3), (4, 6), (5, 7), (0, 2, 4, 6)]
+        recombined = recombination_values(_alignment(first_tree * 8 + second_tree * 8), window=10, permutations=200)
+        self.assertEqual(80, recombined['PhiPack sites'])
+        self.assertLess(recombined['Phi'], 0.001)
+        self.assertLess(recombined['Max Chi^2'], 0.05)
+        self.assertLess(recombined['NSS'], 0.05)
+
+        # Deterministic for a given seed
+        self.assertEqual(recombined, recombination_values(_alignment(first_tree * 8 + second_tree * 8), window=10,
+                                                          permutations=200, jobs=2))
+
+        # When sites supporting either tree are interleaved, there is no signal of recombination
+        interleaved = list(itertools.chain(*zip(first_tree * 8, second_tree * 8)))
+        mixed = recombination_values(_alignment(interleaved), window=10, permutations=200)
+        self.assertLess(0.05, mixed['Phi'])
+        self.assertLess(0.05, mixed['Max Chi^2'])
+
+    @unittest.skipUnless(os.path.isfile(PHIPACK), 'PhiPack must be available')
+    def test_recombination_values_against_phipack(self):
+        '''
+        Assert values agree with those PhiPack logs for the same alignments, within the noise of the permutations.
+        '''
+        first_tree = [(0, 1), (2, 3), (4, 5), (6, 7), (0, 1, 2, 3)]
+        second_tree = [(0, 2), (1, 3), (4, 6), (5, 7), (0, 2, 4, 6)]
+        interleaved = list(itertools.chain(*zip(first_tree * 8, second_tree * 8)))
+        directory = tempfile.mkdtemp(prefix='recombination_')
+        try:
+            manifest = GenomeCacheManifest(os.path.join(directory, 'manifest.sqlite'))
+            for index, partitions in enumerate((first_tree * 8 + second_tree * 8, interleaved)):
+                dna_file = os.path.join(directory, 'alignment{0}.fasta'.format(index))
+                AlignIO.write(_alignment(partitions), dna_file, 'fasta')
+                expected = run_phipack.run_phipack(directory, dna_file, cache_dir=directory, manifest=manifest)
+                actual = recombination_values(AlignIO.read(dna_file, 'fasta'))
+                self.assertEqual(expected['PhiPack sites'], actual['PhiPack sites'])
+                self.assertAlmostEqual(expected['Phi'], actual['Phi'], delta=0.01)
+                self.assertAlmostEqual(expected['Max Chi^2'], actual['Max Chi^2'], delta=0.1)
+                self.assertAlmostEqual(expected['NSS'], actual['NSS'], delta=0.1)
+        finally:
+            shutil.rmtree(directory)
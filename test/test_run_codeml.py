@@ -0,0 +1,76 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+import run_codeml
+
+# Stand-in for codeml, which counts its invocations and writes pairwise values for each data set in the control file
+FAKE_CODEML = '''#!/bin/sh
+echo run >> {calls}
+ndata=$(sed -n 's/^ *ndata = \\([0-9]*\\).*/\\1/p' codeml.ctl)
+outfile=$(sed -n 's/^ *outfile = \\([^ ]*\\).*/\\1/p' codeml.ctl)
+for index in $(seq 1 $ndata); do
+    printf '\\n\\nData set %d\\n\\npairwise comparison, codon frequencies: F3X4.\\n' $index >> $outfile
+    printf 't= 0.%04d  S=    10.0  N=    20.0  dN/dS= 0.5000  dN= 0.1000  dS= 0.2000\\n' $index >> $outfile
+done
+'''
+
+
+def _pair(sequence_a, sequence_b):
+    '''Return single sequence alignments for clade A & B.'''
+    return (MultipleSeqAlignment([SeqRecord(Seq(sequence_a), id='a')]),
+            MultipleSeqAlignment([SeqRecord(Seq(sequence_b), id='b')]))
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='run_codeml_')
+        self.calls = os.path.join(self.directory, 'calls')
+        self.codeml = os.path.join(self.directory, 'codeml')
+        with open(self.codeml, mode='w') as write_handle:
+            write_handle.write(FAKE_CODEML.format(calls=self.calls))
+        os.chmod(self.codeml, stat.S_IRWXU)
+        self.original_codeml = run_codeml.CODEML
+        run_codeml.CODEML = self.codeml
+
+    def tearDown(self):
+        run_codeml.CODEML = self.original_codeml
+        shutil.rmtree(self.directory)
+
+    def test_pairwise_dnds_for_all(self):
+        '''
+        Assert values of batched codeml runs are demultiplexed in order, with one codeml run per batch.
+        '''
+        pairs = [_pair('ATGCTTAAA', 'ATGCTCAAA')] * 5
+        values = run_codeml.pairwise_dnds_for_all(pairs, batch_size=2, jobs=2)
+        self.assertEqual([0.0001, 0.0002, 0.0001, 0.0002, 0.0001], [value_dict['t'] for value_dict in values])
+        self.assertEqual([2.] * 5, [value_dict['Ds'] for value_dict in values])
+        with open(self.calls) as read_handle:
+            self.assertEqual(3, len(read_handle.readlines()))
+
+    def test_write_phylip_datasets(self):
+        '''
+        Assert sequence pairs are written as consecutive PHYLIP data sets.
+        '''
+        phylip_file = os.path.join(self.directory, 'batch.phy')
+        run_codeml._write_phylip_datasets([('ATG', 'ATA'), ('CTTAAA', 'CTCAAA')], phylip_file)
+        with open(phylip_file) as read_handle:
+            self.assertEqual('  2  3\nclade_a  ATG\nclade_b  ATA\n\n  2  6\nclade_a  CTTAAA\nclade_b  CTCAAA\n\n',
+                             read_handle.read())
+
+    def test_pairwise_dnds_for_all_unbatched(self):
+        '''
+        Assert codeml runs once per pair by default, with values returned in order.
+        '''
+        pairs = [_pair('ATGCTTAAA', 'ATGCTCAAA')] * 3
+        values = run_codeml.pairwise_dnds_for_all(pairs, jobs=2)
+        self.assertEqual([0.0001] * 3, [value_dict['t'] for value_dict in values])
+        with open(self.calls) as read_handle:
+            self.assertEqual(3, len(read_handle.readlines()))
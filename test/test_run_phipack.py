@@ -0,0 +1,109 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from genome_cache import GenomeCacheManifest
+import run_phipack
+
+# Stand-in for PhiPack, which counts its invocations and writes a Phi.log file to the working directory
+FAKE_PHIPACK = '''#!/bin/sh
+echo run >> {calls}
+cat > Phi.log <<END
+Found 103 informative sites.
+PHI (Normal):        9.04e-01
+Max Chi^2:           6.60e-01  (1000 permutations)
+NSS:                 6.31e-01  (1000 permutations)
+END
+'''
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='run_phipack_')
+        # Keep cached values and their manifest out of the shared cache directory
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        os.mkdir(self.cache_dir)
+        self.manifest = GenomeCacheManifest(os.path.join(self.directory, 'manifest.sqlite'))
+        self.calls = os.path.join(self.directory, 'calls')
+        self.phipack = os.path.join(self.directory, 'Phi')
+        with open(self.phipack, mode='w') as write_handle:
+            write_handle.write(FAKE_PHIPACK.format(calls=self.calls))
+        os.chmod(self.phipack, stat.S_IRWXU)
+        self.original_phipack = run_phipack.PHIPACK
+        run_phipack.PHIPACK = self.phipack
+
+        self.dna_files = []
+        for index, sequence in enumerate(('ACGTAC', 'ACGTAA', 'ACGTAG')):
+            dna_file = os.path.join(self.directory, 'COG{0}.ffn'.format(index))
+            with open(dna_file, mode='w') as write_handle:
+                write_handle.write('>58191|a\n{0}\n>58017|b\nACGTTT\n'.format(sequence))
+            self.dna_files.append(dna_file)
+
+    def tearDown(self):
+        run_phipack.PHIPACK = self.original_phipack
+        shutil.rmtree(self.directory)
+
+    def _run_phipack_for_all(self):
+        '''Run PhiPack for all files, with values cached in the temporary directory.'''
+        return run_phipack.run_phipack_for_all(self.directory, self.dna_files, jobs=2,
+                                               cache_dir=self.cache_dir, manifest=self.manifest)
+
+    def _count_calls(self):
+        '''Return the number of times the stand-in PhiPack was called.'''
+        if not os.path.isfile(self.calls):
+            return 0
+        with open(self.calls) as read_handle:
+            return len(read_handle.readlines())
+
+    def test_run_phipack_for_all(self):
+        '''
+        Assert PhiPack values are returned in order for all files, and reused from cache on a rerun.
+        '''
+        expected = {'PhiPack sites': 103, 'Phi': 0.904, 'Max Chi^2': 0.66, 'NSS': 0.631}
+        self.assertEqual([expected] * 3, self._run_phipack_for_all())
+        self.assertEqual(3, self._count_calls())
+
+        # Rerunning should not call PhiPack again
+        self.assertEqual([expected] * 3, self._run_phipack_for_all())
+        self.assertEqual(3, self._count_calls())
+
+        # Cache accesses are recorded in the manifest passed in, with values cached in the directory passed in
+        self.assertEqual((3, 3, 0.5), self.manifest.hit_rates()['phipack'])
+        self.assertTrue(all(path.startswith(self.cache_dir) for path in self.manifest.last_accesses()))
+
+    def test_run_phipack_for_all_native(self):
+        '''
+        Assert the native backend shares a single pool of worker processes across files, without affecting values.
+        '''
+        dna_files = []
+        for index in range(3):
+            dna_file = os.path.join(self.directory, 'native{0}.ffn'.format(index))
+            with open(dna_file, mode='w') as write_handle:
+                for genome, sequence in (('a', 'AAAAAAAA'), ('b', 'AAAACCCC'), ('c', 'CCCCAAAA'), ('d', 'CCCCCCCC')):
+                    write_handle.write('>{0}|{1}\n{2}{3}\n'.format(genome, index, sequence, 'G' * index))
+            dna_files.append(dna_file)
+
+        pools = []
+        original_pool = run_phipack.Pool
+
+        def _counting_pool(*args):
+            '''Keep track of the pools created.'''
+            pools.append(original_pool(*args))
+            return pools[-1]
+        run_phipack.Pool = _counting_pool
+        try:
+            pooled = run_phipack.run_phipack_for_all(self.directory, dna_files, jobs=2, backend='native',
+                                                     cache_dir=self.cache_dir, manifest=self.manifest)
+        finally:
+            run_phipack.Pool = original_pool
+        self.assertEqual(1, len(pools))
+
+        sequential_cache = os.path.join(self.directory, 'sequential')
+        os.mkdir(sequential_cache)
+        sequential = run_phipack.run_phipack_for_all(self.directory, dna_files, jobs=1, backend='native',
+                                                     cache_dir=sequential_cache, manifest=self.manifest)
+        self.assertEqual(sequential, pooled)
+        self.assertEqual([8] * 3, [values['PhiPack sites'] for values in pooled])
@@ -33,3 +33,133 @@ class Test(unittest.TestCase):
         finally:
             os.remove(fakefile)
             shutil.rmtree(target_dir)
+
+    def test_iterate_archive_of_files(self):
+        '''
+        Iterate over a sample zipfile and assert the contents of the first and only file are read without extracting.
+        '''
+        archive_file = shared.resource_filename(__name__, 'data/shared/sample.txt.zip')
+        contents = [(filename, read_handle.read())
+                    for filename, read_handle in shared.iterate_archive_of_files(archive_file)]
+        self.assertEqual(1, len(contents))
+        self.assertEqual("12345", contents[0][1])
+
+    def test_create_archive_of_records(self):
+        '''
+        Assert records are written to files in an uncompressed archive, and read back from it as they were written.
+        '''
+        from Bio import SeqIO
+        from Bio.Seq import Seq
+        from Bio.SeqRecord import SeqRecord
+        from zipfile import ZipFile, ZIP_STORED
+        archive_file = tempfile.mkstemp(suffix='.zip')[1]
+        try:
+            records = [SeqRecord(Seq('ATGAAA'), id='58191|a', description=''), SeqRecord(Seq('ATGTTT'), id='58017|b')]
+            filenames = shared.create_archive_of_records(archive_file,
+                                                         [('COG1.ffn', records), ('COG2.ffn', records[:1])],
+                                                         compression=ZIP_STORED)
+            self.assertEqual(['COG1.ffn', 'COG2.ffn'], filenames)
+            self.assertEqual([ZIP_STORED] * 2, [zipinfo.compress_type for zipinfo in ZipFile(archive_file).infolist()])
+            self.assertEqual([('COG1.ffn', ['ATGAAA', 'ATGTTT']), ('COG2.ffn', ['ATGAAA'])],
+                             [(filename, [str(seqr.seq) for seqr in SeqIO.parse(read_handle, 'fasta')])
+                              for filename, read_handle in shared.iterate_archive_of_files(archive_file)])
+        finally:
+            os.remove(archive_file)
+
+    def test_create_archives_of_records(self):
+        '''
+        Assert records are written to multiple archives in a single pass, with a placeholder in archives left empty.
+        '''
+        from Bio.Seq import Seq
+        from Bio.SeqRecord import SeqRecord
+        from zipfile import ZipFile
+        directory = tempfile.mkdtemp(prefix='archives_of_records_')
+        try:
+            archive_files = [os.path.join(directory, name) for name in ('a.zip', 'b.zip')]
+            records = [SeqRecord(Seq('ATGAAA'), id='58191|a', description='')]
+            named_records = ([('COG{0}.a.ffn'.format(index), records), ('COG{0}.b.ffn'.format(index), records)]
+                             for index in range(2))
+            filenames = shared.create_archives_of_records(archive_files, named_records)
+            self.assertEqual([['COG0.a.ffn', 'COG1.a.ffn'], ['COG0.b.ffn', 'COG1.b.ffn']], filenames)
+            self.assertEqual(filenames, [ZipFile(archive_file).namelist() for archive_file in archive_files])
+
+            self.assertEqual([[], []], shared.create_archives_of_records(archive_files, []))
+            self.assertEqual([['empty'], ['empty']],
+                             [ZipFile(archive_file).namelist() for archive_file in archive_files])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_parse_header(self):
+        '''
+        Parse a sample header line and assert fields are split once, with genome IDs and COGs interned.
+        '''
+        header = shared.parse_header('58191|NC_010067.1|YP_001569097.1|COG4948MR|some|gene name')
+        self.assertEqual('58191', header.genome)
+        self.assertEqual('NC_010067.1', header.accession)
+        self.assertEqual('YP_001569097.1', header.protein)
+        self.assertEqual('COG4948MR', header.cog)
+        self.assertEqual('some|gene name', header.product)
+        self.assertIs(intern('58191'), header.genome)
+        self.assertIs(intern('COG4948MR'), header.cog)
+
+    def test_parse_header_missing_fields(self):
+        '''
+        Assert headers with fewer fields, such as those of concatemers, are padded with None values.
+        '''
+        header = shared.parse_header('58191|trimmed')
+        self.assertEqual(('58191', 'trimmed', None, None, None), header)
+
+    def test_get_most_recent_gene_name_from_headers(self):
+        '''
+        Assert the product is taken from the most recently modified genome, when passing parsed headers.
+        '''
+        import datetime
+        genomes = [{'Assembly Accession': '1.1', 'Modify Date': None, 'Release Date': datetime.datetime(2010, 1, 1)},
+                   {'Assembly Accession': '2.1', 'Modify Date': datetime.datetime(2012, 1, 1), 'Release Date': None}]
+        headers = [shared.parse_header('1.1|NC_1|YP_1|COG1A|older'),
+                   shared.parse_header('2.1|NC_2|YP_2|None|newer')]
+        self.assertEqual('newer', shared.get_most_recent_gene_name(genomes, headers))
+        self.assertEqual(set(['COG1A']), shared.find_cogs_in_sequence_records(headers))
+
+        # Genomes ranked once up front give the same gene name
+        ranking = shared.GenomeRanking(genomes)
+        self.assertEqual({'2.1': 0, '1.1': 1}, ranking.ranks)
+        self.assertEqual('newer', shared.get_most_recent_gene_name(ranking, headers))
+
+    def test_genome_ranking_special_cases(self):
+        '''
+        Assert ranking keeps ties in input order, with the same gene names for hypothetical and unranked genomes.
+        '''
+        import datetime
+        genomes = [{'Assembly Accession': '1.1', 'Modify Date': None, 'Release Date': datetime.datetime(2010, 1, 1)},
+                   {'Assembly Accession': '2.1', 'Modify Date': datetime.datetime(2010, 1, 1), 'Release Date': None},
+                   {'Assembly Accession': '3.1', 'Modify Date': None, 'Release Date': datetime.datetime(2009, 1, 1)}]
+        ranking = shared.GenomeRanking(genomes)
+        self.assertEqual({'1.1': 0, '2.1': 1, '3.1': 2}, ranking.ranks)
+        cases = [['1.1|NC_1|YP_1|COG1A|first', '2.1|NC_2|YP_2|COG1A|second'],
+                 ['1.1|NC_1|YP_1|COG1A|hypothetical_protein', '3.1|NC_3|YP_3|COG1A|older'],
+                 ['1.1|NC_1|YP_1|COG1A|hypothetical_protein', '2.1|NC_2|YP_2|COG1A|hypothetical_protein'],
+                 ['4.1|NC_4|YP_4|COG1A|unranked', '3.1|NC_3|YP_3|COG1A|older']]
+        for case in cases:
+            headers = [shared.parse_header(header) for header in case]
+            self.assertEqual(shared.get_most_recent_gene_name(genomes, headers),
+                             shared.get_most_recent_gene_name(ranking, headers))
+        self.assertEqual(['first', 'older', 'hypothetical_protein', 'older'],
+                         [shared.get_most_recent_gene_name(ranking, [shared.parse_header(header) for header in case])
+                          for case in cases])
+
+    def test_ortholog_metadata(self):
+        '''
+        Assert headers, COGs and product are all retrieved from a single parse of an ortholog file.
+        '''
+        import datetime
+        genomes = [{'Assembly Accession': '1.1', 'Modify Date': None, 'Release Date': datetime.datetime(2010, 1, 1)},
+                   {'Assembly Accession': '2.1', 'Modify Date': datetime.datetime(2012, 1, 1), 'Release Date': None}]
+        ortholog_file = tempfile.mkstemp(suffix='.ffn')[1]
+        with open(ortholog_file, mode='w') as write_handle:
+            write_handle.write('>1.1|NC_1|YP_1|COG1A|older gene\nATG\n>2.1|NC_2|YP_2|COG2B|newer gene\nATG\n')
+        metadata = shared.ortholog_metadata(ortholog_file, shared.GenomeRanking(genomes))
+        os.remove(ortholog_file)
+        self.assertEqual(['YP_1', 'YP_2'], [header.protein for header in metadata.headers])
+        self.assertEqual(set(['COG1A', 'COG2B']), metadata.cogs)
+        self.assertEqual('newer gene', metadata.product)
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+from zipfile import ZipFile, ZIP_STORED
+
+from Bio import AlignIO
+from StringIO import StringIO
+import split_by_taxa
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='split_by_taxa_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_main(self):
+        '''
+        Assert each alignment is read once and split into uncompressed archives per taxon, named after their prefix.
+        '''
+        orthologs_zip = os.path.join(self.directory, 'orthologs.zip')
+        with ZipFile(orthologs_zip, mode='w') as zipfile_handle:
+            zipfile_handle.writestr('COG1.ffn', '>58191|a\nATGAAA\n>58017|b\nATG-TT\n>58018|c\nATGTTT\n')
+            zipfile_handle.writestr('COG2.ffn', '>58191|a\nATGCTT\n>58017|b\nATGCTC\n>58018|c\nATGCTA\n')
+        genomes_a = os.path.join(self.directory, 'genomes_a.tsv')
+        with open(genomes_a, mode='w') as write_handle:
+            write_handle.write('58191\tEscherichia coli A\n58018\tEscherichia coli B\n')
+        genomes_b = os.path.join(self.directory, 'genomes_b.tsv')
+        with open(genomes_b, mode='w') as write_handle:
+            write_handle.write('58017\tSalmonella\n')
+
+        reads = []
+        original_iterate = split_by_taxa.iterate_archive_of_files
+
+        def _counting_iterate(archive_file):
+            '''Keep track of the archives read.'''
+            reads.append(archive_file)
+            return original_iterate(archive_file)
+        split_by_taxa.iterate_archive_of_files = _counting_iterate
+        try:
+            taxon_a_zip, taxon_b_zip = split_by_taxa.main(['--genomes-a', genomes_a, '--genomes-b', genomes_b,
+                                                           '--orthologs-zip', orthologs_zip,
+                                                           '--taxon-a-zip', os.path.join(self.directory, 'a.zip'),
+                                                           '--taxon-b-zip', os.path.join(self.directory, 'b.zip')])
+        finally:
+            split_by_taxa.iterate_archive_of_files = original_iterate
+        self.assertEqual([orthologs_zip], reads)
+
+        with ZipFile(taxon_a_zip) as archive_a, ZipFile(taxon_b_zip) as archive_b:
+            self.assertEqual(['COG1.Escherichiacoli.ffn', 'COG2.Escherichiacoli.ffn'], archive_a.namelist())
+            self.assertEqual(['COG1.Salmonella.ffn', 'COG2.Salmonella.ffn'], archive_b.namelist())
+            self.assertEqual([ZIP_STORED] * 4, [zipinfo.compress_type
+                                                for zipinfo in archive_a.infolist() + archive_b.infolist()])
+            alignment = AlignIO.read(StringIO(archive_a.read('COG1.Escherichiacoli.ffn')), 'fasta')
+            self.assertEqual(['58191|a', '58018|c'], [seqr.id for seqr in alignment])
+            alignment = AlignIO.read(StringIO(archive_b.read('COG2.Salmonella.ffn')), 'fasta')
+            self.assertEqual(['ATGCTC'], [str(seqr.seq) for seqr in alignment])
@@ -15,3 +15,20 @@ class Test(unittest.TestCase):
     @unittest.skipUnless(os.path.isdir(SOFTWARE_DIR), 'SOFTWARE_DIR must be available')
     def test_main(self):
         versions.main()
+
+    def test_aligner_version_once(self):
+        '''
+        Assert aligner versions are determined on first use only, and reused for later calls.
+        '''
+        calls = []
+        original_call_program, original_version = versions._call_program, versions.aligner_version.version
+        versions._call_program = lambda *command: calls.append(command) or 'version'
+        versions.aligner_version.version = None
+        try:
+            self.assertEqual([], calls)
+            first = versions.aligner_version()
+            self.assertEqual(first, versions.aligner_version())
+            self.assertEqual(2, len(calls))
+        finally:
+            versions._call_program = original_call_program
+            versions.aligner_version.version = original_version
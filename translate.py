@@ -6,7 +6,6 @@ from Bio.Alphabet.IUPAC import ambiguous_dna
 from Bio.Data import CodonTable
 from Bio.Data.CodonTable import TranslationError
 from Bio.SeqRecord import SeqRecord
-from multiprocessing import Pool
 from operator import itemgetter
 import os
 import re
@@ -14,11 +13,12 @@ import shutil
 import sys
 import tempfile
 
-from download_taxa_ncbi import download_genome_files
+from download_taxa_ncbi import iterate_genome_files
+from genome_cache import default_manifest
 import logging as log
 from select_taxa import select_genomes_by_ids
 from shared import create_directory, concatenate, create_archive_of_files, parse_options, \
-    extract_archive_of_files, CODON_TABLE_ID
+    extract_archive_of_files, CODON_TABLE_ID, parse_header
 
 
 __author__ = "Tim te Beek"
@@ -38,7 +38,8 @@ def _append_external_genomes(external_fasta_files, genomes_file):
             header = read_handle.readline()[1:]
 
             # Header format as requested: >project_id|genbank_ac|protein_id|cog|source
-            label, origin = header.split('|')[0:2]
+            fields = parse_header(header)
+            label, origin = fields.genome, fields.accession
 
             with open(genomes_file, mode='a') as append_handle:
                 # We'll use this 'external genome' source to skip externally derived files when downloading & translating
@@ -80,10 +81,9 @@ def translate_genomes(genomes):
     """Download genome files, extract genes and translate those to proteins, returning DNA and protein fasta files."""
     assert len(genomes), 'Some genomes should be selected'
 
-    # Use a pool to download files in the background while translating
-    pool = Pool()
-    futures = [pool.apply_async(download_genome_files, (genome,)) for genome in genomes]
-    dna_aa_pairs = [_translate_genome(gbk_ptt_pairs.get()) for gbk_ptt_pairs in futures if gbk_ptt_pairs.get() != None]
+    # Use a pool of threads sharing FTP sessions to download files in the background while translating
+    dna_aa_pairs = [_translate_genome(gbk_ptt_pairs) for gbk_ptt_pairs in iterate_genome_files(genomes)
+                    if gbk_ptt_pairs != None]
 
     # Extract DNA & Protein files separately from dna_aa_pairs
     dna_files = [pair[0] for pair in dna_aa_pairs]
@@ -120,12 +120,20 @@ def _extract_gene_and_protein(out_dir, project_id, genbank_file, ptt_file=None,
     dna_file_dest = os.path.join(out_dir, os.path.split(file_root)[1] + '.ffn')
     aa_file_dest = os.path.join(out_dir, os.path.split(file_root)[1] + '.faa')
 
-    # Check if destination output files already exist and have content, and if so return them
+    # Return translations recorded in the manifest for the current contents of the genbank file
+    manifest = default_manifest()
+    if manifest.translation_of(genbank_file) == (dna_file_dest, aa_file_dest):
+        manifest.record_hit('translations', dna_file_dest, aa_file_dest)
+        return dna_file_dest, aa_file_dest
+
+    # Translations cached before the manifest was introduced are validated once using file sizes and modification times
     if (os.path.isfile(aa_file_dest) and 0 < os.path.getsize(aa_file_dest) and
             os.path.isfile(dna_file_dest) and 0 < os.path.getsize(dna_file_dest)):
         # But only if the output files are newer than the genbank file, otherwise translate the newer file & overwrite
         if (os.path.getmtime(genbank_file) < os.path.getmtime(aa_file_dest) and
                 os.path.getmtime(genbank_file) < os.path.getmtime(dna_file_dest)):
+            manifest.record_translation(genbank_file, dna_file_dest, aa_file_dest)
+            manifest.record_hit('translations', dna_file_dest, aa_file_dest)
             return dna_file_dest, aa_file_dest
 
     # Use temporary files as write handles when translating, so we can not pollute cache with incomplete files
@@ -196,6 +204,8 @@ def _extract_gene_and_protein(out_dir, project_id, genbank_file, ptt_file=None,
     # Move completed files to cache location only just now, so incomplete files do not pollute cache when raising errors
     shutil.move(dna_tmp, dna_file_dest)
     shutil.move(aa_tmp, aa_file_dest)
+    manifest.record_translation(genbank_file, dna_file_dest, aa_file_dest)
+    manifest.record_miss('translations', dna_file_dest, aa_file_dest)
 
     return dna_file_dest, aa_file_dest
 
@@ -311,7 +321,7 @@ def translate_fasta_coding_regions(nucl_fasta_file):
     """Translate an individual nucleotide fasta file containing coding regions to proteins using NCBI codon table 11."""
     # Determine output file name
     record_iter = SeqIO.parse(nucl_fasta_file, 'fasta')
-    genomeid = record_iter.next().id.split('|')[0]  # pylint: disable=E1101
+    genomeid = parse_header(record_iter.next().id).genome  # pylint: disable=E1101
     prot_fasta_file = tempfile.mkstemp(suffix='.faa', prefix=genomeid + '.')[1]
     with open(prot_fasta_file, mode='w') as write_handle:
         for nucl_seqrecord in SeqIO.parse(nucl_fasta_file, 'fasta', alphabet=ambiguous_dna):
@@ -377,7 +387,7 @@ Usage: translate.py
     create_archive_of_files(dna_zipfile, dna_files)
     create_archive_of_files(protein_zipfile, protein_files)
 
-    # Do not clean up extracted DNA files or Protein translations: Keep them as cache
+    # Do not clean up extracted DNA files or Protein translations: Keep them as cache, bounded by running cache_gc.py
 
     # But do clean up external_dir now that the compressed archives are created
     if external_zip:
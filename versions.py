@@ -8,6 +8,7 @@ import logging
 import os
 from subprocess import Popen, PIPE
 import sys
+import threading
 
 
 __author__ = "Tim te Beek"
@@ -82,6 +83,22 @@ def _grep_version(path, pattern='version'):
     return stdout.split('\n')[0]
 
 
+def aligner_version():
+    """Return the versions of TranslatorX and the muscle aligner it calls internally, used to key cached alignments.
+
+    Versions are determined once per process, rather than calling out to grep and muscle for each alignment."""
+    # Guard against concurrent alignment threads each determining the versions
+    with aligner_version.lock:
+        if aligner_version.version is None:
+            aligner_version.version = 'TranslatorX {0}; muscle {1}'.format(
+                _grep_version(TRANSLATORX, pattern='TranslatorX v')[28:-6], _call_program('muscle', '-version'))
+    return aligner_version.version
+
+# Assign versions lazily on first use, as most commands never look up cached alignments
+aligner_version.version = None
+aligner_version.lock = threading.Lock()
+
+
 def _parse_args():
     '''
     Parse required arguments.